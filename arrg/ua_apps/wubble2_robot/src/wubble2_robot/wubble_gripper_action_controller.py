@@ -31,8 +31,13 @@
 #
 
 import math
+import time
+from threading import Event
+from threading import Lock
 from threading import Thread
 
+import numpy as np
+
 import roslib; roslib.load_manifest('wubble2_robot')
 
 import rospy
@@ -49,10 +54,90 @@ from wubble2_robot.msg import WubbleGripperAction
 from wubble2_robot.msg import WubbleGripperGoal
 
 
+# torque control steps are sized for this many control iterations per second,
+# at other rates they are scaled so the grip tightens and loosens equally fast
+NOMINAL_CONTROL_RATE = 150.0
+
+# largest step scale, a long gap between samples shouldn't turn into a jump
+MAX_STEP_SCALE = 3.0
+
+
 def within_tolerance(a, b, tolerance):
     return abs(a - b) < tolerance
 
 
+class ChangePublisher():
+    """
+    Publishes a Float64 topic only when the value changed by more than
+    tolerance, at most max_rate times per second, and at least every
+    keepalive seconds so late subscribers still get it.
+    """
+    
+    def __init__(self, topic, max_rate, tolerance=0.0, keepalive=1.0):
+        self.pub = rospy.Publisher(topic, Float64)
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.tolerance = tolerance
+        self.keepalive = keepalive
+        self.last_value = None
+        self.last_time = 0.0
+
+
+    def publish(self, value, now):
+        elapsed = now - self.last_time
+        
+        if self.last_value is None or \
+           elapsed >= self.keepalive or \
+           (elapsed >= self.min_interval and abs(value - self.last_value) > self.tolerance):
+            self.pub.publish(value)
+            self.last_value = value
+            self.last_time = now
+
+
+class LoopStats():
+    """
+    Period jitter of the control loop and latency from the oldest pressure
+    sample a control decision used to the motor command it produced.
+    """
+    
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.iterations = 0
+        self.period_sum = 0.0
+        self.period_sq_sum = 0.0
+        self.period_max = 0.0
+        self.commands = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+
+    def add_period(self, period):
+        self.iterations += 1
+        self.period_sum += period
+        self.period_sq_sum += period * period
+        if period > self.period_max: self.period_max = period
+
+
+    def add_latency(self, latency):
+        self.commands += 1
+        self.latency_sum += latency
+        if latency > self.latency_max: self.latency_max = latency
+
+
+    def summary(self):
+        n = max(self.iterations, 1)
+        mean = self.period_sum / n
+        jitter = math.sqrt(max(self.period_sq_sum / n - mean * mean, 0.0))
+        latency = self.latency_sum / self.commands if self.commands else 0.0
+        
+        return 'control loop: %d iterations, period %.2f ms (jitter %.2f ms, max %.2f ms), ' \
+               'sample to command latency %.2f ms (max %.2f ms) over %d commands' % \
+               (self.iterations, mean * 1000, jitter * 1000, self.period_max * 1000,
+                latency * 1000, self.latency_max * 1000, self.commands)
+
+
 class GripperActionController():
     def __init__(self, controller_namespace, controllers):
         self.controller_namespace = controller_namespace
@@ -101,21 +186,44 @@ class GripperActionController():
         self.l_finger_ground_distance_pub = rospy.Publisher('left_finger_ground_distance', Float64)
         self.r_finger_ground_distance_pub = rospy.Publisher('right_finger_ground_distance', Float64)
         
+        # 'polled' runs torque control at a fixed 150Hz, 'event' runs it as
+        # pressure samples arrive, once every control_decimation samples
+        self.control_mode = rospy.get_param('~control_mode', 'event')
+        self.control_decimation = max(1, rospy.get_param('~control_decimation', 8))
+        self.stats_period = rospy.get_param('~stats_period', 10.0)
+        
+        if self.control_mode not in ('polled', 'event'):
+            rospy.logwarn('Unrecognized control mode %s, using polled' % self.control_mode)
+            self.control_mode = 'polled'
+            
         # Pressure sensors
         # 0-3 - left finger
         # 4-7 - right finger
         num_sensors = 8
-        self.pressure = [0.0] * num_sensors
-        [rospy.Subscriber('/interface_kit/124427/sensor/%d' % i, Float64Stamped, self.process_pressure_sensors, i) for i in range(num_sensors)]
+        self.pressure = np.zeros(num_sensors)
         
         # pressure sensors are at these values when no external pressure is applied
         self.l_zero_pressure = [0.0, 0.0, 0.0, 0.0]
         self.r_zero_pressure = [0.0, 0.0, 130.0, 0.0]
         self.lr_zero_pressure = self.l_zero_pressure + self.r_zero_pressure
+        self.finger_zero_pressure = np.array([sum(self.l_zero_pressure), sum(self.r_zero_pressure)])
+        
+        # samples that came in since the last control decision, and when the
+        # oldest of them arrived
+        self.sample_lock = Lock()
+        self.sample_event = Event()
+        self.pending_samples = 0
+        self.pending_since = None
+        self.stats = LoopStats()
         
-        self.l_total_pressure_pub = rospy.Publisher('left_finger_pressure', Float64)
-        self.r_total_pressure_pub = rospy.Publisher('right_finger_pressure', Float64)
-        self.lr_total_pressure_pub = rospy.Publisher('total_pressure', Float64)
+        # pressure topics are only published when they change, at most this often
+        publish_rate = rospy.get_param('~pressure_publish_rate', 50.0)
+        publish_tolerance = rospy.get_param('~pressure_publish_tolerance', 1.0)
+        self.l_total_pressure_pub = ChangePublisher('left_finger_pressure', publish_rate, publish_tolerance)
+        self.r_total_pressure_pub = ChangePublisher('right_finger_pressure', publish_rate, publish_tolerance)
+        self.lr_total_pressure_pub = ChangePublisher('total_pressure', publish_rate, publish_tolerance)
+        
+        [rospy.Subscriber('/interface_kit/124427/sensor/%d' % i, Float64Stamped, self.process_pressure_sensors, i) for i in range(num_sensors)]
         
         self.close_gripper = False
         self.dynamic_torque_control = False
@@ -128,7 +236,10 @@ class GripperActionController():
         rospy.Subscriber('/interface_kit/106950/sensor/7', Float64Stamped, self.process_ir_sensor)
         
         # Temperature monitor and torque control thread
-        Thread(target=self.gripper_monitor).start()
+        if self.control_mode == 'event':
+            Thread(target=self.gripper_event_monitor).start()
+        else:
+            Thread(target=self.gripper_monitor).start()
         
         # Start gripper opening monitoring thread
         Thread(target=self.calculate_gripper_opening).start()
@@ -168,34 +279,109 @@ class GripperActionController():
         return max(l_desired_torque, r_desired_torque)
 
 
+    def finger_pressures(self):
+        """
+        Total pressure on the left and right finger above their no-contact
+        readings, and the sum of both.
+        """
+        l_total_pressure, r_total_pressure = np.maximum(0.0, self.pressure.reshape(2, 4).sum(axis=1) - self.finger_zero_pressure)
+        return l_total_pressure, r_total_pressure, l_total_pressure + r_total_pressure
+
+
+    def publish_pressures(self, l_total_pressure, r_total_pressure, pressure):
+        now = time.time()
+        self.l_total_pressure_pub.publish(l_total_pressure, now)
+        self.r_total_pressure_pub.publish(r_total_pressure, now)
+        self.lr_total_pressure_pub.publish(pressure, now)
+
+
+    def monitor_temperature(self, motors_overheating):
+        """Disables torque when either motor gets too hot, returns whether they are."""
+        l_temp = max(self.l_finger_state.motor_temps)
+        r_temp = max(self.r_finger_state.motor_temps)
+        
+        if l_temp >= 75 or r_temp >= 75:
+            if not motors_overheating:
+                rospy.logwarn('Disabling gripper motors torque [LM: %dC, RM: %dC]' % (l_temp, r_temp))
+                self.__send_motor_command(-0.5, 0.5)
+            return True
+            
+        return False
+
+
+    def control_torque(self, pressure, step_scale=1.0, max_pressure=8000.0):
+        """
+        Moves the fingers to bring the pressure back between the lower and
+        upper limits, step_scale scales the step for the current control rate.
+        Returns True if a motor command was sent.
+        """
+        l_current = self.l_finger_state.goal_pos
+        r_current = self.r_finger_state.goal_pos
+        
+        if pressure > self.upper_pressure:   # release
+            pressure_change_step = step_scale * abs(pressure - self.upper_pressure) / max_pressure
+            l_goal = min( self.l_max_speed, l_current + pressure_change_step)
+            r_goal = max(-self.r_max_speed, r_current - pressure_change_step)
+            
+            if l_goal < self.l_max_speed or r_goal > -self.r_max_speed:
+                if self.close_gripper:
+                    self.__send_motor_command(l_goal, r_goal)
+                    rospy.logdebug('>MAX pressure is %.2f, LT: %.2f, RT: %.2f, step is %.2f' % (pressure, l_current, r_current, pressure_change_step))
+                    return True
+        elif pressure < self.lower_pressure: # squeeze
+            pressure_change_step = step_scale * abs(pressure - self.lower_pressure) / max_pressure
+            l_goal = max(-self.l_max_speed, l_current - pressure_change_step)
+            r_goal = min( self.r_max_speed, r_current + pressure_change_step)
+            
+            if l_goal > -self.l_max_speed or r_goal < self.r_max_speed:
+                if self.close_gripper:
+                    self.__send_motor_command(l_goal, r_goal)
+                    rospy.logdebug('<MIN pressure is %.2f, LT: %.2f, RT: %.2f, step is %.2f' % (pressure, l_current, r_current, pressure_change_step))
+                    return True
+                    
+        return False
+
+
+    def take_pending_samples(self):
+        """Clears the pending sample count, returns when the oldest one arrived."""
+        with self.sample_lock:
+            since = self.pending_since
+            self.pending_samples = 0
+            self.pending_since = None
+            self.sample_event.clear()
+            
+        return since
+
+
+    def report_stats(self, last_report):
+        now = time.time()
+        
+        if self.stats_period > 0 and now - last_report >= self.stats_period:
+            rospy.loginfo('%s (%s mode)' % (self.stats.summary(), self.control_mode))
+            self.stats.reset()
+            return now
+            
+        return last_report
+
+
     def gripper_monitor(self):
         rospy.loginfo('Gripper temperature monitor and torque control thread started successfully')
         motors_overheating = False
-        max_pressure = 8000.0
-        r = rospy.Rate(150)
+        r = rospy.Rate(NOMINAL_CONTROL_RATE)
+        last_iteration = time.time()
+        last_report = last_iteration
         
         while not rospy.is_shutdown():
-            l_total_pressure = max(0.0, sum(self.pressure[:4]) - sum(self.l_zero_pressure))
-            r_total_pressure = max(0.0, sum(self.pressure[4:]) - sum(self.r_zero_pressure))
-            pressure = l_total_pressure + r_total_pressure
+            now = time.time()
+            self.stats.add_period(now - last_iteration)
+            last_iteration = now
+            sample_time = self.take_pending_samples()
             
-            self.l_total_pressure_pub.publish(l_total_pressure)
-            self.r_total_pressure_pub.publish(r_total_pressure)
-            self.lr_total_pressure_pub.publish(pressure)
+            l_total_pressure, r_total_pressure, pressure = self.finger_pressures()
+            self.publish_pressures(l_total_pressure, r_total_pressure, pressure)
             
-            #----------------------- TEMPERATURE MONITOR ---------------------------#
-            l_temp = max(self.l_finger_state.motor_temps)
-            r_temp = max(self.r_finger_state.motor_temps)
-            
-            if l_temp >= 75 or r_temp >= 75:
-                if not motors_overheating:
-                    rospy.logwarn('Disabling gripper motors torque [LM: %dC, RM: %dC]' % (l_temp, r_temp))
-                    self.__send_motor_command(-0.5, 0.5)
-                    motors_overheating = True
-            else:
-                motors_overheating = False
-                
-            #########################################################################
+            motors_overheating = self.monitor_temperature(motors_overheating)
+            last_report = self.report_stats(last_report)
             
             # don't do torque control if not requested or
             # when the gripper is open
@@ -206,31 +392,50 @@ class GripperActionController():
                 r.sleep()
                 continue
                 
-            #----------------------- TORQUE CONTROL -------------------------------#
-            l_current = self.l_finger_state.goal_pos
-            r_current = self.r_finger_state.goal_pos
-            
-            if pressure > self.upper_pressure:   # release
-                pressure_change_step = abs(pressure - self.upper_pressure) / max_pressure
-                l_goal = min( self.l_max_speed, l_current + pressure_change_step)
-                r_goal = max(-self.r_max_speed, r_current - pressure_change_step)
+            if self.control_torque(pressure) and sample_time is not None:
+                self.stats.add_latency(time.time() - sample_time)
+                
+            r.sleep()
+
+
+    def gripper_event_monitor(self):
+        """
+        Torque control driven by the pressure sensors: runs as soon as
+        control_decimation new samples are in. The temperature is still
+        checked at least every 0.1 seconds when no samples arrive.
+        """
+        rospy.loginfo('Gripper temperature monitor and event driven torque control thread started successfully')
+        motors_overheating = False
+        last_iteration = time.time()
+        last_report = last_iteration
+        
+        while not rospy.is_shutdown():
+            if not self.sample_event.wait(0.1):
+                motors_overheating = self.monitor_temperature(motors_overheating)
+                last_report = self.report_stats(last_report)
+                continue
                 
-                if l_goal < self.l_max_speed or r_goal > -self.r_max_speed:
-                    if self.close_gripper:
-                        self.__send_motor_command(l_goal, r_goal)
-                        rospy.logdebug('>MAX pressure is %.2f, LT: %.2f, RT: %.2f, step is %.2f' % (pressure, l_current, r_current, pressure_change_step))
-            elif pressure < self.lower_pressure: # squeeze
-                pressure_change_step = abs(pressure - self.lower_pressure) / max_pressure
-                l_goal = max(-self.l_max_speed, l_current - pressure_change_step)
-                r_goal = min( self.r_max_speed, r_current + pressure_change_step)
+            now = time.time()
+            period = now - last_iteration
+            self.stats.add_period(period)
+            last_iteration = now
+            sample_time = self.take_pending_samples()
+            
+            l_total_pressure, r_total_pressure, pressure = self.finger_pressures()
+            self.publish_pressures(l_total_pressure, r_total_pressure, pressure)
+            
+            motors_overheating = self.monitor_temperature(motors_overheating)
+            last_report = self.report_stats(last_report)
+            
+            if not self.dynamic_torque_control or \
+               not self.close_gripper or \
+               motors_overheating:
+                continue
                 
-                if l_goal > -self.l_max_speed or r_goal < self.r_max_speed:
-                    if self.close_gripper:
-                        self.__send_motor_command(l_goal, r_goal)
-                        rospy.logdebug('<MIN pressure is %.2f, LT: %.2f, RT: %.2f, step is %.2f' % (pressure, l_current, r_current, pressure_change_step))
-            ########################################################################
+            step_scale = min(period * NOMINAL_CONTROL_RATE, MAX_STEP_SCALE)
             
-            r.sleep()
+            if self.control_torque(pressure, step_scale) and sample_time is not None:
+                self.stats.add_latency(time.time() - sample_time)
 
 
     def calculate_gripper_opening(self):
@@ -277,6 +482,13 @@ class GripperActionController():
 
     def process_pressure_sensors(self, msg, i):
         self.pressure[i] = msg.data
+        
+        with self.sample_lock:
+            if self.pending_since is None: self.pending_since = time.time()
+            self.pending_samples += 1
+            
+            if self.pending_samples >= self.control_decimation:
+                self.sample_event.set()
 
 
     def process_ir_sensor(self, msg):
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+"""
+Replays a byte stream recorded from the CHR-6dm through the per-byte reader
+that used to live in CHR6dmIMU.read_accel_angrate_orientation and through
+PacketDecoder, checks that both decode the same values and reports
+packets/sec for each.
+
+usage: benchmark_decoder.py [-f replay_file] [-n num_packets] [-r read_size]
+
+The replay file is a capture log (see chr_6dm_log), the bytes read from the
+port during the capture are replayed. Without one, num_packets SENSOR_DATA packets with the channels chr_6dm_node enables
+are synthesized, with some line noise in between. read_size is the most
+PacketDecoder gets per read, the per-byte reader always reads one byte.
+"""
+
+import sys
+import time
+import getopt
+import struct
+import random
+from binascii import b2a_hex
+
+from chr_6dm_const import *
+from chr_6dm_io import SENSOR_CHANNELS
+from chr_6dm_io import PacketDecoder
+from chr_6dm_io import decode_sensor_data
+from chr_6dm_log import read_chunks
+
+
+class ReplayPort(object):
+    """ Just enough of serial.Serial to read a recorded stream. """
+
+    def __init__(self, dataStr, read_size):
+        self.dataStr = dataStr
+        self.read_size = read_size
+        self.pos = 0
+
+    def inWaiting(self):
+        return min(self.read_size, len(self.dataStr) - self.pos)
+
+    def read(self, size=1):
+        dataStr = self.dataStr[self.pos:self.pos+size]
+        self.pos += len(dataStr)
+        return dataStr
+
+    def done(self):
+        return self.pos >= len(self.dataStr)
+
+
+def make_packet(command, dataStr):
+    chkSum = sum(map(ord, 'snp')) + command + len(dataStr) + sum(map(ord, dataStr))
+    return 'snp' + chr(command) + chr(len(dataStr)) + dataStr + struct.pack('>H', chkSum)
+
+
+def synthesize(num_packets, active_channels=0xFC0E):
+    num_channels = len([ch for ch in SENSOR_CHANNELS if active_channels & ch[0]])
+    chunks = []
+    
+    for i in range(num_packets):
+        values = [random.randint(-32768, 32767) for ch in range(num_channels)]
+        chunks.append(make_packet(SENSOR_DATA, struct.pack('>H%dh' % num_channels, active_channels, *values)))
+        
+        # occasional garbage between packets, sometimes with a stray 's'
+        if random.random() < 0.01:
+            chunks.append(''.join(chr(random.choice([ord('s'), random.randint(0, 255)])) for b in range(random.randint(1, 8))))
+            
+    return ''.join(chunks)
+
+
+def legacy_read(ser):
+    """ The reader CHR6dmIMU used before PacketDecoder, one read() per byte. """
+    # look for packet prefix 'snp'
+    while ser.read() != 's':
+        if ser.done(): return None
+    packet = 's' + ser.read(2) # read 'n' and 'p'
+    
+    if packet != 'snp':
+        return {}
+        
+    command = ord(ser.read())
+    n = ord(ser.read())
+    
+    dataStr = ser.read(n)
+    data = map(b2a_hex, dataStr)
+    data = map(int, data, [16] * len(data))
+    
+    chkSumStr = ser.read(2)
+    chkSumData = map(b2a_hex, chkSumStr)
+    chkSumData = map(int, chkSumData, [16] * len(chkSumData))
+    chkSumRx = (chkSumData[0] << 8) | chkSumData[1]
+    
+    chkSum = reduce(int.__add__, map(ord, ['s', 'n', 'p']), 0)
+    chkSum = chkSum + command + len(data) + reduce(int.__add__, data, 0)
+    
+    if chkSumRx != chkSum:
+        return {}
+        
+    res = {}
+    
+    if command == SENSOR_DATA:
+        active_channels = (data[0] << 8) | data[1]
+        i = 2
+        
+        for mask, name, scale, unit in SENSOR_CHANNELS:
+            if active_channels & mask:
+                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
+                res[name] = value[0] * scale * unit
+                i += 2
+                
+    return res
+
+
+def run_legacy(stream):
+    ser = ReplayPort(stream, 1)
+    result = []
+    
+    while not ser.done():
+        res = legacy_read(ser)
+        if res: result.append(res)
+        
+    return result
+
+
+def run_decoder(stream, read_size):
+    ser = ReplayPort(stream, read_size)
+    decoder = PacketDecoder()
+    result = []
+    
+    while not ser.done():
+        decoder.feed(ser.read(max(1, ser.inWaiting())))
+        
+        payloads = [dataStr for command, dataStr in decoder.packets() if command == SENSOR_DATA]
+        result.extend(decode_sensor_data(payloads))
+                
+    return result
+
+
+def report(name, num_packets, seconds):
+    print '%-14s %8d packets in %6.3f sec, %10.1f packets/sec' % (name, num_packets, seconds, num_packets / seconds)
+
+
+if __name__ == '__main__':
+    replay_file = None
+    num_packets = 30000
+    read_size = 64
+    
+    opts, args = getopt.getopt(sys.argv[1:], 'f:n:r:')
+    for opt, arg in opts:
+        if opt == '-f': replay_file = arg
+        elif opt == '-n': num_packets = int(arg)
+        elif opt == '-r': read_size = int(arg)
+        
+    if replay_file:
+        stream = ''.join(dataStr for timestamp, dataStr in read_chunks(replay_file))
+        print 'Replaying %d bytes from %s' % (len(stream), replay_file)
+    else:
+        random.seed(0)
+        stream = synthesize(num_packets)
+        print 'Replaying %d synthesized packets (%d bytes)' % (num_packets, len(stream))
+        
+    start = time.time()
+    legacy = run_legacy(stream)
+    report('per-byte read', len(legacy), time.time() - start)
+    
+    start = time.time()
+    decoded = run_decoder(stream, read_size)
+    report('PacketDecoder', len(decoded), time.time() - start)
+    
+    # the per-byte reader loses the packet after a stray 's', PacketDecoder
+    # resyncs, so everything the former got must show up in the latter
+    remaining = iter(decoded)
+    same = all(any(a == b for b in remaining) for a in legacy)
+    print 'decoded values identical: %s (%d packets only found by PacketDecoder)' % (same, len(decoded) - len(legacy))
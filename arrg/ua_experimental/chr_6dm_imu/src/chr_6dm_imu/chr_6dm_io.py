@@ -38,28 +38,219 @@ import time
 import serial
 import struct
 from math import sqrt
-from binascii import b2a_hex
+from collections import deque
+
+import numpy as np
 
 from chr_6dm_const import *
+from chr_6dm_log import CaptureLog
+from chr_6dm_log import CaptureSerial
+from chr_6dm_log import ReplaySerial
 
 DEG_TO_RAD = 0.017453293    # degrees to radians
 MILIG_TO_MSS = 0.00980665   # mili g to m/s^2
 
 MAX_BYTES_SKIPPED = 1000
 
+REPLAY_PREFIX = 'replay://'
+
+# decoded sensor data packets kept around for read_accel_angrate_orientation,
+# one second worth at the highest broadcast rate
+SENSOR_QUEUE_SIZE = 300
+
+PACKET_PREFIX = 'snp'
+PREFIX_CHECKSUM = sum(map(ord, PACKET_PREFIX))
+
+# packet: s  n  p  INSTRUCTION  LENGTH  DATA  CHECKSUM
+# bytes:  1  1  1       1          1     N       2
+HEADER_SIZE = 5
+CHECKSUM_SIZE = 2
+
+# SENSOR_DATA channels in the order they appear in the packet:
+# (active channel bit, imu_data key, scale factor, unit conversion)
+SENSOR_CHANNELS = (
+    (0x8000, 'yaw',        SCALE_YAW,        DEG_TO_RAD),
+    (0x4000, 'pitch',      SCALE_PITCH,      DEG_TO_RAD),
+    (0x2000, 'roll',       SCALE_ROLL,       DEG_TO_RAD),
+    (0x1000, 'yaw_rate',   SCALE_YAW_RATE,   DEG_TO_RAD),
+    (0x0800, 'pitch_rate', SCALE_PITCH_RATE, DEG_TO_RAD),
+    (0x0400, 'roll_rate',  SCALE_ROLL_RATE,  DEG_TO_RAD),
+    (0x0200, 'mag_x',      SCALE_MAG_X,      1.0),
+    (0x0100, 'mag_y',      SCALE_MAG_Y,      1.0),
+    (0x0080, 'mag_z',      SCALE_MAG_Z,      1.0),
+    (0x0040, 'gyro_x',     SCALE_GYRO_X,     DEG_TO_RAD),
+    (0x0020, 'gyro_y',     SCALE_GYRO_Y,     DEG_TO_RAD),
+    (0x0010, 'gyro_z',     SCALE_GYRO_Z,     DEG_TO_RAD),
+    (0x0008, 'accel_x',    SCALE_ACCEL_X,    MILIG_TO_MSS),
+    (0x0004, 'accel_y',    SCALE_ACCEL_Y,    MILIG_TO_MSS),
+    (0x0002, 'accel_z',    SCALE_ACCEL_Z,    MILIG_TO_MSS),
+)
+
+
+class SensorLayout(object):
+    """ Layout of a SENSOR_DATA packet for one set of active channels. """
+
+    def __init__(self, active_channels):
+        channels = [ch for ch in SENSOR_CHANNELS if active_channels & ch[0]]
+        
+        self.names = [ch[1] for ch in channels]
+        self.scales = np.array([ch[2] for ch in channels])
+        self.units = np.array([ch[3] for ch in channels])
+        
+        # 2 bytes of active channel flags followed by one signed short per channel
+        self.struct = struct.Struct('>H%dh' % len(channels))
+
+    def decode(self, payloads):
+        """ Decodes data fields of SENSOR_DATA packets, one dictionary per packet. """
+        unpack = self.struct.unpack_from
+        raw = np.array([unpack(dataStr) for dataStr in payloads], dtype=np.float64)
+        
+        # scale first and convert units second, same rounding as one channel at a time
+        values = raw[:,1:] * self.scales * self.units
+        names = self.names
+        
+        return [dict(zip(names, row)) for row in values.tolist()]
+
+
+SENSOR_LAYOUTS = {}
+
+def sensor_layout(active_channels):
+    """ Cached SensorLayout for a channel mask, the mask rarely changes. """
+    layout = SENSOR_LAYOUTS.get(active_channels)
+    
+    if layout is None:
+        layout = SENSOR_LAYOUTS[active_channels] = SensorLayout(active_channels)
+        
+    return layout
+
+def decode_sensor_data(payloads):
+    """
+    Decodes the data fields of SENSOR_DATA packets into dictionaries with one
+    entry per active channel, None for packets too short for their channels.
+    Packets with the same active channels are decoded together.
+    """
+    result = [None] * len(payloads)
+    groups = {}
+    
+    for idx, dataStr in enumerate(payloads):
+        if len(dataStr) < 2: continue
+        
+        layout = sensor_layout((ord(dataStr[0]) << 8) | ord(dataStr[1]))
+        if len(dataStr) < layout.struct.size: continue
+        
+        groups.setdefault(layout, []).append(idx)
+        
+    for layout, inds in groups.items():
+        for idx, values in zip(inds, layout.decode([payloads[i] for i in inds])):
+            result[idx] = values
+            
+    return result
+
+
+class PacketDecoder(object):
+    """
+    Splits the byte stream coming from the IMU into packets. Bytes are
+    appended to a buffer as they arrive, packets are located by searching the
+    buffer for the 'snp' prefix and bytes in front of a prefix or in packets
+    with bad checksums are dropped.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.skipped_bytes = 0
+        self.bad_checksums = 0
+
+    def clear(self):
+        del self.buf[:]
+
+    def feed(self, dataStr):
+        self.buf.extend(dataStr)
+
+    def packets(self):
+        """ Removes all complete packets from the buffer, returns (command, data) pairs. """
+        buf = self.buf
+        size = len(buf)
+        result = []
+        pos = 0
+        
+        while True:
+            start = buf.find(PACKET_PREFIX, pos)
+            
+            if start < 0:
+                # keep what could be the beginning of a prefix
+                keep = max(pos, size - len(PACKET_PREFIX) + 1)
+                while keep < size and not PACKET_PREFIX.startswith(str(buf[keep:])): keep += 1
+                self.skipped_bytes += keep - pos
+                pos = keep
+                break
+                
+            self.skipped_bytes += start - pos
+            pos = start
+            
+            if size < start + HEADER_SIZE: break
+            
+            command = buf[start+3]
+            n = buf[start+4]
+            end = start + HEADER_SIZE + n + CHECKSUM_SIZE
+            
+            if size < end: break
+            
+            data_end = end - CHECKSUM_SIZE
+            chkSumRx = (buf[data_end] << 8) | buf[data_end+1]
+            chkSum = PREFIX_CHECKSUM + command + n + sum(buf[start+HEADER_SIZE:data_end])
+            
+            if chkSumRx != chkSum:
+                # could have been a stray 's' inside another packet, resync right after it
+                self.bad_checksums += 1
+                self.skipped_bytes += 1
+                pos = start + 1
+                continue
+                
+            result.append((command, str(buf[start+HEADER_SIZE:data_end])))
+            pos = end
+            
+        del buf[:pos]
+        return result
+
+
+def open_port(port):
+    """ serial.Serial for a device, ReplaySerial for a replay:// port. """
+    if not port.startswith(REPLAY_PREFIX):
+        return serial.Serial(port)
+        
+    path, _, query = port[len(REPLAY_PREFIX):].partition('?')
+    speed = 1.0
+    
+    for option in filter(None, query.split('&')):
+        name, _, value = option.partition('=')
+        if name == 'speed':
+            speed = None if value == 'max' else float(value)
+            
+    return ReplaySerial(path, speed)
+
+
 class CHR6dmIMU(object):
     """ Provides low level IO with the CHR-6dm IMU through pyserial. """
 
-    def __init__(self, port='/dev/ttyUSB0'):
-        """ Constructor takes serial port as argument. """
+    def __init__(self, port='/dev/ttyUSB0', capture_file=None):
+        """
+        Constructor takes serial port as argument. A port of the form
+        replay://<capture log>[?speed=<factor>|max] plays back a recording
+        instead, with capture_file everything exchanged with the port is
+        recorded.
+        """
         self.ser = None
-        self.ser = serial.Serial(port)
+        self.ser = open_port(port)
         self.ser.timeout = 0.015
         self.ser.baudrate = 115200
         self.ser.bytesize = serial.EIGHTBITS
         self.ser.stopbits = serial.STOPBITS_ONE
         self.ser.parity = serial.PARITY_NONE
         
+        if capture_file:
+            self.ser = CaptureSerial(self.ser, CaptureLog(capture_file))
+            print "Capturing IMU data to %s" % capture_file
+            
         print "Connected to IMU on %s" % port
         
         # IMU state variables
@@ -101,6 +292,9 @@ class CHR6dmIMU(object):
         self.accel_covariance = 0.0
         self.mag_covariance = 0.0
         self.process_covariance = 0.0
+        
+        self.decoder = PacketDecoder()
+        self.sensor_data = deque(maxlen=SENSOR_QUEUE_SIZE)
 
     def __del__(self):
         """ Destructor calls self.close_serial_port() """
@@ -113,6 +307,11 @@ class CHR6dmIMU(object):
 
     def write_to_imu(self, command, data=tuple()):
         self.ser.flushInput()
+        self.decoder.clear()
+        
+        # samples queued before the command are stale once its reply arrives,
+        # only what comes with or after the reply is handed out
+        self.sensor_data.clear()
         
         chkSum = self.calculate_checksum(command, data)
         dataStr = ''.join(map(chr, data))
@@ -129,43 +328,56 @@ class CHR6dmIMU(object):
         
         self.read_from_imu()
 
+    def read_packets(self):
+        """
+        Reads whatever the port has buffered (blocking for at most one timeout
+        if there is nothing) and handles every complete packet in it. Returns
+        the number of bytes read and the number of packets handled.
+        """
+        dataStr = self.ser.read(max(1, self.ser.inWaiting()))
+        if not dataStr: return 0, 0
+        
+        timestamp = time.time()
+        self.decoder.feed(dataStr)
+        packets = self.decoder.packets()
+        
+        # all sensor data that arrived with this read is decoded in one go
+        sensor_payloads = [payload for command, payload in packets if command == SENSOR_DATA]
+        sensor_values = iter(decode_sensor_data(sensor_payloads))
+        
+        for command, payload in packets:
+            if command == SENSOR_DATA:
+                self.process_sensor_data(payload, sensor_values.next(), timestamp)
+            else:
+                self.process_packet(command, payload)
+                
+        return len(dataStr), len(packets)
+
     def read_from_imu(self):
-        # look for packet prefix 'snp'
+        """ Reads from the port until at least one complete packet was handled. """
         skipped_bytes = 0
         
         while skipped_bytes < MAX_BYTES_SKIPPED:
-            if self.ser.read() != 's': skipped_bytes += 1
-            else: break
+            num_bytes, num_packets = self.read_packets()
+            if num_packets: return
+            skipped_bytes += num_bytes or 1
         else:
             print 'Unable to find packet prefix. Throw exception.'
+
+    def process_sensor_data(self, dataStr, values, timestamp):
+        if values is None:
+            print "Sensor data packet too short for active channels %s" % hex(struct.unpack_from('>H', dataStr.ljust(2, '\0'))[0]).upper()
             return
             
-        packet = 's' + self.ser.read(2) # read 'n' and 'p'
-        
-        if packet != 'snp':
-            print "Received corrupted packet, prefix was %s" % packet
-            return
-            
-        command = ord(self.ser.read())
-        n = ord(self.ser.read())
-        
-        dataStr = self.ser.read(n)
-        data = map(b2a_hex, dataStr)
-        data = map(int, data, [16] * len(data))
-        
-        # print "Received reply: %s (%s), data: %s" % (CODE_TO_STR[command], hex(command).upper(), str(data))
-        
-        chkSumStr = self.ser.read(2)
-        chkSumData = map(b2a_hex, chkSumStr)
-        chkSumData = map(int, chkSumData, [16] * len(chkSumData))
-        chkSumRx = (chkSumData[0] << 8) | chkSumData[1]
+        values['timestamp'] = timestamp
+        self.imu_data.update(values)
+        self.sensor_data.append(values)
+
+    def process_packet(self, command, dataStr):
+        data = bytearray(dataStr)
         
-        chkSum = self.calculate_checksum(command, data)
+        # print "Received reply: %s (%s), data: %s" % (CODE_TO_STR[command], hex(command).upper(), str(list(data)))
         
-        if chkSumRx != chkSum:
-            print "Checksums don't match %d != %d" % (chkSumRx, chkSum)
-            return
-            
         if command == COMMAND_COMPLETE:
             print 'Command %s (%s) complete' % (CODE_TO_STR[data[0]], hex(data[0]).upper())
         elif command == COMMAND_FAILED:
@@ -193,115 +405,7 @@ class CHR6dmIMU(object):
             if data[0] & 0x01:
                 print 'FAILED self-test: accel_x'
         elif command == SENSOR_DATA:
-            self.imu_data['timestamp'] = time.time()
-            active_channels = (data[0] << 8) | data[1]
-            
-            i = 2
-            
-            # yaw angle
-            if active_channels & 0x8000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['yaw'] = value[0] * SCALE_YAW * DEG_TO_RAD
-                #print 'yaw = %f' % self.imu_data['yaw']
-                i += 2
-                
-            # pitch angle
-            if active_channels & 0x4000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['pitch'] = value[0] * SCALE_PITCH * DEG_TO_RAD
-                #print 'pitch = %f' % self.imu_data['pitch']
-                i += 2
-                
-            # roll angle
-            if active_channels & 0x2000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['roll'] = value[0] * SCALE_ROLL * DEG_TO_RAD
-                #print 'roll = %f' % self.imu_data['roll']
-                i += 2
-                
-            # yaw rate
-            if active_channels & 0x1000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['yaw_rate'] = value[0] * SCALE_YAW_RATE * DEG_TO_RAD
-                #print 'yaw_rate = %f' % self.imu_data['yaw_rate']
-                i += 2
-                
-            # pitch rate
-            if active_channels & 0x0800:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['pitch_rate'] = value[0] * SCALE_PITCH_RATE * DEG_TO_RAD
-                #print 'pitch_rate = %f' % self.imu_data['pitch_rate']
-                i += 2
-                
-            # roll rate
-            if active_channels & 0x0400:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['roll_rate'] = value[0] * SCALE_ROLL_RATE * DEG_TO_RAD
-                #print 'roll_rate = %f' % self.imu_data['roll_rate']
-                i += 2
-                
-            # mag X
-            if active_channels & 0x0200:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['mag_x'] = value[0] * SCALE_MAG_X
-                #print 'mx = %f' % self.imu_data['mag_x']
-                i += 2
-                
-            # mag Y
-            if active_channels & 0x0100:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['mag_y'] = value[0] * SCALE_MAG_Y
-                #print 'my = %f' % self.imu_data['mag_y']
-                i += 2
-                
-            # mag Z
-            if active_channels & 0x0080:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['mag_z'] = value[0] * SCALE_MAG_Z
-                #print 'mz = %f' % self.imu_data['mag_z']
-                i += 2
-                
-            # gyro X
-            if active_channels & 0x0040:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['gyro_x'] = value[0] * SCALE_GYRO_X * DEG_TO_RAD
-                #print 'gx = %f' % self.imu_data['gyro_x']
-                i += 2
-                
-            # gyro Y
-            if active_channels & 0x0020:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['gyro_y'] = value[0] * SCALE_GYRO_Y * DEG_TO_RAD
-                #print 'gy = %f' % self.imu_data['gyro_y']
-                i += 2
-                
-            # gyro Z
-            if active_channels & 0x0010:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['gyro_z'] = value[0] * SCALE_GYRO_Z * DEG_TO_RAD
-                #print 'gz = %f' % self.imu_data['gyro_z']
-                i += 2
-                
-            # accel X
-            if active_channels & 0x0008:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['accel_x'] = value[0] * SCALE_ACCEL_X * MILIG_TO_MSS
-                #print 'ax = %f' % self.imu_data['accel_x']
-                i += 2
-                
-            # accel Y
-            if active_channels & 0x0004:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['accel_y'] = value[0] * SCALE_ACCEL_Y * MILIG_TO_MSS
-                #print 'ay = %f' % self.imu_data['accel_y']
-                i += 2
-                
-            # accel Z
-            if active_channels & 0x0002:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                self.imu_data['accel_z'] = value[0] * SCALE_ACCEL_Z * MILIG_TO_MSS
-                #print 'az = %f' % self.imu_data['accel_z']
-                i += 2
+            self.process_sensor_data(dataStr, decode_sensor_data([dataStr])[0], time.time())
         elif command == GYRO_BIAS_REPORT:
             value = struct.unpack('>h', dataStr[0] + dataStr[1])
             gyro_z_bias = value[0] * SCALE_GYRO_Z * DEG_TO_RAD
@@ -914,119 +1018,18 @@ class CHR6dmIMU(object):
         self.set_active_channels(ch)
 
     def read_accel_angrate_orientation(self):
-        # look for packet prefix 'snp'
-        while self.ser.read() != 's':
-            print "looking for packet prefix 'snp'"
-        packet = 's' + self.ser.read(2) # read 'n' and 'p'
-        
-        if packet != 'snp':
-            print "Received corrupted packet, prefix was %s" % packet
-            return
-
-        command = ord(self.ser.read())
-        #print "packet type = %s" % hex(command).upper()
-
-        n = ord(self.ser.read())
-        #print "data bytes = %d" % n
-
-        dataStr = self.ser.read(n)
-        data = map(b2a_hex, dataStr)
-        data = map(int, data, [16] * len(data))
-        #print data
-
-        chkSumStr = self.ser.read(2)
-        chkSumData = map(b2a_hex, chkSumStr)
-        chkSumData = map(int, chkSumData, [16] * len(chkSumData))
-        chkSumRx = (chkSumData[0] << 8) | chkSumData[1]
-
-        chkSum = self.calculate_checksum(command, data)
-        
-        if chkSumRx != chkSum:
-            print "Checksums don't match %d != %d" % (chkSumRx, chkSum)
-            return
-
-        res = {}
-
-        if command == SENSOR_DATA:
-            res['timestamp'] = time.time()
-            active_channels = (data[0] << 8) | data[1]
-            
-            i = 2
-            
-            # yaw angle
-            if active_channels & 0x8000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                yaw = value[0] * SCALE_YAW * DEG_TO_RAD
-                #print 'yaw = %f' % yaw
-                res['yaw'] = yaw
-                i += 2
-            
-            # pitch angle
-            if active_channels & 0x4000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                pitch = value[0] * SCALE_PITCH * DEG_TO_RAD
-                #print 'pitch = %f' % pitch
-                res['pitch'] = pitch
-                i += 2
-            
-            # roll angle
-            if active_channels & 0x2000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                roll = value[0] * SCALE_ROLL * DEG_TO_RAD
-                #print 'roll = %f' % roll
-                res['roll'] = roll
-                i += 2
-            
-            # yaw rate
-            if active_channels & 0x1000:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                yaw_rate = value[0] * SCALE_YAW_RATE * DEG_TO_RAD
-                #print 'yaw_rate = %f' % yaw_rate
-                res['yaw_rate'] = yaw_rate
-                i += 2
-            
-            # pitch rate
-            if active_channels & 0x0800:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                pitch_rate = value[0] * SCALE_PITCH_RATE * DEG_TO_RAD
-                #print 'pitch_rate = %f' % pitch_rate
-                res['pitch_rate'] = pitch_rate
-                i += 2
-            
-            # roll rate
-            if active_channels & 0x0400:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                roll_rate = value[0] * SCALE_ROLL_RATE * DEG_TO_RAD
-                #print 'roll_rate = %f' % roll_rate
-                res['roll_rate'] = roll_rate
-                i += 2
-
-            # accel X
-            if active_channels & 0x0008:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                ax = value[0] * SCALE_ACCEL_X * MILIG_TO_MSS
-                #print 'ax = %f' % ax
-                res['accel_x'] = ax
-                i += 2
+        """
+        Returns the oldest sensor data packet received since the last command
+        that was not returned yet, reading from the port if there is none. Returns
+        an empty dictionary if no sensor data arrived within the timeout.
+        """
+        if not self.sensor_data:
+            self.read_packets()
             
-            # accel Y
-            if active_channels & 0x0004:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                ay = value[0] * SCALE_ACCEL_Y * MILIG_TO_MSS
-                #print 'ay = %f' % ay
-                res['accel_y'] = ay
-                i += 2
+        if self.sensor_data:
+            return self.sensor_data.popleft()
             
-            # accel Z
-            if active_channels & 0x0002:
-                value = struct.unpack('>h', dataStr[i] + dataStr[i+1])
-                az = value[0] * SCALE_ACCEL_Z * MILIG_TO_MSS
-                #print 'az = %f' % az
-                res['accel_z'] = az
-                i += 2
-                
-        return res
-
+        return {}
 if __name__ == "__main__":
     sio = CHR6dmIMU()
     sio.set_silent_mode()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+#
+
+"""
+Capture and replay of the raw byte stream exchanged with the CHR-6dm.
+
+A capture log starts with an 8 byte magic followed by one record per chunk
+of bytes read from or written to the port: a header (timestamp, direction,
+length) and the bytes themselves. <log>.idx holds the same headers plus
+the record offsets as a flat array, so a replay loads it with one read and
+never has to walk the log. The index is rebuilt from the log if it is
+missing or does not cover the whole log, e.g. after a crash.
+"""
+
+import os
+import time
+import mmap
+import struct
+
+import numpy as np
+
+
+LOG_MAGIC = 'CHR6DLOG'
+
+# direction of a chunk
+READ = 0
+WRITE = 1
+
+# timestamp (sec), direction, number of bytes
+RECORD_HEADER = struct.Struct('<dBI')
+
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('direction', 'u1'), ('length', '<u4'), ('offset', '<u8')])
+
+
+def index_file(path):
+    return path + '.idx'
+
+
+class CaptureLog(object):
+    """ Appends chunks to a capture log and its index. """
+
+    def __init__(self, path):
+        self.path = path
+        self.log = open(path, 'ab')
+        self.log.seek(0, os.SEEK_END)
+        
+        if self.log.tell() == 0:
+            self.log.write(LOG_MAGIC)
+        else:
+            # drop a record cut short by a crash so new ones line up behind the rest
+            index = load_index(path)
+            end = index['offset'][-1] + index['length'][-1] if len(index) else len(LOG_MAGIC)
+            self.log.truncate(int(end))
+            self.log.seek(0, os.SEEK_END)
+            
+        self.index = open(index_file(path), 'ab')
+
+    def append(self, direction, dataStr, timestamp=None):
+        if timestamp is None: timestamp = time.time()
+        
+        entry = np.zeros(1, dtype=INDEX_DTYPE)
+        entry[0] = (timestamp, direction, len(dataStr), self.log.tell() + RECORD_HEADER.size)
+        
+        self.log.write(RECORD_HEADER.pack(timestamp, direction, len(dataStr)))
+        self.log.write(dataStr)
+        self.index.write(entry.tostring())
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+
+class CaptureSerial(object):
+    """
+    Wraps an open serial port and records every chunk read from or written
+    to it, everything besides read and write goes straight to the port.
+    """
+
+    def __init__(self, ser, log):
+        self.__dict__['ser'] = ser
+        self.__dict__['capture'] = log
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.ser, name, value)
+
+    def read(self, size=1):
+        dataStr = self.ser.read(size)
+        if dataStr: self.capture.append(READ, dataStr)
+        return dataStr
+
+    def write(self, dataStr):
+        self.capture.append(WRITE, dataStr)
+        return self.ser.write(dataStr)
+
+    def close(self):
+        self.ser.close()
+        self.capture.close()
+
+
+def rebuild_index(path):
+    """ Walks the log and writes a new index for every complete record in it. """
+    f = open(path, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    entries = []
+    
+    if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+        f.close()
+        raise IOError('%s is not a CHR-6dm capture log' % path)
+        
+    offset = len(LOG_MAGIC)
+    
+    while offset + RECORD_HEADER.size <= size:
+        f.seek(offset)
+        timestamp, direction, length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        
+        offset += RECORD_HEADER.size
+        if offset + length > size: break
+        
+        entries.append((timestamp, direction, length, offset))
+        offset += length
+        
+    f.close()
+    
+    index = np.array(entries, dtype=INDEX_DTYPE)
+    index.tofile(index_file(path))
+    
+    return index
+
+
+def load_index(path):
+    """ Index of a capture log, rebuilt when it does not match the log. """
+    idx_file = index_file(path)
+    
+    if os.path.exists(idx_file):
+        index = np.fromfile(idx_file, dtype=INDEX_DTYPE)
+        end = index['offset'][-1] + index['length'][-1] if len(index) else len(LOG_MAGIC)
+        
+        if os.path.getsize(idx_file) % INDEX_DTYPE.itemsize == 0 and end == os.path.getsize(path):
+            return index
+            
+    return rebuild_index(path)
+
+
+def read_chunks(path, direction=READ):
+    """ (timestamp, bytes) of every chunk in a capture log going one direction. """
+    index = load_index(path)
+    index = index[index['direction'] == direction]
+    
+    f = open(path, 'rb')
+    chunks = []
+    
+    for timestamp, d, length, offset in index:
+        f.seek(offset)
+        chunks.append((timestamp, f.read(length)))
+        
+    f.close()
+    return chunks
+
+
+class ReplaySerial(object):
+    """
+    Plays the bytes read during a capture back through the part of
+    serial.Serial CHR6dmIMU uses. With speed=1.0 chunks become available at
+    the times they were recorded at (2.0 is twice as fast), with speed=None
+    every read gets the next recorded chunk right away. Chunks are never
+    merged or split in the latter mode, so a replay decodes the same way
+    every time. Writes are only counted and flushes do nothing, the log
+    holds exactly what was read.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.port = path
+        self.speed = speed
+        
+        self.timeout = None
+        self.baudrate = None
+        self.bytesize = None
+        self.stopbits = None
+        self.parity = None
+        
+        index = load_index(path)
+        index = index[index['direction'] == READ]
+        
+        self.times = index['timestamp'] - index['timestamp'][0] if len(index) else index['timestamp']
+        self.offsets = index['offset'].astype(np.int64)
+        self.ends = self.offsets + index['length']
+        
+        # bytes in all chunks before chunk i, chunks are not contiguous in the log
+        self.received = np.concatenate(([0], np.cumsum(index['length'], dtype=np.int64)))
+        
+        self.log = open(path, 'rb')
+        self.data = mmap.mmap(self.log.fileno(), 0, access=mmap.ACCESS_READ) if len(index) else ''
+        
+        self.next_chunk = 0         # first chunk not handed out yet
+        self.pending = ''           # rest of a chunk read only partially
+        self.start_time = None      # wall clock time the replay started at
+        self.bytes_written = 0
+
+    def _due(self):
+        """ Index one past the last chunk that has arrived by now. """
+        if self.speed is None:
+            return min(self.next_chunk + (not self.pending), len(self.times))
+            
+        if self.start_time is None: self.start_time = time.time()
+        return np.searchsorted(self.times, (time.time() - self.start_time) * self.speed, 'right')
+
+    def _take(self, due):
+        if due > self.next_chunk:
+            chunks = [self.data[self.offsets[i]:self.ends[i]] for i in range(self.next_chunk, due)]
+            self.pending += ''.join(chunks)
+            self.next_chunk = due
+
+    def finished(self):
+        """ True once every recorded chunk was read. """
+        return self.next_chunk >= len(self.times) and not self.pending
+
+    def inWaiting(self):
+        due = self._due()
+        return len(self.pending) + int(self.received[due] - self.received[self.next_chunk])
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        
+        while True:
+            self._take(self._due())
+            
+            if len(self.pending) >= size or self.speed is None:
+                break
+                
+            if self.next_chunk >= len(self.times):
+                # the recording is over, a real port would keep us waiting
+                if not self.pending and deadline is not None:
+                    time.sleep(max(0.0, deadline - time.time()))
+                break
+                
+            if deadline is not None and time.time() >= deadline:
+                break
+                
+            # sleep until the next chunk is due or the timeout expires
+            wake = self.start_time + self.times[self.next_chunk] / self.speed
+            if deadline is not None: wake = min(wake, deadline)
+            time.sleep(max(0.0, wake - time.time()))
+            
+        dataStr = self.pending[:size]
+        self.pending = self.pending[size:]
+        
+        return dataStr
+
+    def write(self, dataStr):
+        self.bytes_written += len(dataStr)
+        return len(dataStr)
+
+    def flushInput(self):
+        # bytes flushed during the capture were never read and never recorded,
+        # everything in the log was read after the flushes it went through
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def close(self):
+        if self.data: self.data.close()
+        self.log.close()
+        
+        # nothing left to read from a closed port
+        self.data = ''
+        self.next_chunk = len(self.times)
+        self.pending = ''
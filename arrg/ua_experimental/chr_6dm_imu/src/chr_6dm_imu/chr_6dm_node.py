@@ -37,23 +37,54 @@
 import roslib
 roslib.load_manifest('chr_6dm_imu')
 
+import time
+from threading import Thread
+from collections import deque
+
 import rospy
 
 from chr_6dm_io import CHR6dmIMU
 from std_srvs.srv import Empty
 from sensor_msgs.msg import Imu
+from diagnostic_msgs.msg import DiagnosticArray
+from diagnostic_msgs.msg import DiagnosticStatus
+from diagnostic_msgs.msg import KeyValue
 from tf.transformations import quaternion_from_euler
 import tf
 
+class LatencyStats():
+    """ Mean and max latency of one pipeline stage since the last reset. """
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        if latency > self.max: self.max = latency
+
+    def key_value(self):
+        mean = self.total / self.count if self.count else 0.0
+        return KeyValue('%s latency mean/max (ms)' % self.name, '%.3f / %.3f' % (mean * 1000, self.max * 1000))
+
 class CHR6dmNode():
     def __init__(self):
-        port_name = rospy.get_param('~port_name', '/dev/ttyUSB0')
+        self.port_name = rospy.get_param('~port_name', '/dev/ttyUSB0')
         frame_id = rospy.get_param('~frame_id', 'imu_link')
         self.mode = rospy.get_param('~mode', 'polled')
         self.ignore_pitch_roll = rospy.get_param('~ignore_pitch_roll', False)
         self.data_rate = rospy.get_param('~data_rate', 150)
+        self.queue_size = rospy.get_param('~queue_size', 64)
+        self.diagnostics_period = rospy.get_param('~diagnostics_period', 1.0)
+        capture_file = rospy.get_param('~capture_file', '')
         
-        self.imu = CHR6dmIMU(port_name)
+        self.imu = CHR6dmIMU(self.port_name, capture_file)
         
         if self.mode == 'streaming':
             self.imu.set_broadcast_mode(self.data_rate)
@@ -61,6 +92,7 @@ class CHR6dmNode():
             self.imu.set_silent_mode()
         else:
             rospy.logwarn('Unrecognized IMU mode, setting to polled')
+            self.mode = 'polled'
             self.imu.set_silent_mode()
             
         rospy.sleep(0.1)
@@ -90,61 +122,167 @@ class CHR6dmNode():
         self.imu_msg.orientation_covariance[4] = proc_cov
         self.imu_msg.orientation_covariance[8] = proc_cov
         
+        # ring buffer between the reader thread and the publisher, the reader
+        # only appends and the publisher only pops, both are atomic on a deque
+        self.samples = deque(maxlen=self.queue_size)
+        self.dropped_samples = 0
+        self.published_samples = 0
+        
+        self.read_stats = LatencyStats('Read')
+        self.queue_stats = LatencyStats('Queue')
+        self.publish_stats = LatencyStats('Publish')
+        
+        self.running = False
+        self.reader = None
+        
+        self.tf_broadcaster = tf.TransformBroadcaster()
         self.imu_data_pub = rospy.Publisher('imu/data', Imu)
+        self.diagnostics_pub = rospy.Publisher('/diagnostics', DiagnosticArray)
 #        self.zero_rate_gyros_srv = rospy.Service('imu/zero_rate_gyros', Empty, self.process_zero_rate_gyros)
 #        self.auto_set_accel_ref = rospy.Service('imu/auto_set_accel_ref', Empty, self.process_auto_set_accel_ref)
 
-    def publish_data(self):
+    def start_reader(self):
+        self.running = True
+        self.reader = Thread(target=self.read_data)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def read_data(self):
+        """
+        Reader thread, the only user of the serial port once the IMU is set up.
+        Every sensor data packet is timestamped when its bytes arrive and pushed
+        into the ring buffer, the oldest sample is dropped when it is full.
+        """
         r = rospy.Rate(self.data_rate)
         
-        while not rospy.is_shutdown():
+        while self.running and not rospy.is_shutdown():
             if self.mode == 'streaming':
-                data = self.imu.read_accel_angrate_orientation()
+                self.imu.read_packets()
             else:
-                data = self.imu.get_data()
+                self.imu.get_data()
                 
-            if not data: continue
+            now = time.time()
             
-            # quaternion from eauler in NED coordinate system
-            if self.ignore_pitch_roll:
-                data['roll'] = 0.0
-                data['pitch'] = 0.0
+            while self.imu.sensor_data:
+                data = self.imu.sensor_data.popleft()
+                self.read_stats.add(now - data['timestamp'])
                 
-            ori = quaternion_from_euler(data['roll'], data['pitch'], data['yaw'])
-            
-            # quaternion in ENU coordiante system
-            self.imu_msg.orientation.x = ori[1]
-            self.imu_msg.orientation.y = ori[0]
-            self.imu_msg.orientation.z = -ori[2]
-            self.imu_msg.orientation.w = ori[3]
-            
-            # populate angular and linear rates, converting from NED to ENU
-            self.imu_msg.angular_velocity.x = data['pitch_rate']
-            self.imu_msg.angular_velocity.y = data['roll_rate']
-            self.imu_msg.angular_velocity.z = -data['yaw_rate']
-            
-            self.imu_msg.linear_acceleration.x = data['accel_y']
-            self.imu_msg.linear_acceleration.y = data['accel_x']
-            self.imu_msg.linear_acceleration.z = -data['accel_z']
+                if len(self.samples) == self.samples.maxlen: self.dropped_samples += 1
+                self.samples.append(data)
+                
+            # in polled mode each GET_DATA yields one sample, ask at the output rate
+            if self.mode == 'polled':
+                try:
+                    r.sleep()
+                except rospy.ROSInterruptException:
+                    break
+
+    def publish_data(self):
+        """ Publisher stage, drains the ring buffer at the configured rate. """
+        self.start_reader()
+        
+        r = rospy.Rate(self.data_rate)
+        next_diagnostics = time.time() + self.diagnostics_period
+        
+        while not rospy.is_shutdown():
+            while self.samples:
+                data = self.samples.popleft()
+                start = time.time()
+                self.queue_stats.add(start - data['timestamp'])
+                
+                self.publish_sample(data)
+                
+                self.publish_stats.add(time.time() - start)
+                self.published_samples += 1
+                
+            if time.time() >= next_diagnostics:
+                self.publish_diagnostics()
+                next_diagnostics += self.diagnostics_period
+                
+            r.sleep()
+
+    def publish_sample(self, data):
+        # quaternion from eauler in NED coordinate system
+        if self.ignore_pitch_roll:
+            data['roll'] = 0.0
+            data['pitch'] = 0.0
             
-            self.imu_msg.header.stamp = rospy.Time.from_sec(data['timestamp'])
-            self.imu_data_pub.publish(self.imu_msg)
+        ori = quaternion_from_euler(data['roll'], data['pitch'], data['yaw'])
+        
+        # quaternion in ENU coordiante system
+        self.imu_msg.orientation.x = ori[1]
+        self.imu_msg.orientation.y = ori[0]
+        self.imu_msg.orientation.z = -ori[2]
+        self.imu_msg.orientation.w = ori[3]
+        
+        # populate angular and linear rates, converting from NED to ENU
+        self.imu_msg.angular_velocity.x = data['pitch_rate']
+        self.imu_msg.angular_velocity.y = data['roll_rate']
+        self.imu_msg.angular_velocity.z = -data['yaw_rate']
+        
+        self.imu_msg.linear_acceleration.x = data['accel_y']
+        self.imu_msg.linear_acceleration.y = data['accel_x']
+        self.imu_msg.linear_acceleration.z = -data['accel_z']
+        
+        self.imu_msg.header.stamp = rospy.Time.from_sec(data['timestamp'])
+        self.imu_data_pub.publish(self.imu_msg)
+        
+        o = [self.imu_msg.orientation.x, self.imu_msg.orientation.y,self.imu_msg.orientation.z,self.imu_msg.orientation.w]
+        self.tf_broadcaster.sendTransform((0, 0, 0.5), o, self.imu_msg.header.stamp, '/dummy_imu_link', self.imu_msg.header.frame_id)
+
+    def publish_diagnostics(self):
+        stat = DiagnosticStatus()
+        stat.name = 'CHR-6dm IMU'
+        stat.hardware_id = self.port_name
+        
+        rate = self.published_samples / self.diagnostics_period
+        
+        if self.dropped_samples:
+            stat.level = DiagnosticStatus.WARN
+            stat.message = 'Dropped %d samples, publisher falling behind' % self.dropped_samples
+        elif rate < 0.9 * self.data_rate:
+            stat.level = DiagnosticStatus.WARN
+            stat.message = 'Publishing at %.1f Hz, expected %d Hz' % (rate, self.data_rate)
+        else:
+            stat.level = DiagnosticStatus.OK
+            stat.message = 'OK'
             
-            br = tf.TransformBroadcaster()
-            o = [self.imu_msg.orientation.x, self.imu_msg.orientation.y,self.imu_msg.orientation.z,self.imu_msg.orientation.w]
-            br.sendTransform((0, 0, 0.5), o, self.imu_msg.header.stamp, '/dummy_imu_link', self.imu_msg.header.frame_id)
+        stat.values.append(KeyValue('Mode', self.mode))
+        stat.values.append(KeyValue('Publish rate (Hz)', '%.1f' % rate))
+        stat.values.append(KeyValue('Queued samples', str(len(self.samples))))
+        stat.values.append(KeyValue('Dropped samples', str(self.dropped_samples)))
+        stat.values.append(KeyValue('Skipped bytes (total)', str(self.imu.decoder.skipped_bytes)))
+        stat.values.append(KeyValue('Bad checksums (total)', str(self.imu.decoder.bad_checksums)))
+        
+        for stats in (self.read_stats, self.queue_stats, self.publish_stats):
+            stat.values.append(stats.key_value())
+            stats.reset()
             
-            r.sleep()
+        # counters are per diagnostics period, a drop counted by the reader
+        # between reading and resetting shows up in the next period instead
+        self.dropped_samples = 0
+        self.published_samples = 0
+        
+        diag = DiagnosticArray()
+        diag.header.stamp = rospy.Time.now()
+        diag.status.append(stat)
+        self.diagnostics_pub.publish(diag)
 
     def shutdown(self):
-        self.imu_data_pub.shutdown()
+        self.running = False
+        if self.reader: self.reader.join(1.0)
+        
+        self.imu_data_pub.unregister()
+        self.diagnostics_pub.unregister()
         self.imu.close()
 
 if __name__ == '__main__':
+    rospy.init_node('imu_node', anonymous=True)
+    imu_node = CHR6dmNode()
+    
     try:
-        rospy.init_node('imu_node', anonymous=True)
-        imu_node = CHR6dmNode()
         imu_node.publish_data()
     except rospy.ROSInterruptException:
-        imu_node.shutdown()
-
+        pass
+        
+    imu_node.shutdown()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Author: Daniel Hewlett
+
+"""
+Distance statistics of laser scans: closest and mean valid return overall, in
+front of the robot and in configurable angular sectors. Returns that are
+NaN, inf or outside [range_min, range_max] are ignored. Every beam can be
+averaged over the last few scans first, which takes the flicker out of the
+statistics.
+
+Parameters:
+    ~window                 number of scans every beam is averaged over (1 for none)
+    ~front_width            width of the front sector in degrees, centered on 0
+    ~sectors                list of [start, end] angles in degrees
+    ~publish_distance_info  also publish the DistanceInfo of simple_laser_filter.py,
+                            computed exactly like it does from the raw scan
+"""
+
+PKG = 'path_learning_experiment'
+
+import roslib; roslib.load_manifest(PKG)
+import rospy
+
+from sensor_msgs.msg import LaserScan
+from path_learning_experiment.msg import DistanceInfo
+from path_learning_experiment.msg import ScanStatistics
+
+import math
+import numpy
+
+INF = float('inf')
+
+class ScanWindow():
+    """
+    Per-beam mean of the valid returns of the last size scans. Running sums
+    are updated with the scan that comes in and the one that drops out, and
+    recomputed from the window every time it wraps around so rounding
+    errors don't build up.
+    """
+    def __init__(self, size, num_beams):
+        self.ranges = numpy.zeros((size, num_beams))
+        self.valid = numpy.zeros((size, num_beams), dtype=bool)
+        self.sums = numpy.zeros(num_beams)
+        self.counts = numpy.zeros(num_beams, dtype=int)
+        self.next = 0
+
+    def add(self, ranges, valid):
+        """Adds a scan, returns the smoothed ranges and which of them are valid."""
+        i = self.next
+        ranges = numpy.where(valid, ranges, 0.0)
+
+        self.sums -= self.ranges[i]
+        self.counts -= self.valid[i]
+        self.ranges[i] = ranges
+        self.valid[i] = valid
+        self.sums += ranges
+        self.counts += valid
+
+        self.next = (i + 1) % len(self.ranges)
+        if self.next == 0:
+            self.sums = self.ranges.sum(axis=0)
+            self.counts = self.valid.sum(axis=0)
+
+        return self.sums / numpy.maximum(self.counts, 1), self.counts > 0
+
+def sector_slices(angle_min, angle_increment, num_beams, sectors):
+    """Beam index slices of the (start, end) angle sectors, in radians."""
+    slices = []
+
+    for start, end in sectors:
+        first = int(math.ceil((start - angle_min) / angle_increment))
+        last = int(math.floor((end - angle_min) / angle_increment))
+        slices.append(slice(min(max(first, 0), num_beams), min(max(last + 1, 0), num_beams)))
+
+    return slices
+
+def scan_statistics(ranges, valid, slices):
+    """
+    Number of valid returns, closest and mean valid return of the whole scan
+    and closest and mean valid return of every slice. inf where there is no
+    valid return.
+    """
+    closest = numpy.where(valid, ranges, INF)
+
+    # prefix sums give the sum and count of any slice with two lookups
+    sums = numpy.zeros(len(ranges) + 1)
+    numpy.cumsum(numpy.where(valid, ranges, 0.0), out=sums[1:])
+    counts = numpy.zeros(len(ranges) + 1, dtype=int)
+    numpy.cumsum(valid, out=counts[1:])
+
+    def stats(s, e):
+        count = counts[e] - counts[s]
+        if not count: return INF, INF
+        return closest[s:e].min(), (sums[e] - sums[s]) / count
+
+    n = len(ranges)
+    min_dist, avg_dist = stats(0, n)
+    sector_stats = [stats(*sl.indices(n)[:2]) for sl in slices]
+
+    return counts[-1], min_dist, avg_dist, sector_stats
+
+class ScanStatisticsNode():
+    def __init__(self):
+        rospy.init_node('scan_statistics', anonymous=True)
+
+        self.window_size = max(1, rospy.get_param('~window', 4))
+        front_width = math.radians(rospy.get_param('~front_width', 10.0))
+        sectors = rospy.get_param('~sectors', [[-90.0, -30.0], [-30.0, 30.0], [30.0, 90.0]])
+
+        # the front sector goes first, followed by the configured ones
+        self.sectors = [(-front_width / 2.0, front_width / 2.0)]
+        self.sectors += [(math.radians(start), math.radians(end)) for start, end in sectors]
+
+        self.geometry = None
+        self.slices = None
+        self.window = None
+
+        self.stats_pub = rospy.Publisher('scan_statistics', ScanStatistics)
+
+        if rospy.get_param('~publish_distance_info', True):
+            self.dist_pub = rospy.Publisher('dist_info', DistanceInfo)
+        else:
+            self.dist_pub = None
+
+        rospy.Subscriber('scan', LaserScan, self.process_scan)
+
+    def process_scan(self, scan):
+        ranges = numpy.asarray(scan.ranges, dtype=numpy.float64)
+
+        # sectors and window are set up again if the scanner's geometry changes
+        geometry = (scan.angle_min, scan.angle_increment, len(ranges))
+        if geometry != self.geometry:
+            self.geometry = geometry
+            self.slices = sector_slices(scan.angle_min, scan.angle_increment, len(ranges), self.sectors)
+            self.window = ScanWindow(self.window_size, len(ranges))
+
+        # NaN fails both comparisons, inf fails the second one
+        with numpy.errstate(invalid='ignore'):
+            valid = (ranges >= scan.range_min) & (ranges <= scan.range_max)
+
+        if self.dist_pub:
+            self.publish_distance_info(scan, ranges)
+
+        if self.window_size > 1:
+            ranges, valid = self.window.add(ranges, valid)
+
+        num_valid, min_dist, avg_dist, sector_stats = scan_statistics(ranges, valid, self.slices)
+
+        msg = ScanStatistics()
+        msg.header = scan.header
+        msg.num_valid = num_valid
+        msg.min_dist = min_dist
+        msg.avg_dist = avg_dist
+        msg.front_dist = sector_stats[0][0]
+        msg.sector_min_dist = [s[0] for s in sector_stats[1:]]
+        msg.sector_avg_dist = [s[1] for s in sector_stats[1:]]
+        self.stats_pub.publish(msg)
+
+    def publish_distance_info(self, scan, ranges):
+        """
+        The DistanceInfo simple_laser_filter.py publishes for scan: center
+        beam, closest and mean return of all beams, nothing filtered or
+        smoothed, so data_collector.py records the same dist_info either way.
+        """
+        di = DistanceInfo()
+        di.header = scan.header
+        di.front_dist = ranges[(len(ranges) + 1) / 2]
+        di.min_dist = ranges.min()
+        di.avg_dist = ranges.sum() / len(ranges)
+        self.dist_pub.publish(di)
+
+if __name__ == '__main__':
+    try:
+        node = ScanStatisticsNode()
+        rospy.spin()
+    except rospy.ROSInterruptException: pass
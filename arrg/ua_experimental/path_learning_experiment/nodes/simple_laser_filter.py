@@ -27,15 +27,12 @@ class SimpleLaserFilter():
     def filter_scan(self, scan):
         di = DistanceInfo()
         di.header = scan.header    
-        di.min_dist = numpy.min(scan.ranges)
-        num_scans = len(scan.ranges)
+        ranges = numpy.asarray(scan.ranges)
+        num_scans = len(ranges)
         center_scan_index = (num_scans + 1) / 2
-        center_range = scan.ranges[center_scan_index]
-        di.front_dist = center_range
-        sum_dist = 0        
-        for dist in scan.ranges:
-            sum_dist += dist
-        di.avg_dist = sum_dist / num_scans 
+        di.front_dist = ranges[center_scan_index]
+        di.min_dist = ranges.min()
+        di.avg_dist = ranges.sum() / num_scans
         self.dist_pub.publish(di)
 
 if __name__ == '__main__':
@@ -4,12 +4,57 @@ import roslib; roslib.load_manifest('point_cloud_classifier')
 import rospy
 from point_cloud_classifier.srv import GetClusterLabels
 from point_cloud_classifier.srv import GetClusterLabelsResponse
-from point_cloud_classifier.srv import ExtractSHOTDescriptor
+from point_cloud_classifier.srv import ExtractSHOTDescriptors
 from sklearn import decomposition,neighbors
 from numpy import *
 import os
 
 
+# text files the model used to be read from, all of them go into one .npz
+# bundle the first time the node starts
+MODEL_FILES = {
+    'code_book': 'codebook.txt',
+    'pca_mean':  'pcamean.txt',
+    'pca_comps': 'pcacomps.txt',
+    'mean':      'mean.txt',
+    'std':       'std.txt',
+    'train':     'dataTrain.txt',
+}
+
+MODEL_BUNDLE = 'model.npz'
+
+
+def load_model(data_path):
+    """
+    Arrays of the classification model, read from the bundle in data_path if
+    it is newer than the text files, otherwise from the text files (and
+    bundled for the next start).
+    """
+    bundle_file = os.path.join(data_path, MODEL_BUNDLE)
+    text_files = [os.path.join(data_path, f) for f in MODEL_FILES.values()]
+    text_mtime = max([os.path.getmtime(f) for f in text_files if os.path.exists(f)] or [0])
+    
+    if os.path.exists(bundle_file) and os.path.getmtime(bundle_file) >= text_mtime:
+        bundle = load(bundle_file)
+        model = dict((name, bundle[name]) for name in bundle.files)
+        bundle.close()
+        return model
+    
+    model = {}
+    
+    for name, fname in MODEL_FILES.items():
+        rospy.loginfo('Loading %s...' % fname)
+        model[name] = loadtxt(os.path.join(data_path, fname))
+    
+    try:
+        savez(bundle_file, **model)
+        rospy.loginfo('Saved model bundle %s' % bundle_file)
+    except (IOError, OSError) as e:
+        rospy.logwarn('could not save model bundle %s: %s' % (bundle_file, e))
+    
+    return model
+
+
 class ClusterClassification:
     def __init__(self):
         self.index_to_label = {
@@ -30,15 +75,20 @@ class ClusterClassification:
         default_data_path = os.path.join(roslib.packages.get_pkg_dir('point_cloud_classifier'), 'data')
         data_path = rospy.get_param('data_path', default_data_path)
         
-        rospy.loginfo('Loading codebook...')
-        self.code_book = loadtxt(os.path.join(data_path, 'codebook.txt'))
+        rospy.loginfo('Loading model...')
+        model = load_model(data_path)
         
-        # PCA
-        rospy.loginfo('Loading PCA data...')
-        self.pca_mean  = loadtxt(os.path.join(data_path, 'pcamean.txt'))
-        self.pca_comps = loadtxt(os.path.join(data_path, 'pcacomps.txt'))
-        self.mean      = loadtxt(os.path.join(data_path, 'mean.txt'))
-        self.std       = loadtxt(os.path.join(data_path, 'std.txt'))
+        self.code_book = model['code_book']
+        self.code_book_sq = (self.code_book**2).sum(axis=1)
+        
+        # normalization and PCA projection folded into one affine map,
+        # ((x - mean) / std - pca_mean) . pca_comps.T == x . weights + offset
+        self.pca_mean  = model['pca_mean']
+        self.pca_comps = model['pca_comps']
+        self.mean      = model['mean']
+        self.std       = model['std']
+        self.weights = (self.pca_comps / self.std).T
+        self.offset = -dot(self.mean / self.std + self.pca_mean, self.pca_comps.T)
         
 #        data = loadtxt('shot.txt')
 #        mean = data.mean(axis=0)
@@ -53,16 +103,15 @@ class ClusterClassification:
 #        self.std  = std
 #        self.pca  = pca
         
-        # KNN
-        rospy.loginfo('Loading training data...')
-        trainData = loadtxt(os.path.join(data_path, 'dataTrain.txt'))
+        # KNN, histograms are searched with a ball tree instead of brute force
         rospy.loginfo('Training KNN...')
-        self.knn = neighbors.KNeighborsClassifier(1)
+        trainData = model['train']
+        self.knn = neighbors.KNeighborsClassifier(1, algorithm='ball_tree')
         self.knn.fit(trainData[:,:-1], trainData[:,-1])
-        del trainData
+        del trainData, model
         
-        rospy.wait_for_service('extract_shot_descriptor')
-        self.extract_shot_features_srv = rospy.ServiceProxy('extract_shot_descriptor', ExtractSHOTDescriptor)
+        rospy.wait_for_service('extract_shot_descriptors')
+        self.extract_shot_features_srv = rospy.ServiceProxy('extract_shot_descriptors', ExtractSHOTDescriptors)
         rospy.loginfo('Classification node initialization done')
         
         rospy.Service('get_cluster_labels', GetClusterLabels, self.get_cluster_labels)
@@ -70,46 +119,66 @@ class ClusterClassification:
     def get_cluster_labels(self, req):
         rospy.loginfo('got %d clusters' % len(req.clusters))
         res = GetClusterLabelsResponse()
-        clusters = req.clusters
-        
-        for idx,point_cloud in enumerate(clusters):
-            try:
-                label = self.classify(point_cloud)
-                res.labels.append(label)
-            except Exception as e:
-                label = 'Unknown'
-                rospy.logerr('classification failed: %s' % e)
-                
+        
+        try:
+            res.labels = self.classify_all(req.clusters)
+        except Exception as e:
+            res.labels = ['Unknown'] * len(req.clusters)
+            rospy.logerr('classification failed: %s' % e)
+        
+        for idx,label in enumerate(res.labels):
             rospy.loginfo('labeled object %d with %s category' % (idx, label))
-            
+        
         return res
 
-    def classify(self, point_cloud):
-        res = self.extract_shot_features_srv(point_cloud)
-        num_features = res.num_features
-        feature_size = res.feature_size
-        shot_features = res.shot_feature
+    def codewords(self, shot_features):
+        """Index of the nearest codeword of every descriptor (one per row)."""
+        objectPca = dot(shot_features, self.weights) + self.offset
+        
+        # squared distances up to the per-row constant |x|^2, which doesn't
+        # change the argmin
+        dist = self.code_book_sq - 2.0 * dot(objectPca, self.code_book.T)
+        return dist.argmin(axis=1)
+
+    def histograms(self, shot_features, num_features):
+        """
+        Normalized bag of words histogram of every cluster, num_features[i]
+        consecutive rows of shot_features belong to cluster i. Clusters
+        without descriptors get an all zero histogram.
+        """
+        num_words = self.code_book.shape[0]
+        num_features = asarray(num_features, dtype=int)
+        clusters = repeat(arange(len(num_features)), num_features)
+        
+        words = self.codewords(shot_features)
+        objectHist = bincount(clusters * num_words + words, minlength=len(num_features) * num_words)
+        objectHist = objectHist.reshape(len(num_features), num_words).astype(float)
+        
+        return objectHist / maximum(num_features, 1)[:,newaxis]
+
+    def classify_all(self, point_clouds):
+        """Labels of all clusters, with a single descriptor extraction call."""
+        if not point_clouds: return []
+        
+        res = self.extract_shot_features_srv(point_clouds)
+        num_features = asarray(res.num_features, dtype=int)
         rospy.loginfo('successfully extarcted shot features')
         
-        shot_features = reshape(shot_features, (num_features, feature_size))
-        shot_features = shot_features - self.mean
-        shot_features = shot_features / self.std
+        # clusters without any descriptors stay unknown
+        labels = ['Unknown'] * len(point_clouds)
+        found = flatnonzero(num_features > 0)
+        if not found.size: return labels
         
-        #pca transform
-        temp = shot_features - self.pca_mean
-        objectPca = dot(temp, self.pca_comps.T)
-#        objectPca = self.pca.transform(shot_features)
-        objectHist = zeros((self.code_book.shape[0]))
+        shot_features = reshape(asarray(res.shot_features, dtype=float), (num_features.sum(), res.feature_size))
+        objectHist = self.histograms(shot_features, num_features)
         
-        for i in range(objectPca.shape[0]):
-            dist = sum( (self.code_book - objectPca[i,:])**2 , axis=1 )
-            objectHist[argmin(dist)] = objectHist[argmin(dist)] + 1
+        for idx, label in zip(found, self.knn.predict(objectHist[found])):
+            labels[idx] = self.index_to_label.get(int(label), 'Unknown')
             
-        objectHist = objectHist / objectHist.sum()
-        idx = self.knn.predict(objectHist)[0]
-        
-        if idx in self.index_to_label: return self.index_to_label[idx]
-        else: return 'Unknown'
+        return labels
+
+    def classify(self, point_cloud):
+        return self.classify_all([point_cloud])[0]
 
 
 if __name__ == '__main__':
@@ -117,4 +186,3 @@ if __name__ == '__main__':
     pclClf = ClusterClassification()
     
     rospy.spin()
-
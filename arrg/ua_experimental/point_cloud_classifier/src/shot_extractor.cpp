@@ -1,5 +1,6 @@
 #include <ros/ros.h>
 #include <point_cloud_classifier/ExtractSHOTDescriptor.h>
+#include <point_cloud_classifier/ExtractSHOTDescriptors.h>
 #include <sensor_msgs/PointCloud.h>
 #include <sensor_msgs/point_cloud_conversion.h>
 #include <stdlib.h>
@@ -16,8 +17,9 @@
 
 using namespace pcl;
 
-bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
-         point_cloud_classifier::ExtractSHOTDescriptor::Response &res )
+// SHOT descriptors of every point of a cloud, one after another, returns the
+// number of descriptors and sets feature_size to the length of one
+int extractDescriptors(const sensor_msgs::PointCloud &cloud, std::vector<double> &features, int &feature_size)
 {
     float        kernelSize;
 
@@ -32,8 +34,9 @@ bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
     //initialization
     kernelSize = 5;
     sensor_msgs::PointCloud2 pcl2;
-    sensor_msgs:convertPointCloudToPointCloud2(req.point_cloud,pcl2);
+    sensor_msgs::convertPointCloudToPointCloud2(cloud,pcl2);
     fromROSMsg(pcl2,*cloudIn);
+    if (cloudIn->empty()) return 0;
     //estimating input normals
     ne.setInputCloud (cloudIn);
     ne.setSearchMethod (tree);
@@ -45,17 +48,40 @@ bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
     shotExtractor.setSearchMethod(tree2);
     shotExtractor.setRadiusSearch(kernelSize);
     shotExtractor.compute(*cloudShot);
-    //response
-    res.num_features = cloudShot->size();
-    res.feature_size = cloudShot->points[0].descriptor.size();
+    if (cloudShot->empty()) return 0;
+
+    feature_size = cloudShot->points[0].descriptor.size();
+    features.reserve(features.size() + cloudShot->size() * feature_size);
     for(int i=0;i<cloudShot->size();i++)
     {
         for(int j=0;j<cloudShot->points[i].descriptor.size();j++)
         {
-            res.shot_feature.push_back(cloudShot->points[i].descriptor[j]);
+            features.push_back(cloudShot->points[i].descriptor[j]);
         }
     }
 
+    return cloudShot->size();
+}
+
+bool extract(point_cloud_classifier::ExtractSHOTDescriptor::Request  &req,
+         point_cloud_classifier::ExtractSHOTDescriptor::Response &res )
+{
+    int feature_size = 0;
+    res.num_features = extractDescriptors(req.point_cloud, res.shot_feature, feature_size);
+    res.feature_size = feature_size;
+    return true;
+}
+
+// all clusters in one call, descriptors of every cloud follow the ones of the previous cloud
+bool extractAll(point_cloud_classifier::ExtractSHOTDescriptors::Request  &req,
+         point_cloud_classifier::ExtractSHOTDescriptors::Response &res )
+{
+    int feature_size = 0;
+    for(int i=0;i<req.point_clouds.size();i++)
+    {
+        res.num_features.push_back(extractDescriptors(req.point_clouds[i], res.shot_features, feature_size));
+    }
+    res.feature_size = feature_size;
     return true;
 }
 
@@ -64,6 +90,7 @@ int main(int argc, char **argv)
     ros::init(argc, argv, "shotExtractor");
     ros::NodeHandle n;
     ros::ServiceServer service = n.advertiseService("extract_shot_descriptor", extract);
+    ros::ServiceServer batch_service = n.advertiseService("extract_shot_descriptors", extractAll);
     ROS_INFO("Ready to extract shot features.");
     ros::spin();
     return 0;
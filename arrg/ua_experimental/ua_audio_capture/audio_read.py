@@ -39,8 +39,6 @@ import pickle
 import math
 import os
 import time
-from fnmatch import fnmatch
-from array import array
 from operator import itemgetter
 import pickle
 
@@ -49,7 +47,6 @@ import rospy
 
 import pylab as pl
 import numpy as np
-import matplotlib
 from scipy.ndimage.filters import gaussian_filter1d
 from scikits.audiolab import Format, Sndfile
 
@@ -63,6 +60,12 @@ from multiprocessing import cpu_count
 from itertools import ifilter
 from sklearn.cluster.spectral import spectral_clustering
 
+from nw_align import NWAligner, NwalignAligner, som_cost_matrix
+from nw_cache import DistanceCache, distance_matrix
+from sound_corpus import SoundCorpus
+from sound_features import FeatureStore
+from som_encode import SomEncoder, stringify_units
+
 
 
 def print_confusion_matrix(o, c):
@@ -169,6 +172,7 @@ class AudioClassifier():
                        'som_learning_rate':    0.05,
                        'nw_gap_open':          0,
                        'nw_gap_extend':        -5,
+                       'nw_engine':            'nwalign',  # or 'numpy'
                        'knn_k':                10,
                        'fft_n':                512,
                        'fft_overlap':          256,
@@ -185,6 +189,13 @@ class AudioClassifier():
                            '/tmp/robot_sounds/raw/shake_pitch',
                           ]
                           
+        # pairwise sequence distances are kept here between runs, set to None
+        # to always realign
+        self.distance_cache_path = '/tmp/robot_sounds/nw_cache'
+        
+        # binned spectrograms of every clip, set to None to always recompute
+        self.feature_cache_path = '/tmp/robot_sounds/features'
+                          
         self.action_names = ['grasp',        # 0
                              'lift',         # 1
                              'drop',         # 2
@@ -205,6 +216,9 @@ class AudioClassifier():
                              'ace_terminals',        # 8
                              'chalkboard_eraser',    # 9
                             ]
+                            
+        self.aligner = None
+        self.distance_cache = None
 
 
     def stringify_sequence(self, seq):
@@ -212,13 +226,7 @@ class AudioClassifier():
         input  = [(1,2),(2,3) ...]
         output = 'ab....'
         """
-        map_side = self.params['som_size']
-        result = []
-        for t in seq:
-            idx = t[0] * map_side + t[1]
-            ascii_idx = idx + 48
-            result.append(chr(ascii_idx))
-        return ''.join(result)
+        return stringify_units(seq, self.params['som_size'])
 
 
     def generate_cost_matrix(self):
@@ -262,10 +270,28 @@ class AudioClassifier():
         outfile.write(result)
         outfile.close()
         
+        # nwalign's C kernel is the faster one per alignment, the numpy
+        # aligner keeps the same matrix in memory and aligns in batches
+        if self.params['nw_engine'] == 'nwalign':
+            self.aligner = NwalignAligner('/tmp/som.costs',
+                                          self.params['nw_gap_open'],
+                                          self.params['nw_gap_extend'])
+        else:
+            self.aligner = NWAligner(som_cost_matrix(map_side),
+                                     self.params['nw_gap_open'],
+                                     self.params['nw_gap_extend'])
+                                     
+        if self.distance_cache_path:
+            self.distance_cache = DistanceCache(self.aligner, self.distance_cache_path)
+            
         return result
 
 
-    def sound_seq_distance_str(self, seq1_str, seq2_str):
+    def nwalign_distance_str(self, seq1_str, seq2_str):
+        """
+        nwalign based distance, needs /tmp/som.costs. The reference in
+        benchmark_nw_align.py.
+        """
         gopen = self.params['nw_gap_open']
         gextend = self.params['nw_gap_extend']
         seq1_str = np.asanyarray(seq1_str)
@@ -277,30 +303,82 @@ class AudioClassifier():
         return (-nw.score_alignment(*align, gap_open=gopen, gap_extend=gextend, matrix='/tmp/som.costs'))/(len1+len2+0.0)
 
 
+    def sound_seq_distance_str(self, seq1_str, seq2_str):
+        return self.aligner.distance(seq1_str, seq2_str)
+
+
+    def sound_seq_distances_str(self, seq_str, seq_strs):
+        """
+        Distances from seq_str to every sequence in seq_strs, looked up in the
+        distance cache when there is one.
+        """
+        if self.distance_cache is not None:
+            return self.distance_cache.distances(seq_str, seq_strs)
+            
+        return self.aligner.distances(seq_str, seq_strs)
+
+
+    def sound_seq_distance_matrix_str(self, seq_strs1, seq_strs2):
+        """
+        Distances between every pair of sequences from the two lists, looked up
+        in the distance cache when there is one, missing pairs are aligned on a
+        process pool.
+        """
+        if self.distance_cache is not None:
+            return self.distance_cache.matrix(seq_strs1, seq_strs2)
+            
+        return distance_matrix(self.aligner, seq_strs1, seq_strs2)
+
+
+    def distance_weight(self, dist):
+        return math.exp(-(dist-1)/0.5) / math.exp(0)
+
+
     def knn_weight_fn(self, x, y):
         dist = self.sound_seq_distance_str(x, y)
-        return math.exp(-(dist-1)/0.5) / math.exp(0)
+        return self.distance_weight(dist)
+
+
+    def knn_weights(self, knn_model, seq_str):
+        """
+        Equivalent of kNN.calculate with knn_weight_fn and sound_seq_distance_str,
+        but aligns the query against all training sequences in one batch and
+        computes each distance only once.
+        """
+        dists = self.sound_seq_distances_str(seq_str, knn_model.xs)
+        return self.knn_weights_from_distances(knn_model, dists)
+
+
+    def knn_weights_from_distances(self, knn_model, dists):
+        nearest = np.argsort(dists, kind='mergesort')[:knn_model.k]
+        
+        weights = {}
+        for klass in knn_model.classes:
+            weights[klass] = 0.0
+            
+        for i in nearest:
+            klass = knn_model.ys[i]
+            weights[klass] += self.distance_weight(dists[i])
+            
+        return weights
 
 
     def rebin_time_fixed_width(self, s, w):
         # filter first
         #s = gaussian_filter1d(s, 10, mode='constant')
         
-        num_intervals = int(s.shape[0] / w + 1)
-        result = []
-        
-        for i in range(num_intervals-1):
-            start = i*w
-            end = start + w
-            m = s[start:end].mean()
-            result.append(m)
-            
-        return np.asarray(result)
+        # means of all complete windows, a partial window at the end is dropped
+        num_intervals = s.shape[0] // w
+        return np.asarray(s[:num_intervals*w]).reshape(num_intervals, w).mean(axis=1)
 
 
     def sound_fft_to_string(self, sound_fft, som):
-        sequence = [som.bmu(sound_fft[:,col]) for col in range(sound_fft.shape[1])]
-        return self.stringify_sequence(sequence)
+        return SomEncoder(som, self.params['som_size']).sound_fft_to_string(sound_fft)
+
+
+    def sound_ffts_to_strings(self, sound_ffts, som):
+        """Encodes a list of sounds, best matching units of all columns are found at once."""
+        return SomEncoder(som, self.params['som_size']).sound_ffts_to_strings(sound_ffts)
 
 
     def train_model(self, training_ffts, training_labels):
@@ -321,7 +399,7 @@ class AudioClassifier():
         np.random.shuffle(column_vectors)
         som.fit(column_vectors)
         
-        training_sequences = [self.sound_fft_to_string(sound_fft, som) for sound_fft in training_ffts]
+        training_sequences = self.sound_ffts_to_strings(training_ffts, som)
         knn_model = kNN.train(training_sequences, training_labels, knn_k)
         
         return som, knn_model
@@ -334,12 +412,31 @@ class AudioClassifier():
         all label probabilities.
         """
         sequence = self.sound_fft_to_string(sound_fft, som)
+        weights = self.knn_weights(knn_model, sequence)
         
-        weights = kNN.calculate(knn_model,
-                                self.stringify_sequence(sequence),
-                                weight_fn=self.knn_weight_fn,
-                                distance_fn=self.sound_seq_distance_str)
-                              
+        return self.normalize_knn_weights(weights)
+
+
+    def classify_batch(self, sound_ffts, som, knn_model):
+        """
+        Classifies a list of sounds at once, the distances from all of them to
+        the training sequences are computed as one matrix. Returns a list of
+        tuples like classify().
+        """
+        sequences = self.sound_ffts_to_strings(sound_ffts, som)
+        return self.classify_sequences(sequences, knn_model)
+
+
+    def classify_sequences(self, sequences, knn_model):
+        dists = self.sound_seq_distance_matrix_str(sequences, knn_model.xs)
+        return [self.normalize_knn_weights(self.knn_weights_from_distances(knn_model, d)) for d in dists]
+
+
+    def normalize_knn_weights(self, weights):
+        """
+        Turns raw kNN votes into probabilities, returns the most likely label and
+        the probabilities of all labels.
+        """
         sum_weights = float(sum(weights.values()))
         
         most_class = None
@@ -364,163 +461,62 @@ class AudioClassifier():
         return most_class, weights
 
 
-    def find_sound_start(self, data_paths, actions, objects):
+    def sound_envelope(self, sound):
+        """Mean absolute amplitude over consecutive rebin_window long windows."""
         window = int(self.params['rebin_window'] * 44100)
+        return self.rebin_time_fixed_width(np.abs(sound), window)
+
+
+    def detect_sound_start(self, envelope):
+        """Sample where the sound starts or None if it never gets loud enough."""
+        window = int(self.params['rebin_window'] * 44100)
+        loud = np.nonzero(envelope > 0.02)[0]
         
-        counter = {}
-        total = {}
-        
-        for action_str in actions:
-            counter[action_str] = 0.0
-            total[action_str] = 0
-            
-        start_times_by_action = {}
-        
-        for action_str in actions:
-            start_times_by_action[action_str] = {}
-            for object_str in objects:
-                start_times_by_action[action_str][object_str] = []
-                
-        for path in data_paths:
-            print 'Processing sound descriptor files in %s' % path
-            
-            for fname in os.listdir(path):
-                if fnmatch(fname, '*.desc'):
-                    name = os.path.splitext(fname)[0]
-                    desc_file = open(os.path.join(path, fname), 'r')
-                    data_file = open(os.path.join(path, name + '.rawsound'), 'r')
-                    
-                    descriptors = desc_file.read().split('\n')
-                    arr = array('d')
-                    arr.fromstring(data_file.read())
-                    audio_blob = arr.tolist()
-                    
-                    desc_file.close()
-                    data_file.close()
-                    
-                    for descriptor in descriptors:
-                        if not descriptor: continue
-                        
-                        action_id, object_id, offset, length = descriptor.split()
-                        
-                        # grab string labels for current action and object
-                        action_str = actions[int(action_id)]
-                        object_str = objects[int(object_id)]
-                        
-                        sound = np.asarray(audio_blob[int(offset):int(offset)+int(length)])
-                        sound = np.abs(sound)
-                        sound = self.rebin_time_fixed_width(sound, window)
-                        maximum = max(sound)
-                        
-                        start = index_where(sound, (lambda x: x > 0.02))#maximum / 2.0))
-                        
-    #                    f = pl.figure()
-    #                    ax = f.add_subplot(111)
-    #                    im = pl.plot(sound)
-    #                    pl.draw()
-    #                    pl.show()
-                        
-                        
-                        if start is not None:
-                            start *= window
-                            start = max(0, start - self.params['start_offset'] * 44100)
-                            total[action_str] += start
-                            counter[action_str] += 1
-                            start_times_by_action[action_str][object_str].append(start)
-                        else:
-                            start_times_by_action[action_str][object_str].append(-1)
-                            
-        average_start_time = {}
+        if len(loud) == 0: return None
         
-        for action_str in actions:
-            average_start_time[action_str] = int(total[action_str] / counter[action_str])
-            
-        for action_str in actions:
-            for object_str in objects:
-                for i in range(len(start_times_by_action[action_str][object_str])):
-                    if start_times_by_action[action_str][object_str][i] == -1:
-                        start_times_by_action[action_str][object_str][i] = average_start_time[action_str]
-                        
-        return start_times_by_action
+        start = loud[0] * window
+        return max(0, start - self.params['start_offset'] * 44100)
 
 
-    def find_sound_end(self, data_paths, actions, objects, start_times):
+    def detect_sound_end(self, envelope, start_time, last_index):
+        """Sample where the sound ends or None if nothing loud follows the start."""
         window = int(self.params['rebin_window'] * 44100)
+        start = int((start_time+0.15*44100)/window)
+        loud = np.nonzero(envelope[start:] > 0.02)[0]
         
-        counter = {}
-        total = {}
+        if len(loud) == 0: return None
         
-        for action_str in actions:
-            counter[action_str] = 0.0
-            total[action_str] = 0
-            
-        end_times_by_action = {}
+        end = (start + loud[-1]) * window
+        return min(end + self.params['end_offset'] * 44100, last_index)
+
+
+    def fill_with_action_average(self, clips, times):
+        """Replaces undetected (None) times with the average over the clip's action."""
+        total = {}
+        counter = {}
         
-        for action_str in actions:
-            end_times_by_action[action_str] = {}
-            for object_str in objects:
-                end_times_by_action[action_str][object_str] = []
+        for clip, t in zip(clips, times):
+            if t is not None:
+                total[clip.action] = total.get(clip.action, 0) + t
+                counter[clip.action] = counter.get(clip.action, 0.0) + 1
                 
-        for path in data_paths:
-            print 'Processing sound descriptor files in %s' % path
-            
-            for fname in os.listdir(path):
-                if fnmatch(fname, '*.desc'):
-                    name = os.path.splitext(fname)[0]
-                    desc_file = open(os.path.join(path, fname), 'r')
-                    data_file = open(os.path.join(path, name + '.rawsound'), 'r')
-                    
-                    descriptors = desc_file.read().split('\n')
-                    arr = array('d')
-                    arr.fromstring(data_file.read())
-                    audio_blob = arr.tolist()
-                    
-                    desc_file.close()
-                    data_file.close()
-                    
-                    for descriptor in descriptors:
-                        if not descriptor: continue
-                        
-                        action_id, object_id, offset, length = descriptor.split()
-                        
-                        # grab string labels for current action and object
-                        action_str = actions[int(action_id)]
-                        object_str = objects[int(object_id)]
-                        
-                        sound = np.asarray(audio_blob[int(offset):int(offset)+int(length)])
-                        sound = np.abs(sound)
-                        last_index = len(sound)
-                        sound = self.rebin_time_fixed_width(sound, window)
-                        minimum = min(sound)
-                        sample_idx = len(end_times_by_action[action_str][object_str])
-                        start = int((start_times[action_str][object_str][sample_idx]+0.15*44100)/window)
-                        sound = sound[start:]
-                        maximum = max(sound)
-                        end = reverse_index_where(sound, (lambda x: x > 0.02))#maximum / 2.0))
-                        
-                        if end is not None:
-                            end = (start + end) * window
-                            end = min(end + self.params['end_offset'] * 44100, last_index)
-                            total[action_str] += end
-                            counter[action_str] += 1
-                            end_times_by_action[action_str][object_str].append(end)
-                        else:
-                            end_times_by_action[action_str][object_str].append(-1)
-                            
-                        sample_idx += 1
-                        
-        average_end_time = {}
+        return [t if t is not None else int(total[clip.action] / counter[clip.action]) for clip, t in zip(clips, times)]
+
+
+    def find_sound_bounds(self, clips):
+        """
+        Start and end sample of every clip. The amplitude envelope of each clip
+        is computed once and used for both.
+        """
+        envelopes = [self.sound_envelope(clip.sound) for clip in clips]
         
-        for action_str in actions:
-            average_end_time[action_str] = int(total[action_str] / counter[action_str])
-            
-        for action_str in actions:
-            for object_str in objects:
-                for i in range(len(end_times_by_action[action_str][object_str])):
-                    if end_times_by_action[action_str][object_str][i] == -1:
-                        end_times_by_action[action_str][object_str][i] = average_end_time[action_str]
-                        
-        return end_times_by_action
+        start_times = [self.detect_sound_start(env) for env in envelopes]
+        start_times = self.fill_with_action_average(clips, start_times)
+        
+        end_times = [self.detect_sound_end(env, start, len(clip)) for clip, env, start in zip(clips, envelopes, start_times)]
+        end_times = self.fill_with_action_average(clips, end_times)
+        
+        return start_times, end_times
 
 
     def calculate_fft(self, data_paths, actions, objects):
@@ -530,7 +526,6 @@ class AudioClassifier():
         of corresponding labels.
         """
         ####### Parameters ######
-        sampling_rate = 44100
         fft_n = self.params['fft_n']
         fft_overlap = self.params['fft_overlap']
         fft_freq_bins = self.params['fft_freq_bins']
@@ -542,86 +537,25 @@ class AudioClassifier():
             for object_str in objects:
                 object_count_by_actions[action_str][object_str] = 0
                 
-        processed_ffts = []
-        object_labels = []
-        action_labels = []
+        # every clip is a view into its memory-mapped .rawsound file
+        corpus = SoundCorpus(data_paths, actions, objects)
+        clips = list(corpus.clips())
+        print 'Found %d sound descriptors in %s' % (len(clips), ', '.join(data_paths))
         
-        #print 'Calculating start times...'
-        start_times = self.find_sound_start(data_paths, actions, objects)
-        #print start_times
+        #print 'Calculating start and end times...'
+        start_times, end_times = self.find_sound_bounds(clips)
         
-        #print 'Calculating end times...'
-        end_times = self.find_sound_end(data_paths, actions, objects, start_times)
-        #print end_times
+        # spectrograms are computed in parallel, unchanged clips come from disk
+        store = FeatureStore(self.feature_cache_path)
+        processed_ffts = store.features(clips, start_times, end_times, fft_n, fft_overlap, fft_freq_bins)
         
-        sample_idx = 0
+        action_labels = [clip.action for clip in clips]
+        object_labels = [clip.object for clip in clips]
         
-        for path in data_paths:
-            print 'Processing sound descriptor files in %s' % path
+        for clip in clips:
+            object_count_by_actions[clip.action][clip.object] += 1
             
-            for fname in os.listdir(path):
-                if fnmatch(fname, '*.desc'):
-                    name = os.path.splitext(fname)[0]
-                    desc_file = open(os.path.join(path, fname), 'r')
-                    data_file = open(os.path.join(path, name + '.rawsound'), 'r')
-                    
-                    descriptors = desc_file.read().split('\n')
-                    arr = array('d')
-                    arr.fromstring(data_file.read())
-                    audio_blob = arr.tolist()
-                    
-                    desc_file.close()
-                    data_file.close()
-                    
-                    for descriptor in descriptors:
-                        if not descriptor: continue
-                        
-                        action_id, object_id, offset, length = descriptor.split()
-                        
-                        # grab string labels for current action and object
-                        action_str = actions[int(action_id)]
-                        object_str = objects[int(object_id)]
-                        
-                        action_labels.append(action_str)
-                        object_labels.append(object_str)
-                        
-                        sound = np.asarray(audio_blob[int(offset):int(offset)+int(length)])
-                        idx = object_count_by_actions[action_str][object_str]
-                        start = int(start_times[action_str][object_str][idx])
-                        end = int(end_times[action_str][object_str][idx]) #start + int(fft_time_after_peak * sampling_rate)
-                        sound = sound[start:end]
-                        
-    #                    f = pl.figure()
-    #                    ax = f.add_subplot(111)
-    #                    im = pl.plot(sound)
-    #                    pl.draw()
-    #                    pl.show()
-                        
-                        Pxx,freqs,t = matplotlib.mlab.specgram(sound, NFFT=fft_n, Fs=sampling_rate, noverlap=fft_overlap)
-                        Pxx = 20 * np.log10(Pxx)
-                        freqs /= 1000.0
-                        
-                        # bin resulting FFT into fft_freq_bins number of frequency bins
-                        l = np.linspace(0, Pxx.shape[0], fft_freq_bins+1)
-                        fft_binned = np.empty((fft_freq_bins,Pxx.shape[1]))
-                        
-                        for i in range(len(l)-1):
-                            lis = int(l[i])
-                            lie = int(l[i+1])
-                            t = Pxx[lis:lie,:]
-                            fft_binned[i] = t.mean(axis=0)
-                            
-                        processed_ffts.append(fft_binned)
-                        print '[Sample %d] calculated FFT for action %s on object %s' % (sample_idx, action_str, object_str)
-                        object_count_by_actions[action_str][object_str] += 1
-                        sample_idx += 1
-                        
-    #                    f = pl.figure()
-    #                    ax = f.add_subplot(111)
-    #                    im = ax.pcolormesh(fft_binned)
-    #                    pl.draw()
-    #                    pl.show()
-                        
+        corpus.close()
         pretty_print_totals(object_count_by_actions)
         return action_labels, object_labels, processed_ffts
 
@@ -691,10 +625,19 @@ class AudioClassifier():
     #        pickle.dump(knn_model, open('/tmp/knn_model.pkl','w'))
     #        pickle.dump(som, open('/tmp/som.pkl','w'))
             
+            # classify all test sounds of an action together so their distances
+            # come out of the cache as one matrix
+            results = [None] * len(test_set)
+            for act in action_names:
+                act_inds = [idx for idx,a in enumerate(act_test_labels) if a == act]
+                if not act_inds: continue
+                
+                act_results = self.classify_batch([test_set[idx] for idx in act_inds], soms[act], knns[act])
+                for idx, res in zip(act_inds, act_results):
+                    results[idx] = res
+                    
             correct = 0
-            for idx, seq in enumerate(test_set):
-                act = act_test_labels[idx]
-                label, probs = self.classify(seq, soms[act], knns[act])
+            for idx, (label, probs) in enumerate(results):
                 pretty_print_knn_probs(test_labels[idx], label, probs)
                 true_id = object_names.index(test_labels[idx])
                 pred_id = object_names.index(label)
@@ -870,7 +813,6 @@ class AudioClassifier():
         action_ffts = data[3]
         sampling = data[4]
         
-        num_categories = len(self.object_names)
         num_ffts = len(action_ffts)
         
         labels = np.asarray(object_labels)
@@ -893,21 +835,27 @@ class AudioClassifier():
         
         del train_set
         
-        sampling_probs = np.zeros((num_test,num_categories), dtype=float)
-        object_names = []
+        # alignment happens back in the parent process, which owns the
+        # distance cache
+        test_sequences = self.sound_ffts_to_strings(test_set, som)
         
-        for idx, seq in enumerate(test_set):
-            if idx % 25 == 0:
-                print 'Action %s, Sampling %d, Test instance %d/%d' % (action_name.upper(), sampling, idx, num_test)
-                
-            label, probs = self.classify(seq, som, knn_model)
-            object_names.append(test_labels[idx])
-            
+        return sampling, action_name, list(test_labels), test_sequences, knn_model
+
+
+    def confusion_probabilities(self, test_sequences, knn_model):
+        """
+        Class probabilities (ordered as self.object_names) for every test
+        sequence, one row per sequence.
+        """
+        num_categories = len(self.object_names)
+        sampling_probs = np.zeros((len(test_sequences),num_categories), dtype=float)
+        
+        for idx, (label, probs) in enumerate(self.classify_sequences(test_sequences, knn_model)):
             # copy over the probabilities in correct order
             for cat_id,obj in enumerate(self.object_names):
                 sampling_probs[idx,cat_id] = probs[obj]
                 
-        return sampling, action_name, object_names, sampling_probs
+        return sampling_probs
 
 
     def run(self):
@@ -997,25 +945,17 @@ class AudioClassifier():
             objs_ffts = by_action[act]
             num_objs = len(objs_ffts)
             
+            som = soms[act]
+            strs = self.sound_ffts_to_strings([of[1] for of in objs_ffts], som)
+            
             for idx_obj1 in range(num_objs):
                 print '\t[%d/%d]' % (idx_obj1+1, num_objs)
                 
-                som = soms[act]
-                
-                str1 = self.sound_fft_to_string(objs_ffts[idx_obj1][1], som)
-                row = []
+                # whole row of distances in one batch
+                row = self.sound_seq_distances_str(strs[idx_obj1], strs)
+                #delta = 0.1
+                #row = np.exp(-row ** 2 / (2. * delta ** 2))
                 
-                for idx_obj2 in range(num_objs):
-                    #print '\t\tComputing distance between %s and %s objects' % (objs_ffts[idx_obj1][0], objs_ffts[idx_obj2][0])
-                    str2 = self.sound_fft_to_string(objs_ffts[idx_obj2][1], som)
-                    dist = self.sound_seq_distance_str(str1, str2)
-                    #dist = math.exp(-(dist-1)/0.5) / math.exp(0)
-                    #delta = 0.1
-                    #row.append(np.exp(-dist ** 2 / (2. * delta ** 2)))
-                    #row.append(1.0/dist if dist > 0.0 else 1)
-                    row.append(dist)
-                    #print '\t\t\tdistance = %f' % row[-1]
-                    
                 affinity_by_action[act].append(row)
                 
             var = np.asarray(affinity_by_action[act]).var()
@@ -1095,7 +1035,10 @@ class AudioClassifier():
             for object_name in self.object_names:
                 probs_by_action[action_name][object_name] = np.zeros((0,num_objects))
                 
-        for sampling,action_name,object_names,sampling_probs in res:
+        for sampling,action_name,object_names,test_sequences,knn_model in res:
+            print 'Action %s, Sampling %d, classifying %d test instances' % (action_name.upper(), sampling, len(test_sequences))
+            sampling_probs = self.confusion_probabilities(test_sequences, knn_model)
+            
             for idx,object_name in enumerate(object_names):
                 probs_by_action[action_name][object_name] = np.vstack((probs_by_action[action_name][object_name],sampling_probs[idx]))
             
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Compares the batched NWAligner against the nwalign based distance used by
+AudioClassifier.sound_seq_distance_str, checks that both produce the same
+distances and reports the time spent on one kNN query.
+
+usage: benchmark_nw_align.py [num_candidates] [min_len] [max_len]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from audio_read import AudioClassifier
+from nw_align import NWAligner, som_cost_matrix
+
+
+def random_sequences(num, min_len, max_len, map_side):
+    # random walks over the SOM grid look a lot more like real sounds than
+    # independent symbols do
+    result = []
+
+    for n in np.random.randint(min_len, max_len+1, num):
+        steps = np.random.randint(-1, 2, (n, 2))
+        units = np.clip(np.cumsum(steps, axis=0) + map_side // 2, 0, map_side-1)
+        result.append(''.join(chr(x * map_side + y + 48) for x,y in units))
+
+    return result
+
+
+if __name__ == '__main__':
+    num_candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    min_len = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    max_len = int(sys.argv[3]) if len(sys.argv) > 3 else 250
+
+    ac = AudioClassifier()
+    ac.generate_cost_matrix()
+
+    map_side = ac.params['som_size']
+    aligner = NWAligner(som_cost_matrix(map_side), ac.params['nw_gap_open'], ac.params['nw_gap_extend'])
+
+    query = random_sequences(1, min_len, max_len, map_side)[0]
+    candidates = np.asarray(random_sequences(num_candidates, min_len, max_len, map_side))
+
+    print 'Aligning 1 query against %d candidates (length %d-%d)' % (num_candidates, min_len, max_len)
+
+    start = time.time()
+    expected = np.asarray([ac.nwalign_distance_str(query, c) for c in candidates])
+    nw_time = time.time() - start
+    print 'nwalign:   %.3f sec (%.1f alignments/sec)' % (nw_time, num_candidates / nw_time)
+
+    start = time.time()
+    got = aligner.distances(query, candidates)
+    np_time = time.time() - start
+    print 'NWAligner: %.3f sec (%.1f alignments/sec)' % (np_time, num_candidates / np_time)
+
+    print 'speedup:   %.2fx' % (nw_time / np_time)
+    print 'max abs difference: %g' % np.abs(got - expected).max()
@@ -4,20 +4,24 @@ import sys
 import pickle
 import math
 import os
+import time
 from array import array
+from threading import Thread
+from Queue import Queue
 from operator import itemgetter
 
 import rospy
 
 import pylab as pl
 import numpy as np
-import matplotlib
 from scipy.ndimage.filters import gaussian_filter1d
 
-import nwalign as nw
 from scikits.learn.cluster import SelfOrganizingMap
-from Bio import kNN
 
+from nw_align import NWAligner, NwalignAligner, som_cost_matrix
+from som_encode import SomEncoder, stringify_units
+from sound_features import binned_specgram
+from sound_stream import SoundStream
 ############################################################################
 #
 # ROS node for SOM/K nearest neighbors classification of audio 
@@ -27,6 +31,8 @@ from Bio import kNN
 __author__ = 'Antons Rebguns, antons@email.arizona.edu; Daniel Ford, dford@email.arizona.edu'
 
 from ua_audio_capture.srv import *
+from ua_audio_capture.msg import SoundClassification
+from ua_audio_msgs.msg import AudioRawStream
 
 class classifyNode():
 
@@ -40,6 +46,78 @@ class classifyNode():
         # load previously trained SOM and knn_model from pkl files
         self.som = pickle.load(open('/tmp/som.pkl'))
         self.knn_model = pickle.load(open('/tmp/knn_model.pkl'))
+        self.encoder = SomEncoder(self.som, 6)
+
+        # ~nw_engine picks the aligner like AudioClassifier's nw_engine does,
+        # nwalign needs the SOM cost matrix in /tmp/som.costs
+        if rospy.get_param('~nw_engine', 'nwalign') == 'nwalign':
+            self.aligner = NwalignAligner('/tmp/som.costs', gap_open=0, gap_extend=-5)
+        else:
+            self.aligner = NWAligner(som_cost_matrix(6), gap_open=0, gap_extend=-5)
+            
+        # training sequences are prepared for the aligner once
+        self.training_seqs = self.aligner.prepare(self.knn_model.xs)
+
+        # run one classification so the first real sound doesn't pay for
+        # lazy initialization
+        self.classify_sequence(self.knn_model.xs[0])
+
+        # streaming mode: classify sounds straight off the audio topic and
+        # publish the result as soon as a sound ends
+        if rospy.get_param('~streaming', False):
+            self.start_streaming()
+
+    def start_streaming(self):
+        self.stream = SoundStream(onset_threshold=rospy.get_param('~onset_threshold', 0.02),
+                                  offset_threshold=rospy.get_param('~offset_threshold', 0.01),
+                                  silence_duration=rospy.get_param('~silence_duration', 0.05),
+                                  max_duration=rospy.get_param('~max_duration', 2.0),
+                                  encoder=self.encoder)
+
+        # sounds are classified on a separate thread so the audio callback
+        # never falls behind the stream
+        self.sounds = Queue()
+        self.rate_warned = False
+        self.classification_pub = rospy.Publisher('~classification', SoundClassification)
+
+        worker = Thread(target=self.process_sounds)
+        worker.daemon = True
+        worker.start()
+
+        audio_topic = rospy.get_param('~audio_topic', 'audio_capture/audio')
+        rospy.Subscriber(audio_topic, AudioRawStream, self.process_audio)
+        print "Streaming classification of %s" % audio_topic
+
+    # audio topic callback, feeds the sound detector
+    def process_audio(self, msg):
+        if msg.sample_rate != self.stream.sampling_rate and not self.rate_warned:
+            rospy.logwarn('Audio is sampled at %d Hz, model expects %d Hz' % (msg.sample_rate, self.stream.sampling_rate))
+            self.rate_warned = True
+
+        samples = np.asarray(msg.samples, dtype=np.float64)
+        if msg.num_channels > 1: samples = samples[::msg.num_channels]
+
+        received = rospy.Time.now()
+
+        for sound in self.stream.add_samples(samples):
+            self.sounds.put((sound, received, time.time()))
+
+    # publishes a classification for every sound the detector finishes
+    def process_sounds(self):
+        while not rospy.is_shutdown():
+            sound, received, detected = self.sounds.get()
+            mostLikely, beliefDict = self.classify_sequence(sound.sequence)
+
+            msg = SoundClassification()
+            msg.stamp = received
+            msg.duration = (sound.end - sound.start) / float(self.stream.sampling_rate)
+            msg.label = str(mostLikely)
+            msg.objectNames = [str(k) for k in beliefDict.keys()]
+            msg.beliefs = beliefDict.values()
+            msg.latency = time.time() - detected
+            self.classification_pub.publish(msg)
+
+            rospy.loginfo('Classified %.2f s sound as %s in %.1f ms' % (msg.duration, msg.label, msg.latency * 1000))
 
     # callback that handles actual work
     def _handleSvcRequest(self, req):
@@ -64,15 +142,21 @@ class classifyNode():
         Returns a tuple containing a highest probability label and a dictionary of
         all label probabilities.
         """
-        sequence = []
+        return self.classify_sequence(self.encoder.sound_fft_to_string(sound_fft))
+
+    # kNN classification of an already encoded sound
+    def classify_sequence(self, sequence):
+        # same as Bio's kNN.calculate, but all training sequences are aligned
+        # against the new sound in one batch and weighed by their distance
+        dists = self.aligner.distances(sequence, self.training_seqs)
+        weights = {}
         
-        for col in range(sound_fft.shape[1]):
-            sequence.append(self.som.bmu(sound_fft[:,col]))
+        for klass in self.knn_model.classes:
+            weights[klass] = 0.0
             
-        weights = kNN.calculate(self.knn_model,
-                                self.stringify_sequence(sequence),
-                                weight_fn=self.knn_weight_fn,
-                                distance_fn=self.sound_seq_distance_str)
+        for i in np.argsort(dists, kind='mergesort')[:self.knn_model.k]:
+            klass = self.knn_model.ys[i]
+            weights[klass] += self.knn_weight_fn(dists[i])
                               
         sum_weights = float(sum(weights.values()))
         
@@ -115,25 +199,10 @@ class classifyNode():
         end = start + int(fft_time_after_peak * sampling_rate)
         s = s[start:end]
         
-        Pxx,freqs,t = matplotlib.mlab.specgram(s, NFFT=fft_n, Fs=sampling_rate, noverlap=fft_overlap)
-        Pxx = 20 * np.log10(Pxx)
-        freqs /= 1000.0
-        
-        l = np.linspace(0, Pxx.shape[0], fft_freq_bins+1)
-        fft_binned = np.empty((fft_freq_bins,Pxx.shape[1]))
-        
-        for i in range(len(l)-1):
-            lis = int(l[i])
-            lie = int(l[i+1])
-            t = Pxx[lis:lie,:]
-            fft_binned[i] = t.mean(axis=0)
-            
-        #processed_fft.append(fft_binned)
-        
-        return fft_binned
+        # same features the streaming mode computes frame by frame
+        return binned_specgram(s, fft_n, fft_overlap, fft_freq_bins, sampling_rate)
 
-    def knn_weight_fn(self,x, y):
-        #dist = sound_seq_distance_str(x, y)
+    def knn_weight_fn(self, dist):
         return 1#math.exp(dist)
 
     def rebin_time_fixed_width(self, s, w):
@@ -158,24 +227,11 @@ class classifyNode():
         input  = [(1,2),(2,3) ...]
         output = 'ab....'
         """
-        map_side = 6
-        result = []
-        for t in seq:
-            idx = t[0] * map_side + t[1]
-            ascii_idx = idx + 48
-            result.append(chr(ascii_idx))
-        return ''.join(result)
+        return stringify_units(seq, 6)
 
     # compares two strings and returns the distance between them
-    # requires som.costs file to be in /tmp
     def sound_seq_distance_str(self,seq1_str, seq2_str):
-        seq1_str = np.asanyarray(seq1_str)
-        seq2_str = np.asanyarray(seq2_str)
-        
-        align = nw.global_align(seq1_str.tostring(), seq2_str.tostring(), gap_open=0, gap_extend=-5, matrix='/tmp/som.costs')
-        len1 = len(seq1_str.tostring())
-        len2 = len(seq2_str.tostring())
-        return (-nw.score_alignment(*align, gap_open=0, gap_extend=-5, matrix='/tmp/som.costs'))/(len1+len2+0.0)
+        return self.aligner.distance(seq1_str, seq2_str)
 
     # find the start of a sound
     def find_sound_start(self,rawAudio):
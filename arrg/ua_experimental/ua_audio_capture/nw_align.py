@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+In-process Needleman-Wunsch alignment of SOM sequence strings.
+
+Reproduces the scores of nwalign.global_align followed by
+nwalign.score_alignment (including nwalign's gap bookkeeping and tie
+breaking) but keeps the cost matrix in memory and scores a whole batch of
+candidate sequences against one query at once. Every DP row is computed for
+all candidates in a single pass; the horizontal gap recurrence is turned
+into a running maximum so no per-cell Python loop is needed.
+
+NwalignAligner offers the same interface on top of nwalign itself, whose C
+kernel is faster per alignment than the batched one, so callers can switch
+engines without changing anything else.
+"""
+
+import math
+
+import numpy as np
+import nwalign as nw
+
+
+# traceback pointers, same values nwalign uses
+UP, LEFT, DIAG, NONE = 1, 2, 3, 4
+
+# upper bounds on the number of alignments and on the size of the pointer
+# tensor (bytes) handled in one batch
+MAX_CHUNK_SIZE = 256
+MAX_CHUNK_CELLS = 1 << 25
+
+
+def som_cost_matrix(map_side):
+    """
+    Builds the substitution matrix written out by
+    AudioClassifier.generate_cost_matrix, indexed by ASCII code of the
+    stringified SOM units ('0' is unit (0,0)).
+    """
+    costs = np.zeros((256, 256), dtype=np.int64)
+    n = map_side * map_side
+    star = ord('*')
+
+    for x in range(map_side):
+        for y in range(map_side):
+            a = x * map_side + y + 48
+            for i in range(map_side):
+                for j in range(map_side):
+                    dist = math.sqrt(math.pow(j - y, 2.0) + math.pow(i - x, 2.0)) * 10
+                    costs[a, i * map_side + j + 48] = -int(dist)
+
+    costs[48:48+n, star] = -10
+    costs[star, 48:48+n] = -10
+    costs[star, star] = 1
+
+    return costs
+
+
+def load_cost_matrix(path):
+    """
+    Reads a scoring matrix in the NCBI format (the one nwalign accepts) into
+    an ASCII-indexed array.
+    """
+    costs = np.zeros((256, 256), dtype=np.int64)
+    f = open(path, 'r')
+
+    headers = None
+    while headers is None:
+        line = f.readline().strip()
+        if line[0] == '#': continue
+        headers = [ord(x) for x in line.split(' ') if x]
+
+    for row, line in zip(headers, f):
+        vals = [int(x) for x in line.split()[1:]]
+        for col, val in zip(headers, vals):
+            costs[row, col] = val
+
+    f.close()
+    return costs
+
+
+def encode(seq_str):
+    """Turns a sequence string into an array of ASCII codes."""
+    return np.array(bytearray(str(seq_str)), dtype=np.intp)
+
+
+def pad_sequences(seqs):
+    """Packs a list of code arrays into a zero padded 2D array plus lengths."""
+    lens = np.array([len(s) for s in seqs], dtype=np.intp)
+    width = max([1] + [len(s) for s in seqs])
+    padded = np.zeros((len(seqs), width), dtype=np.intp)
+
+    for idx, s in enumerate(seqs):
+        padded[idx,:len(s)] = s
+
+    return padded, lens
+
+
+class NWAligner():
+    def __init__(self, costs, gap_open=0, gap_extend=-5):
+        assert gap_extend <= 0, 'gap_extend penalty must be <= 0'
+        assert gap_open <= 0, 'gap_open must be <= 0'
+
+        self.costs = np.asarray(costs, dtype=np.int64)
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+
+
+    def prepare(self, seq_strs):
+        """
+        Encodes a list of candidate strings once so repeated queries against the
+        same set (e.g. a kNN training set) skip the conversion.
+        """
+        return [encode(s) for s in seq_strs]
+
+
+    def score(self, seq1_str, seq2_str):
+        """Alignment score of two sequences, same as nwalign would report."""
+        return self.scores(seq1_str, [seq2_str])[0]
+
+
+    def distance(self, seq1_str, seq2_str):
+        """Length normalized negative alignment score (AudioClassifier metric)."""
+        return self.distances(seq1_str, [seq2_str])[0]
+
+
+    def distances(self, query, candidates):
+        """
+        Distances from query to every candidate. Candidates may be strings or
+        the output of prepare().
+        """
+        q = query if isinstance(query, np.ndarray) else encode(query)
+        cands = [c if isinstance(c, np.ndarray) else encode(c) for c in candidates]
+        lens = np.array([len(c) for c in cands], dtype=float)
+
+        return -self.scores(q, cands) / (len(q) + lens)
+
+
+    def scores(self, query, candidates):
+        """
+        Alignment scores of query (first argument to nwalign.global_align)
+        against each of the candidates (second argument).
+        """
+        q = query if isinstance(query, np.ndarray) else encode(query)
+        cands = [c if isinstance(c, np.ndarray) else encode(c) for c in candidates]
+        result = np.zeros(len(cands), dtype=np.int64)
+
+        if not cands: return result
+
+        # nwalign puts the longer sequence along the rows, on ties the second
+        # argument goes along the rows
+        cand_lens = np.array([len(c) for c in cands], dtype=np.intp)
+        cand_rows = np.nonzero(cand_lens >= len(q))[0]
+        query_rows = np.nonzero(cand_lens < len(q))[0]
+
+        for inds, cand_is_row in ((cand_rows, True), (query_rows, False)):
+            # sort by length so every chunk carries as little padding as possible
+            inds = inds[np.argsort(cand_lens[inds], kind='mergesort')]
+            start = 0
+
+            while start < len(inds):
+                # chunks of similar length, small enough to bound the pointer
+                # tensor and keep padding low
+                longest = max(cand_lens[inds[min(start+MAX_CHUNK_SIZE, len(inds))-1]], len(q)) + 2
+                chunk = max(1, min(MAX_CHUNK_SIZE, MAX_CHUNK_CELLS // (longest * longest)))
+                sel = inds[start:start+chunk]
+
+                c, c_lens = pad_sequences([cands[i] for i in sel])
+                qs, q_lens = pad_sequences([q] * len(sel))
+
+                if cand_is_row:
+                    result[sel] = self._align_batch(c, c_lens, qs, q_lens, self.costs.T)
+                else:
+                    result[sel] = self._align_batch(qs, q_lens, c, c_lens, self.costs)
+
+                start += chunk
+
+        return result
+
+
+    def _align_batch(self, rows, row_lens, cols, col_lens, score_costs):
+        """
+        Runs the DP for a batch of (row sequence, column sequence) pairs and
+        scores the traced alignments. score_costs is indexed by
+        [row symbol, column symbol] in the orientation score_alignment uses.
+        """
+        go = self.gap_open
+        ge = self.gap_extend
+
+        num, max_r = rows.shape
+        max_c = cols.shape[1]
+        bidx = np.arange(num)
+
+        # substitution profile of the column sequences against every symbol
+        # that occurs in the rows, each DP row then only needs a row gather
+        symbols, row_syms = np.unique(rows, return_inverse=True)
+        row_syms = row_syms.reshape(rows.shape)
+        profile = self.costs[symbols[:,np.newaxis,np.newaxis], cols[np.newaxis,:,:]].astype(np.int32)
+
+        pointer = np.empty((num, max_r+1, max_c+1), dtype=np.uint8)
+        pointer[:,0,0] = NONE
+        pointer[:,0,1:] = LEFT
+        pointer[:,1:,0] = UP
+
+        ramp = ge * np.arange(1, max_c+1, dtype=np.int32)
+        base = go + ramp - ge
+        col_valid = np.arange(1, max_c+1)[np.newaxis,:] <= col_lens[:,np.newaxis]
+        need_mask = not col_valid.all()
+
+        left_gap = np.empty(max_c, dtype=np.int32)
+        left_gap.fill(ge)
+        left_gap[0] = go
+
+        prev = np.empty((num, max_c+1), dtype=np.int32)
+        prev[:,0] = 0
+        prev[:,1:] = base
+        cur = np.empty_like(prev)
+        row_open = np.ones(num, dtype=bool)     # nwalign's agap_i[i-1] == 0
+
+        diag = np.empty((num, max_c), dtype=np.int32)
+        up = np.empty_like(diag)
+        left = np.empty_like(diag)
+        is_up = np.empty((num, max_c), dtype=bool)
+        is_diag = np.empty_like(is_up)
+        tmp = np.empty_like(is_up)
+
+        for i in range(1, max_r+1):
+            first = go + ge * (i - 1)
+            cur[:,0] = first
+
+            np.add(prev[:,:-1], profile[row_syms[:,i-1],bidx], out=diag)
+            np.add(prev[:,1:], np.where(row_open, go, ge)[:,np.newaxis], out=up)
+
+            # score[i,j] = max(up, diag, score[i,j-1] + gap) unrolled into a
+            # running maximum; the gap after column 0 costs gap_open and
+            # gap_extend after that
+            row = cur[:,1:]
+            np.maximum(up, diag, out=row)
+            row -= ramp
+            np.maximum.accumulate(row, axis=1, out=row)
+            row += ramp
+            np.maximum(row, base + first, out=row)
+
+            # pointers with nwalign's tie breaking
+            np.add(cur[:,:-1], left_gap, out=left)
+            np.greater_equal(up, diag, out=is_up)
+            np.greater(up, left, out=tmp)
+            is_up &= tmp
+            np.greater(diag, up, out=is_diag)
+            np.greater(diag, left, out=tmp)
+            is_diag &= tmp
+
+            ptr = pointer[:,i,1:]
+            ptr.fill(LEFT)
+            ptr += is_diag
+            ptr -= is_up
+
+            if need_mask: is_diag &= col_valid
+            row_open = is_diag.any(axis=1)
+
+            prev, cur = cur, prev
+
+        # walk all tracebacks in lockstep, scoring gap runs as score_alignment
+        # does (a run costs gap_open once and gap_extend for the rest)
+        i = row_lens.copy()
+        j = col_lens.copy()
+        total = np.zeros(num, dtype=np.int64)
+        in_gap = np.zeros(num, dtype=bool)
+
+        for step in range(max_r + max_c):
+            p = pointer[bidx,i,j]
+            active = p != NONE
+            if not active.any(): break
+
+            is_diag = p == DIAG
+            is_gap = active & ~is_diag
+
+            sub = score_costs[rows[bidx,i-1], cols[bidx,j-1]]
+            total += np.where(is_diag, sub, 0)
+            total += np.where(is_gap, np.where(in_gap, ge, go), 0)
+            in_gap = np.where(active, is_gap, in_gap)
+
+            i -= is_diag | (p == UP)
+            j -= is_diag | (p == LEFT)
+
+        return total
+
+
+class NwalignAligner():
+    """
+    NWAligner interface on top of nwalign, aligns one pair at a time with the
+    scoring matrix in matrix_file (e.g. the /tmp/som.costs written by
+    AudioClassifier.generate_cost_matrix).
+    """
+    def __init__(self, matrix_file, gap_open=0, gap_extend=-5):
+        self.matrix_file = matrix_file
+        self.costs = load_cost_matrix(matrix_file)
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+
+
+    def prepare(self, seq_strs):
+        return [str(s) for s in seq_strs]
+
+
+    def score(self, seq1_str, seq2_str):
+        align = nw.global_align(str(seq1_str), str(seq2_str), gap_open=self.gap_open, gap_extend=self.gap_extend, matrix=self.matrix_file)
+        return nw.score_alignment(*align, gap_open=self.gap_open, gap_extend=self.gap_extend, matrix=self.matrix_file)
+
+
+    def distance(self, seq1_str, seq2_str):
+        """Length normalized negative alignment score (AudioClassifier metric)."""
+        seq1_str = str(seq1_str)
+        seq2_str = str(seq2_str)
+        return -self.score(seq1_str, seq2_str) / (len(seq1_str) + len(seq2_str) + 0.0)
+
+
+    def distances(self, query, candidates):
+        """Distances from query to every candidate."""
+        query = str(query)
+        return np.array([self.distance(query, c) for c in candidates], dtype=float)
+
+
+    def scores(self, query, candidates):
+        query = str(query)
+        return np.array([self.score(query, c) for c in candidates], dtype=np.int64)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Persistent cache of pairwise SOM sequence distances.
+
+Distances only depend on the two sequence strings and on the aligner setup
+(engine, cost matrix and gap penalties), so the store lives in a directory
+named after a hash of the aligner setup. Only pairs that were actually
+aligned are stored: every batch of new distances is appended as a block
+file holding the sorted 64-bit keys of its pairs (built from hashes of the
+two strings) and their distances. Lookups binary search the blocks, missing
+pairs are aligned on a process pool and written as a new block, so repeated
+experiments over the same sequences only align new pairs.
+
+Blocks are never changed once written. Small ones are merged into one when
+there are too many of them, and the oldest blocks are removed whenever the
+store grows past its size limit.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+
+# don't bother starting a pool for fewer alignments than this
+MIN_PARALLEL_ALIGNMENTS = 200
+
+# oldest blocks are removed once the store is bigger than this (bytes)
+MAX_STORE_SIZE = 256 * 1024 * 1024
+
+# blocks with fewer pairs than this are merged once there are more than
+# MAX_SMALL_BLOCKS of them
+SMALL_BLOCK_PAIRS = 1 << 16
+MAX_SMALL_BLOCKS = 32
+
+BLOCK_SUFFIX = '.npz'
+
+# odd multiplier that mixes the first string's hash into the pair key
+PAIR_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def aligner_key(aligner):
+    """Hash of everything besides the sequences that affects a distance."""
+    h = hashlib.sha1()
+    h.update(aligner.__class__.__name__)
+    h.update(np.ascontiguousarray(aligner.costs, dtype=np.int64).tostring())
+    h.update(repr((aligner.gap_open, aligner.gap_extend)))
+    return h.hexdigest()[:16]
+
+
+def _align_row(args):
+    aligner, query, candidates = args
+    return aligner.distances(query, candidates)
+
+
+def align_rows(jobs, processes):
+    """
+    Runs (aligner, query, candidates) jobs, on a process pool if there is
+    enough work to make it worthwhile.
+    """
+    num_alignments = sum(len(job[2]) for job in jobs)
+
+    if num_alignments < MIN_PARALLEL_ALIGNMENTS or processes < 2:
+        return map(_align_row, jobs)
+
+    pool = Pool(processes=processes)
+    results = pool.map(_align_row, jobs)
+    pool.close()
+    pool.join()
+
+    return results
+
+
+def distance_matrix(aligner, seqs1, seqs2, processes=None):
+    """Uncached distance matrix between two lists of sequence strings."""
+    jobs = [(aligner, s, seqs2) for s in seqs1]
+    return np.asarray(align_rows(jobs, processes or cpu_count())).reshape(len(seqs1), len(seqs2))
+
+
+def sequence_hashes(seqs):
+    """64-bit hashes of a list of sequence strings."""
+    digests = ''.join(hashlib.sha1(s).digest()[:8] for s in seqs)
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+
+def pair_keys(hashes1, hashes2):
+    """Keys of the (hashes1[i], hashes2[i]) pairs, order matters."""
+    return (np.asarray(hashes1, dtype=np.uint64) * PAIR_MULTIPLIER) ^ np.asarray(hashes2, dtype=np.uint64)
+
+
+def drop_dense_stores(root):
+    """Removes stores in the old format (one dense NaN filled matrix)."""
+    if not os.path.isdir(root): return
+
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.exists(os.path.join(path, 'distances.dat')):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class DistanceCache():
+    def __init__(self, aligner, path, processes=None, max_size=MAX_STORE_SIZE):
+        self.aligner = aligner
+        self.root = path
+        self.symmetric = (aligner.costs == aligner.costs.T).all()
+        self.processes = processes or cpu_count()
+        self.max_size = max_size
+
+        self.path = os.path.join(path, aligner_key(aligner))
+
+        drop_dense_stores(path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        self.blocks = {}        # block file name -> (sorted keys, distances)
+        self._refresh()
+
+
+    def __getstate__(self):
+        # only the configuration travels to other processes, the blocks are
+        # read again there
+        return {'aligner': self.aligner, 'root': self.root, 'processes': self.processes, 'max_size': self.max_size}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['aligner'], state['root'], state['processes'], state['max_size'])
+
+
+    def __len__(self):
+        return sum(len(keys) for keys, _ in self.blocks.values())
+
+
+    def _block_names(self):
+        """Block files in the store, oldest first."""
+        return sorted(name for name in os.listdir(self.path) if name.endswith(BLOCK_SUFFIX) and not name.startswith('.'))
+
+
+    def _refresh(self):
+        """Reads blocks other processes added, forgets the ones they removed."""
+        names = self._block_names()
+
+        for name in set(self.blocks) - set(names):
+            del self.blocks[name]
+
+        for name in names:
+            if name in self.blocks: continue
+
+            try:
+                block = np.load(os.path.join(self.path, name))
+                self.blocks[name] = (block['keys'], block['distances'])
+                block.close()
+            except (IOError, OSError):
+                # removed by another process in the meantime
+                pass
+
+
+    def _write_block(self, keys, distances):
+        keys, first = np.unique(keys, return_index=True)
+        distances = distances[first]
+
+        # names sort by creation time, the pid keeps concurrent writers apart
+        name = '%020d-%d%s' % (int(time.time() * 1e6), os.getpid(), BLOCK_SUFFIX)
+        tmp_file = os.path.join(self.path, '.tmp-' + name)
+        np.savez(tmp_file, keys=keys, distances=distances)
+        os.rename(tmp_file, os.path.join(self.path, name))
+
+        self.blocks[name] = (keys, distances)
+
+
+    def _remove_blocks(self, names):
+        for name in names:
+            self.blocks.pop(name, None)
+
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+
+    def _compact(self):
+        """Merges small blocks, then removes the oldest blocks while the store is too big."""
+        small = [name for name in sorted(self.blocks) if len(self.blocks[name][0]) < SMALL_BLOCK_PAIRS]
+
+        if len(small) > MAX_SMALL_BLOCKS:
+            keys = np.concatenate([self.blocks[name][0] for name in small])
+            distances = np.concatenate([self.blocks[name][1] for name in small])
+            self._write_block(keys, distances)
+            self._remove_blocks(small)
+
+        sizes = []
+        for name in self._block_names():
+            try:
+                sizes.append((name, os.path.getsize(os.path.join(self.path, name))))
+            except OSError:
+                pass
+
+        total = sum(size for _, size in sizes)
+
+        for name, size in sizes[:-1]:
+            if total <= self.max_size: break
+            self._remove_blocks([name])
+            total -= size
+
+
+    def lookup(self, keys):
+        """Stored distances of an array of pair keys, NaN for pairs never aligned."""
+        result = np.empty(keys.shape)
+        result.fill(np.nan)
+
+        for block_keys, block_distances in self.blocks.values():
+            if not len(block_keys): continue
+
+            idx = np.minimum(np.searchsorted(block_keys, keys), len(block_keys) - 1)
+            found = block_keys[idx] == keys
+            result[found] = block_distances[idx[found]]
+
+        return result
+
+
+    def distances(self, query, seqs):
+        """Distances from query to every sequence in seqs."""
+        return self.matrix([query], seqs)[0]
+
+
+    def matrix(self, seqs1, seqs2):
+        """
+        Distance matrix between two lists of sequence strings, element [i,j] is
+        the distance from seqs1[i] to seqs2[j]. Pairs not in the cache yet are
+        aligned (in parallel if there are enough of them) and stored.
+        """
+        useqs1, rows = np.unique([str(s) for s in seqs1], return_inverse=True)
+        useqs2, cols = np.unique([str(s) for s in seqs2], return_inverse=True)
+        hashes1 = sequence_hashes(useqs1)
+        hashes2 = sequence_hashes(useqs2)
+
+        self._refresh()
+        keys = pair_keys(hashes1[:,np.newaxis], hashes2[np.newaxis,:])
+        dists = self.lookup(keys)
+        missing = np.isnan(dists)
+
+        if missing.any():
+            jobs = []
+            job_rows = []
+
+            for r in np.nonzero(missing.any(axis=1))[0]:
+                cs = np.nonzero(missing[r])[0]
+                jobs.append((self.aligner, useqs1[r], list(useqs2[cs])))
+                job_rows.append((r, cs))
+
+            results = align_rows(jobs, self.processes)
+            lens1 = np.array([len(s) for s in useqs1])
+            lens2 = np.array([len(s) for s in useqs2])
+            new_keys = [keys[missing]]
+            new_dists = []
+
+            for (r, cs), row_dists in zip(job_rows, results):
+                dists[r,cs] = row_dists
+
+                # with a symmetric cost matrix the alignment only depends on the
+                # argument order when both sequences are of the same length
+                if self.symmetric:
+                    mirror = lens2[cs] != lens1[r]
+                    new_keys.append(pair_keys(hashes2[cs[mirror]], hashes1[r]))
+                    new_dists.append(np.asarray(row_dists)[mirror])
+
+            new_dists.insert(0, dists[missing])
+            self._write_block(np.concatenate(new_keys), np.concatenate(new_dists))
+            self._compact()
+
+        return dists[np.ix_(rows, cols)]
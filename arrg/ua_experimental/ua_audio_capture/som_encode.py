@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Batched best-matching-unit lookup for a trained SelfOrganizingMap.
+
+som.bmu() compares one vector against every unit at a time, encoding a sound
+that way costs a Python call per spectrogram column. SomEncoder keeps the
+unit weights as a (units x dim) matrix and finds the best matching units of
+a whole spectrogram (or of a whole corpus stacked side by side) with one
+matrix product. Units are numbered row-major, (x, y) -> x * map_side + y,
+and turned into sequence strings through a lookup table ('0' is unit 0).
+"""
+
+import numpy as np
+
+
+# first character of the SOM alphabet
+FIRST_SYMBOL = 48
+
+# columns handled per matrix product, bounds the (columns x units) temporaries
+MAX_CHUNK_COLUMNS = 1 << 16
+
+# relative gap between the two closest units below which the winner is
+# recomputed from explicit differences, the expanded product is not exact
+TIE_TOLERANCE = 1e-9
+
+
+def symbol_table(map_side):
+    """Lookup table from unit number to sequence character."""
+    return np.arange(FIRST_SYMBOL, FIRST_SYMBOL + map_side * map_side).astype(np.uint8)
+
+
+def units_to_string(units, table):
+    """Translates an array of unit numbers into a sequence string."""
+    return table[np.asarray(units, dtype=np.intp)].tostring()
+
+
+def stringify_units(seq, map_side):
+    """
+    input  = [(1,2),(2,3) ...]
+    output = 'ab....'
+    """
+    if len(seq) == 0: return ''
+
+    coords = np.asarray(seq, dtype=np.intp).reshape(-1, 2)
+    return units_to_string(coords[:,0] * map_side + coords[:,1], symbol_table(map_side))
+
+
+class SomEncoder():
+    def __init__(self, som, map_side):
+        neurons = np.asarray(som.neurons_, dtype=np.float64)
+
+        self.map_side = map_side
+        self.weights = neurons.reshape(-1, neurons.shape[-1])
+        self.weights_sq = (self.weights ** 2).sum(axis=1)
+        self.table = symbol_table(map_side)
+
+        assert len(self.weights) == map_side * map_side, 'SOM has %d units, expected %d' % (len(self.weights), map_side * map_side)
+
+
+    def units(self, columns):
+        """
+        Best matching unit of every row of a (num x dim) array, same choice
+        som.bmu() makes for each of them (first unit on exact ties).
+        """
+        columns = np.asarray(columns, dtype=np.float64)
+        result = np.empty(len(columns), dtype=np.intp)
+
+        for start in range(0, len(columns), MAX_CHUNK_COLUMNS):
+            x = columns[start:start+MAX_CHUNK_COLUMNS]
+
+            # |w - x|^2 = |w|^2 - 2 w.x + |x|^2, the last term is the same for
+            # every unit and only matters for the tie check below
+            dist = np.dot(x, self.weights.T)
+            dist *= -2
+            dist += self.weights_sq
+
+            rows = np.arange(len(x))
+            best = dist.argmin(axis=1)
+
+            if dist.shape[1] > 1:
+                best_dist = dist[rows,best]
+                dist[rows,best] = np.inf
+                gap = dist.min(axis=1) - best_dist
+
+                x_sq = np.einsum('ij,ij->i', x, x)
+                scale = np.abs(best_dist + x_sq) + x_sq + 1.0
+
+                for idx in np.nonzero(gap <= TIE_TOLERANCE * scale)[0]:
+                    exact = ((self.weights - x[idx]) ** 2).sum(axis=1)
+                    best[idx] = exact.argmin()
+
+            result[start:start+len(x)] = best
+
+        return result
+
+
+    def sound_fft_to_string(self, sound_fft):
+        """Sequence string of a (bins x frames) spectrogram."""
+        return units_to_string(self.units(np.asarray(sound_fft).T), self.table)
+
+
+    def sound_ffts_to_strings(self, sound_ffts):
+        """
+        Sequence strings of a list of spectrograms, all their columns are mapped
+        in one go.
+        """
+        if not sound_ffts: return []
+
+        lens = [sound_fft.shape[1] for sound_fft in sound_ffts]
+        units = self.units(np.hstack(sound_ffts).T)
+        symbols = self.table[units].tostring()
+        bounds = np.concatenate(([0], np.cumsum(lens)))
+
+        return [symbols[bounds[i]:bounds[i+1]] for i in range(len(sound_ffts))]
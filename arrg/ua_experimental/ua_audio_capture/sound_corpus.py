@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Reader for sound corpora recorded by audio_dump.py. Every recording session
+consists of a .rawsound file (native doubles, one after another) and a
+.desc file with one 'action_id object_id offset length' line per sound.
+
+Each .rawsound file is memory-mapped once and every sound is handed out as a
+read-only NumPy view into that map, so nothing gets copied or converted to
+Python lists and only the pages that are actually touched are read from
+disk.
+"""
+
+import os
+from fnmatch import fnmatch
+
+import numpy as np
+
+
+class SoundClip():
+    def __init__(self, action, obj, path, offset, sound):
+        self.action = action    # action label
+        self.object = obj       # object label
+        self.path = path        # .rawsound file the sound came from
+        self.offset = offset    # offset of the first sample in that file
+        self.sound = sound      # view into the memory-mapped file
+
+    def __len__(self):
+        return len(self.sound)
+
+
+class SoundCorpus():
+    def __init__(self, data_paths, actions, objects):
+        self.data_paths = data_paths
+        self.actions = actions
+        self.objects = objects
+        self.maps = {}
+
+
+    def sessions(self):
+        """(directory, session name) pairs, in the order os.listdir reports them."""
+        for path in self.data_paths:
+            for fname in os.listdir(path):
+                if fnmatch(fname, '*.desc'):
+                    yield path, os.path.splitext(fname)[0]
+
+
+    def sound_map(self, rawsound_file):
+        """Memory map of a whole .rawsound file, opened once per corpus."""
+        if rawsound_file not in self.maps:
+            if os.path.getsize(rawsound_file) == 0:
+                self.maps[rawsound_file] = np.zeros(0, dtype=np.float64)
+            else:
+                self.maps[rawsound_file] = np.memmap(rawsound_file, dtype=np.float64, mode='r')
+
+        return self.maps[rawsound_file]
+
+
+    def clips(self):
+        """Yields a SoundClip for every descriptor in the corpus."""
+        for path, name in self.sessions():
+            desc_file = open(os.path.join(path, name + '.desc'), 'r')
+            descriptors = desc_file.read().split('\n')
+            desc_file.close()
+
+            rawsound_file = os.path.join(path, name + '.rawsound')
+            sound_map = self.sound_map(rawsound_file)
+
+            for descriptor in descriptors:
+                if not descriptor: continue
+
+                action_id, object_id, offset, length = [int(x) for x in descriptor.split()]
+
+                yield SoundClip(self.actions[action_id],
+                                self.objects[object_id],
+                                rawsound_file,
+                                offset,
+                                sound_map[offset:offset+length])
+
+
+    def close(self):
+        """Drops all memory maps, views handed out earlier keep theirs alive."""
+        self.maps = {}
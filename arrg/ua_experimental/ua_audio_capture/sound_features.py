@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Spectrogram features for sound clips, computed on a process pool and cached
+on disk.
+
+The cache keeps one compressed .npz file per .rawsound file and parameter
+set (fft_n, fft_overlap, fft_freq_bins). The file name includes a hash of
+the recording's path, size and modification time, so re-recorded sessions
+and new parameter values get fresh files while old ones stay around for
+later sweeps. Inside a file every clip is stored together with the
+descriptor offset/length and the start/end samples it was cut at, a clip is
+only reused when all of those still match.
+"""
+
+import os
+import hashlib
+
+import numpy as np
+from matplotlib import mlab
+
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+
+SAMPLING_RATE = 44100
+
+
+def binned_specgram(sound, fft_n, fft_overlap, fft_freq_bins, sampling_rate=SAMPLING_RATE):
+    """
+    Log power spectrogram of a sound averaged into fft_freq_bins frequency
+    bands, returns a (fft_freq_bins x frames) array.
+    """
+    Pxx,freqs,t = mlab.specgram(sound, NFFT=fft_n, Fs=sampling_rate, noverlap=fft_overlap)
+    Pxx = 20 * np.log10(Pxx)
+
+    # band edges as int(linspace(...)), every band is a mean over its rows
+    edges = np.linspace(0, Pxx.shape[0], fft_freq_bins+1).astype(int)
+    counts = np.diff(edges)
+
+    sums = np.add.reduceat(Pxx, np.minimum(edges[:-1], Pxx.shape[0]-1), axis=0)
+    sums[counts == 0] = np.nan
+
+    return sums / np.maximum(counts, 1)[:,np.newaxis]
+
+
+def _clip_features(args):
+    rawsound_file, begin, end, fft_n, fft_overlap, fft_freq_bins = args
+    sound = np.memmap(rawsound_file, dtype=np.float64, mode='r')[begin:end]
+    return binned_specgram(sound, fft_n, fft_overlap, fft_freq_bins)
+
+
+class FeatureStore():
+    def __init__(self, path, processes=None):
+        self.path = path    # None disables caching
+        self.processes = processes or cpu_count()
+
+        if self.path and not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+
+    def cache_file(self, rawsound_file, fft_n, fft_overlap, fft_freq_bins):
+        if not self.path: return None
+
+        st = os.stat(rawsound_file)
+        h = hashlib.sha1()
+        h.update(repr((os.path.abspath(rawsound_file), st.st_size, st.st_mtime, fft_n, fft_overlap, fft_freq_bins)))
+        name = os.path.splitext(os.path.basename(rawsound_file))[0]
+        return os.path.join(self.path, '%s-%s.npz' % (name, h.hexdigest()[:16]))
+
+
+    def load(self, cache_file):
+        """Cached features of one recording keyed on (offset, length, start, end)."""
+        if not cache_file or not os.path.exists(cache_file): return {}
+
+        data = np.load(cache_file)
+        keys = data['keys']
+        features = np.split(data['features'], np.cumsum(data['frames'])[:-1], axis=1)
+        data.close()
+
+        return dict((tuple(k), f) for k, f in zip(keys, features))
+
+
+    def save(self, cache_file, entries):
+        keys = sorted(entries.keys())
+        features = [entries[k] for k in keys]
+
+        tmp_file = cache_file + '.tmp.npz'
+        np.savez_compressed(tmp_file,
+                            keys=np.array(keys, dtype=np.int64).reshape(-1, 4),
+                            frames=np.array([f.shape[1] for f in features], dtype=np.int64),
+                            features=np.hstack(features))
+        os.rename(tmp_file, cache_file)
+
+
+    def features(self, clips, start_times, end_times, fft_n, fft_overlap, fft_freq_bins):
+        """
+        Binned spectrograms of clips (sound_corpus.SoundClip) cut at the given
+        start and end samples. Cached clips are loaded, the rest are computed
+        in parallel and added to the cache.
+        """
+        result = [None] * len(clips)
+        todo = []
+        by_file = {}
+
+        for idx, clip in enumerate(clips):
+            by_file.setdefault(clip.path, []).append(idx)
+
+        caches = {}
+
+        for rawsound_file, inds in by_file.items():
+            cache_file = self.cache_file(rawsound_file, fft_n, fft_overlap, fft_freq_bins)
+            cached = self.load(cache_file)
+            caches[rawsound_file] = (cache_file, cached, False)
+
+            for idx in inds:
+                key = (clips[idx].offset, len(clips[idx]), int(start_times[idx]), int(end_times[idx]))
+
+                if key in cached:
+                    result[idx] = cached[key]
+                else:
+                    todo.append((idx, key))
+
+        print 'Features for %d of %d clips found in cache, computing %d' % (len(clips) - len(todo), len(clips), len(todo))
+
+        if todo:
+            jobs = []
+            for idx, key in todo:
+                # same samples as clip.sound[start:end]
+                offset, length, start, end = key
+                begin = offset + min(start, length)
+                jobs.append((clips[idx].path, begin, max(begin, offset + min(end, length)), fft_n, fft_overlap, fft_freq_bins))
+
+            if len(jobs) > 1 and self.processes > 1:
+                pool = Pool(processes=self.processes)
+                computed = pool.map(_clip_features, jobs)
+                pool.close()
+                pool.join()
+            else:
+                computed = map(_clip_features, jobs)
+
+            for (idx, key), features in zip(todo, computed):
+                result[idx] = features
+                cache_file, cached, dirty = caches[clips[idx].path]
+                cached[key] = features
+                caches[clips[idx].path] = (cache_file, cached, True)
+
+            for cache_file, cached, dirty in caches.values():
+                if dirty and cache_file: self.save(cache_file, cached)
+
+        return result
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Antons Rebguns. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+"""
+Incremental sound detection over a live audio stream.
+
+Samples are appended to a ring buffer as they arrive. A short-window
+amplitude envelope is tracked to find where a sound starts (envelope above
+onset_threshold) and where it stops (envelope below offset_threshold for
+silence_duration seconds, or max_duration seconds after the start).
+Spectrogram frames of the running sound are computed as soon as enough
+samples for them are in, and optionally turned into SOM units right away,
+so once the sound stops only the kNN step is left to do.
+
+Frames are computed with sound_features.binned_specgram on whole blocks of
+frames, which gives exactly the frames the same call produces on the
+complete clip (every frame only depends on its own fft_n samples).
+"""
+
+import numpy as np
+
+from sound_features import binned_specgram
+
+
+# waiting for a sound, inside a sound, waiting for quiet after a sound that
+# was cut at max_duration
+IDLE, ACTIVE, HOLD = 0, 1, 2
+
+
+class StreamedSound():
+    def __init__(self, start, end, sound_fft, sequence):
+        self.start = start              # first sample, counted from the stream start
+        self.end = end                  # one past the last sample
+        self.sound_fft = sound_fft      # binned spectrogram (bins x frames)
+        self.sequence = sequence        # SOM sequence string or None without an encoder
+
+
+class SoundStream():
+    def __init__(self,
+                 sampling_rate=44100,
+                 fft_n=512,
+                 fft_overlap=256,
+                 fft_freq_bins=33,
+                 envelope_window=0.01,
+                 onset_threshold=0.02,
+                 offset_threshold=0.01,
+                 silence_duration=0.05,
+                 pre_roll=0.05,
+                 max_duration=2.0,
+                 encoder=None):
+        self.sampling_rate = sampling_rate
+        self.fft_n = fft_n
+        self.fft_overlap = fft_overlap
+        self.fft_freq_bins = fft_freq_bins
+        self.hop = fft_n - fft_overlap
+
+        self.window = max(1, int(envelope_window * sampling_rate))
+        self.onset_threshold = onset_threshold
+        self.offset_threshold = offset_threshold
+        self.silence = int(silence_duration * sampling_rate)
+        self.pre_roll = int(pre_roll * sampling_rate)
+        self.max_length = int(max_duration * sampling_rate)
+        self.encoder = encoder
+
+        # a whole sound with its pre-roll and trailing silence plus one incoming
+        # chunk has to fit, longer inputs are split into chunks
+        self.max_chunk = self.pre_roll + self.max_length + self.silence + self.window + fft_n
+        self.capacity = 2 * self.max_chunk
+        self.buffer = np.zeros(self.capacity, dtype=np.float64)
+
+        self.reset()
+
+
+    def reset(self):
+        self.written = 0        # samples received so far
+        self.env_pos = 0        # start of the next envelope window
+        self.state = IDLE
+        self._start_sound(0)
+
+
+    def _start_sound(self, start):
+        self.sound_start = start
+        self.last_loud = start
+        self.frame_pos = start
+        self.frames = []
+        self.units = []
+
+
+    def samples(self, start, end):
+        """Samples [start, end) of the stream, they must still be in the buffer."""
+        assert self.written - self.capacity <= start <= end <= self.written, 'samples %d-%d are not buffered' % (start, end)
+
+        first = start % self.capacity
+        count = end - start
+
+        if first + count <= self.capacity:
+            return self.buffer[first:first+count]
+
+        split = self.capacity - first
+        return np.concatenate((self.buffer[first:], self.buffer[:count-split]))
+
+
+    def add_samples(self, samples):
+        """
+        Appends new samples to the stream, returns a list of StreamedSound for
+        every sound that ended within them.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        finished = []
+
+        for begin in range(0, len(samples), self.max_chunk):
+            chunk = samples[begin:begin+self.max_chunk]
+
+            first = self.written % self.capacity
+            split = min(len(chunk), self.capacity - first)
+            self.buffer[first:first+split] = chunk[:split]
+            self.buffer[:len(chunk)-split] = chunk[split:]
+            self.written += len(chunk)
+
+            finished.extend(self._process())
+
+        return finished
+
+
+    def _process(self):
+        finished = []
+
+        while self.env_pos + self.window <= self.written:
+            env_end = self.env_pos + self.window
+            level = np.abs(self.samples(self.env_pos, env_end)).mean()
+
+            if self.state == HOLD:
+                if level <= self.offset_threshold: self.state = IDLE
+            elif self.state == IDLE:
+                if level > self.onset_threshold:
+                    self.state = ACTIVE
+                    self._start_sound(max(0, self.env_pos - self.pre_roll, self.written - self.capacity))
+                    self.last_loud = env_end
+            else:
+                if level > self.offset_threshold:
+                    self.last_loud = env_end
+
+                quiet = env_end - self.last_loud >= self.silence
+
+                if quiet or env_end - self.sound_start >= self.max_length:
+                    end = min(self.last_loud, self.sound_start + self.max_length)
+                    self._compute_frames(end)
+                    sound = self._finish_sound(end)
+                    if sound is not None: finished.append(sound)
+                    self.state = IDLE if quiet else HOLD
+
+            self.env_pos = env_end
+
+        if self.state == ACTIVE:
+            self._compute_frames(min(self.written, self.sound_start + self.max_length))
+
+        return finished
+
+
+    def _compute_frames(self, end):
+        """Spectrogram frames that fit completely before sample end."""
+        num = (end - self.frame_pos - self.fft_n) // self.hop + 1
+        if num <= 0: return
+
+        block_end = self.frame_pos + self.fft_n + (num - 1) * self.hop
+        frames = binned_specgram(self.samples(self.frame_pos, block_end), self.fft_n, self.fft_overlap, self.fft_freq_bins, self.sampling_rate)
+
+        self.frames.append(frames)
+        if self.encoder is not None: self.units.append(self.encoder.sound_fft_to_string(frames))
+        self.frame_pos += num * self.hop
+
+
+    def _finish_sound(self, end):
+        # frames were computed up to the current position, drop the ones that
+        # reach past the end of the sound
+        num = (end - self.sound_start - self.fft_n) // self.hop + 1
+        if num <= 0: return None
+
+        sound_fft = np.hstack(self.frames)[:,:num]
+        sequence = ''.join(self.units)[:num] if self.encoder is not None else None
+
+        return StreamedSound(self.sound_start, end, sound_fft, sequence)
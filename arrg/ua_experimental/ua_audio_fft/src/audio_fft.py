@@ -4,11 +4,104 @@ import rospy
 import sys
 import traceback
 import getopt
-from scipy.fftpack import fft, fftshift
+import numpy as np
 
 from ua_audio_msgs.msg import AudioRawStream
 from ua_audio_msgs.msg import TransformedStream
 
+WINDOWS = {'none': None,
+           'hanning': np.hanning,
+           'hamming': np.hamming,
+           'blackman': np.blackman,
+           'bartlett': np.bartlett}
+
+class spectrum_frames(object):
+    """
+    Power spectra of overlapping frames of a sample stream.
+
+    Samples are kept in a preallocated buffer that stores every sample twice,
+    at i and at i + capacity, so the unprocessed samples are always one
+    contiguous run. All complete frames are then a strided view into that run
+    and get transformed with a single real-input FFT.
+    """
+
+    def __init__(self, wsz, ovr, window='none', capacity=0):
+        self.wsz = wsz      # samples per frame
+        self.ovr = ovr      # samples between the starts of two frames
+        self.nUniquePts = wsz // 2 + 1
+
+        if WINDOWS[window] is None:
+            self.window = None
+            norm = float(wsz)
+        else:
+            self.window = WINDOWS[window](wsz)
+            norm = self.window.sum()
+
+        # scale by the (window) length so the magnitude does not depend on the
+        # length of the frame, then double everything but the DC and Nyquist
+        # points to fold in the negative frequencies
+        self.gain = np.empty(self.nUniquePts)
+        self.gain.fill(2.0 / norm**2)
+        self.gain[0] = 1.0 / norm**2
+        if wsz % 2 == 0: self.gain[-1] = 1.0 / norm**2
+
+        self.capacity = max(capacity, 4 * wsz)
+        self.buffer = np.zeros(2 * self.capacity)
+        self.start = 0      # position of the oldest unprocessed sample
+        self.count = 0      # number of unprocessed samples
+
+    def add(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        n = len(samples)
+
+        if self.count + n > self.capacity:
+            self.grow(self.count + n)
+
+        # copy into both halves, splitting where the write wraps around
+        first = (self.start + self.count) % self.capacity
+        split = min(n, self.capacity - first)
+
+        for lo, hi, part in ((first, first + split, samples[:split]), (0, n - split, samples[split:])):
+            self.buffer[lo:hi] = part
+            self.buffer[lo + self.capacity:hi + self.capacity] = part
+
+        self.count += n
+
+    def grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed: capacity *= 2
+
+        pending = self.buffer[self.start:self.start + self.count].copy()
+        self.buffer = np.zeros(2 * capacity)
+        self.buffer[:self.count] = pending
+        self.buffer[capacity:capacity + self.count] = pending
+        self.capacity = capacity
+        self.start = 0
+
+    def frames(self):
+        """Power spectra of all complete frames, one row per frame, and drops them."""
+        if self.count < self.wsz:
+            return np.empty((0, self.nUniquePts))
+
+        num = (self.count - self.wsz) // self.ovr + 1
+        pending = self.buffer[self.start:self.start + self.count]
+        frames = np.lib.stride_tricks.as_strided(pending,
+                                                 shape=(num, self.wsz),
+                                                 strides=(self.ovr * pending.strides[0], pending.strides[0]))
+
+        if self.window is not None:
+            frames = frames * self.window
+
+        p = np.fft.rfft(frames, axis=1)
+        p = p.real**2 + p.imag**2
+        p *= self.gain
+
+        used = num * self.ovr
+        self.start = (self.start + used) % self.capacity
+        self.count -= used
+
+        return p
+
 class audio_fft(object):
 
     def __init__(self,argv):
@@ -22,8 +115,9 @@ class audio_fft(object):
         self.wszp = 0.25
         self.ovrp = 0.125
         self.pwr = True
+        self.window = 'none'
         try:
-            opts, args = getopt.getopt(argv, 'w:o:p:', ['window-size=','overlap=','powers_of_two='])
+            opts, args = getopt.getopt(argv, 'w:o:p:W:', ['window-size=','overlap=','powers_of_two=','window-function='])
         except:
             traceback.print_exc()
             rospy.loginfo(rospy.get_name()+': Command line fail')
@@ -39,6 +133,12 @@ class audio_fft(object):
                 if arg=='False':
                     self.pwr = False
                 rospy.loginfo(rospy.get_name()+': powers_of_two='+str(self.pwr))
+            elif opt in ('-W','--window-function'):
+                if arg not in WINDOWS:
+                    rospy.logerr(rospy.get_name()+': unknown window function '+arg+', use one of '+', '.join(sorted(WINDOWS)))
+                    sys.exit(2)
+                rospy.loginfo(rospy.get_name()+': window-function='+arg)
+                self.window = arg
         if self.wszp <= 0:
             self.wszp = 0.25
         if self.ovrp <= 0:
@@ -70,33 +170,19 @@ class audio_fft(object):
             else:
                 self.ovr = hi_pwr
         rospy.loginfo(rospy.get_name()+': From frequency %d, using window-size %d and overlap %d.',data.sample_rate,self.wsz,self.ovr)
-        self.nUniquePts = (self.wsz+1)/2 + (self.wsz+1)%2
+        self.spectra = spectrum_frames(self.wsz, self.ovr, self.window)
+        self.nUniquePts = self.spectra.nUniquePts
 
     def callback(self,data):
-        
         if(self.first_time):
-            self.data = data.samples
             self.init_freq(data)
-        else:
-            self.data = self.data + data.samples
-
-        while len(self.data) >= self.wsz:
-            p = fft(self.data[0:self.wsz-1]) # take the fourier transform 
-            p = p[0:self.nUniquePts]
-            p = abs(p)
-            p = p / float(self.wsz) # scale by the number of points so that
-                             # the magnitude does not depend on the length 
-                             # of the signal or on its sampling frequency  
-            p = p**2  # square it to get the power 
-            # odd nfft excludes Nyquist point
-            if self.wsz % 2 > 0: # we've got odd number of points fft
-                p[1:len(p)] = p[1:len(p)] * 2
-            else:
-                p[1:len(p) -1] = p[1:len(p) - 1] * 2 # we've got even number of points fft
-            #rospy.loginfo(rospy.get_name()+': publishing %d datapoints.', len(p))
-            self.data = self.data[self.ovr:len(self.data)]
-            self.pub.publish(p,1,data.num_channels,data.sample_rate,self.nUniquePts,self.wsz,self.ovr)
+
+        # every complete frame in the buffer is transformed at once
+        self.spectra.add(data.samples)
+
+        for p in self.spectra.frames():
             #Currently the '1' indicates that it is fft transform. Other transforms can be indicated by other integers.
+            self.pub.publish(p.tolist(),1,data.num_channels,data.sample_rate,self.nUniquePts,self.wsz,self.ovr)
 
 if __name__ == '__main__':
     A = audio_fft(sys.argv[1:])
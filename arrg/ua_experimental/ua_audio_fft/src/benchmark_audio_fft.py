@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('ua_audio_fft')
+import sys
+import time
+import getopt
+
+import numpy as np
+from scipy.fftpack import fft
+
+from audio_fft import spectrum_frames
+
+# Throughput of the audio_fft frame processing without ROS in the loop.
+# Feeds synthetic audio in message sized chunks through the list based
+# processing audio_fft used to do and through spectrum_frames, and reports
+# frames/sec and per-message latency of both.
+#
+# usage: benchmark_audio_fft.py [-s seconds] [-m samples_per_message] [-w wsz] [-o ovr] [-W window]
+
+def legacy_frames(state, samples, wsz, ovr, nUniquePts):
+    # the processing audio_fft.callback did before spectrum_frames
+    state['data'] = state['data'] + samples
+    result = []
+    while len(state['data']) >= wsz:
+        p = fft(state['data'][0:wsz-1])
+        p = p[0:nUniquePts]
+        p = abs(p)
+        p = p / float(wsz)
+        p = p**2
+        if wsz % 2 > 0:
+            p[1:len(p)] = p[1:len(p)] * 2
+        else:
+            p[1:len(p) -1] = p[1:len(p) - 1] * 2
+        state['data'] = state['data'][ovr:len(state['data'])]
+        result.append(p)
+    return result
+
+def run(name, messages, process):
+    latencies = []
+    frames = 0
+    start = time.time()
+    for msg in messages:
+        t = time.time()
+        frames += len(process(msg))
+        latencies.append(time.time() - t)
+    total = time.time() - start
+    latencies = np.asarray(latencies) * 1000
+    print '%-16s %8d frames in %6.3f sec, %10.1f frames/sec, latency per message mean %.3f ms, 99%% %.3f ms, max %.3f ms' % \
+          (name, frames, total, frames / total, latencies.mean(), np.percentile(latencies, 99), latencies.max())
+
+if __name__ == '__main__':
+    seconds = 30.0
+    msg_size = 1024
+    sample_rate = 44100
+    wsz = 8192
+    ovr = 4096
+    window = 'none'
+
+    opts, args = getopt.getopt(sys.argv[1:], 's:m:w:o:W:')
+    for opt, arg in opts:
+        if opt == '-s': seconds = float(arg)
+        elif opt == '-m': msg_size = int(arg)
+        elif opt == '-w': wsz = int(arg)
+        elif opt == '-o': ovr = int(arg)
+        elif opt == '-W': window = arg
+
+    num = int(seconds * sample_rate) // msg_size
+    t = np.arange(num * msg_size) / float(sample_rate)
+    audio = (0.5 * np.sin(2 * np.pi * 440 * t) + 0.1 * np.random.randn(len(t))).astype(np.float32)
+
+    # rospy hands float32[] fields over as tuples of floats
+    messages = [tuple(audio[i*msg_size:(i+1)*msg_size].tolist()) for i in range(num)]
+
+    print '%.1f sec of audio in %d messages of %d samples, wsz %d, ovr %d, window %s' % (seconds, num, msg_size, wsz, ovr, window)
+
+    state = {'data': []}
+    nUniquePts = wsz // 2 + 1
+    run('list + fft', messages, lambda msg: legacy_frames(state, list(msg), wsz, ovr, nUniquePts))
+
+    spectra = spectrum_frames(wsz, ovr, window)
+    def process(msg):
+        spectra.add(msg)
+        return spectra.frames()
+    run('ring + rfft', messages, process)
@@ -7,6 +7,15 @@ from numpy.random.mtrand import dirichlet
 import pickle
 
 
+PROPORTIONS_DATABASE = '/tmp/proportions.pkl'
+ALPHAS_DATABASE = '/tmp/alphas.pkl'
+
+# fixed point iterations stop when the log likelihood of a pair improves by
+# less than CONVERGENCE_TOL, or after MAX_ITERATIONS
+CONVERGENCE_TOL = 1e-9
+MAX_ITERATIONS = 10000
+
+
 action_names = ['grasp',        # 0
                 'lift',         # 1
                 'drop',         # 2
@@ -55,11 +64,16 @@ def get_real_data_old(action, category):
     return D
 
 
-def get_real_data(action, category):
-    pkl_file = open('/tmp/proportions.pkl', 'rb')
+def load_proportions(path=PROPORTIONS_DATABASE):
+    pkl_file = open(path, 'rb')
     pdfs,_,_ = pickle.load(pkl_file)
     pkl_file.close()
     
+    return pdfs
+
+
+def get_real_data(action, category, pdfs=None):
+    if pdfs is None: pdfs = load_proportions()
     return pdfs[action][category]
 
 
@@ -75,43 +89,84 @@ def invert_psi(y):
     return x
 
 
+def dirichlet_log_like(alphas, log_p_bar, N):
+    """Log likelihood of N proportions with mean log log_p_bar, per row."""
+    return N * (gammaln(alphas.sum(axis=-1)) - gammaln(alphas).sum(axis=-1) + ((alphas-1.0)*log_p_bar).sum(axis=-1))
+
+
+def compute_alphas_batch(log_p_bars, N, tol=CONVERGENCE_TOL, max_iterations=MAX_ITERATIONS):
+    """
+    Fits one Dirichlet per row of log_p_bars (pairs x k, the mean log
+    proportions of each training set, N holds the set sizes) with the same
+    fixed point iteration as compute_alphas, all pairs at once. Pairs that
+    have converged drop out of the iteration.
+    
+    Returns the alphas (pairs x k), whether each pair converged and the
+    number of iterations it took.
+    """
+    log_p_bars = asarray(log_p_bars, dtype=float)
+    N = asarray(N, dtype=float) * ones(log_p_bars.shape[0])
+    
+    alphas = ones(log_p_bars.shape, dtype=float)
+    last_log_like = -inf * ones(log_p_bars.shape[0])
+    iterations = zeros(log_p_bars.shape[0], dtype=int)
+    active = ones(log_p_bars.shape[0], dtype=bool)
+    
+    for i in range(max_iterations):
+        idx = flatnonzero(active)
+        if not idx.size: break
+        
+        lpb = log_p_bars[idx]
+        a = invert_psi(psi(alphas[idx].sum(axis=1))[:,newaxis] + lpb)
+        log_like = dirichlet_log_like(a, lpb, N[idx])
+        
+        alphas[idx] = a
+        iterations[idx] += 1
+        active[idx] = log_like - last_log_like[idx] > tol
+        last_log_like[idx] = log_like
+        
+    return alphas, ~active, iterations
+
+
 def compute_alphas(D):
-    N = D.shape[0]
-    k = D.shape[1]
+    alphas, converged, iterations = compute_alphas_batch(log(D).mean(axis=0)[newaxis], D.shape[0])
+    return alphas[0]
+
+
+def estimate_all(pdfs, actions=action_names, categories=object_names):
+    """
+    Dirichlet parameters for every (action, category) pair as
+    {action: {category: alphas}}.
+    """
+    pairs = [(action, category) for action in actions for category in categories]
+    data = [asarray(pdfs[action][category], dtype=float) for action, category in pairs]
     
-    log_p_bar = log(D).mean(axis=0)
+    log_p_bars = array([log(D).mean(axis=0) for D in data])
+    N = array([D.shape[0] for D in data])
     
-    alphas = ones(k, dtype=float)
+    alphas, converged, iterations = compute_alphas_batch(log_p_bars, N)
     
-    last_log_like = -float('inf')
-    diff = float('inf')
+    for (action, category), it in zip([p for p, c in zip(pairs, converged) if not c], iterations[~converged]):
+        print 'WARNING: %s %s did not converge in %d iterations' % (action, category, it)
+        
+    results = {}
     
-    while diff > 1e-9:
-        psi_alpha_new = psi(alphas.sum()) + log_p_bar
-        alphas = invert_psi(psi_alpha_new)
-        term1 = N * gammaln(alphas.sum())
-        term2 = N * gammaln(alphas).sum()
-        term3 = N * ((alphas-1.0)*log_p_bar).sum()
-        log_like = term1 - term2 + term3
-        diff = log_like - last_log_like
-        last_log_like = log_like
+    for (action, category), a in zip(pairs, alphas):
+        results.setdefault(action, {})[category] = a
         
-    return alphas
+    return results
+
 
 if __name__ == '__main__':
     #D = get_fake_data(10, 100)
     
-    results = {}
+    results = estimate_all(load_proportions())
     
     for action in action_names:
-        results[action] = {}
         for category in object_names:
-            D = get_real_data(action, category)
-            results[action][category] = compute_alphas(D)
             print action, category
             print results[action][category]
             
-    out_pkl = open('/tmp/alphas.pkl', 'wb')
+    out_pkl = open(ALPHAS_DATABASE, 'wb')
     pickle.dump(results, out_pkl)
     out_pkl.close()
-    
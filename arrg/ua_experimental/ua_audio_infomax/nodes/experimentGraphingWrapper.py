@@ -39,7 +39,6 @@ runs InfoMax agent in batches and collects and plots data
 
 import os
 import sys
-import pickle
 import datetime
 
 from optparse import OptionParser
@@ -49,24 +48,19 @@ import numpy as np
 import roslib; roslib.load_manifest('ua_audio_infomax')
 import rospy
 
-# import optimization frameworks and agent class
-from pybrain.optimization import PGPE
-from pybrain.optimization import CMAES
-from pybrain.rl.agents import OptimizationAgent
 from pybrain.rl.experiments import EpisodicExperiment
-
-# import neural net stuff
-from pybrain.structure.networks.network import Network
-from pybrain.tools.shortcuts import buildNetwork
-from pybrain.structure.modules import SoftmaxLayer
 from pybrain.utilities import drawGibbs
 
 from ua_audio_infomax.tasks import InfoMaxTask
 from ua_audio_infomax.environment import InfoMaxEnv
+from ua_audio_infomax.experiment_runner import ALGORITHMS
+from ua_audio_infomax.experiment_runner import ExperimentRunner
+from ua_audio_infomax.experiment_runner import ExperimentSpec
+from ua_audio_infomax.experiment_runner import build_agent
 from ua_audio_infomax.graphExperiment import graph
+from ua_audio_infomax.results import ResultWriter
 from ua_audio_infomax.msg import Action as InfomaxAction
 
-from multiprocessing import Pool
 from multiprocessing import cpu_count
 
 
@@ -86,7 +80,7 @@ if __name__ == '__main__':
     
     parser = OptionParser(usage=usage_msg, description=desc_msg, epilog=epi_msg)
     parser.add_option('-a', '--algorithm', metavar='ALG', type='string', default='pgpe',
-                      help='optimization algorithm [default: %default]')
+                      help='optimization algorithm, pgpe or cmaes [default: %default]')
     parser.add_option('-o', '--num-objects', metavar='OBJ', type='int', default=1,
                       help='number of objects in the world [default: %default]')
     parser.add_option('-e', '--num-experiments', metavar='EXP', type='int', default=2,
@@ -113,6 +107,9 @@ if __name__ == '__main__':
     num_best_test_runs = options.num_best_test_runs
     max_steps = options.max_steps
     
+    if algorithm not in ALGORITHMS:
+        parser.error('unknown optimization algorithm %s, use one of %s' % (algorithm, ', '.join(ALGORITHMS)))
+        
     print 'Using %s optimization algorithm' % algorithm.upper()
     
     # categories and objects 
@@ -141,148 +138,43 @@ if __name__ == '__main__':
                     'chalkboard_eraser',    # 9
                    ]
                    
-    # save off experiment parameters for each run
-    def pickle_metadata(filename, timestamp, netparams):
-        f = open(filename, 'w')
-        
-        pickle.dump(timestamp,f)                # timestamp
-        pickle.dump(num_categories,f)           # number of categories
-        pickle.dump(object_names,f)             # object name and category
-        pickle.dump(action_names,f)             # action names
-        
-        pickle.dump(num_experiments,f)          # number of experiments
-        pickle.dump(num_batches,f)              # number of learning batches per experiment
-        pickle.dump(num_learning_episodes,f)    # number of episodes per num_learning_episodes
-        pickle.dump(num_testing_episodes,f)     # number of testing episodes per num_learning_episodes
-        pickle.dump(num_best_test_runs,f)       # number of episodes to run the best agent
-        pickle.dump(max_steps,f)                # number of steps per episode 
-        
-        pickle.dump(netparams,f)                # parameters of trained policy
-        
-        f.close()
-        
+    # experiment parameters saved with the results of each run
+    def experiment_metadata(timestamp):
+        return {'timestamp': timestamp,
+                'num_categories': num_categories,
+                'object_names': object_names,
+                'action_names': action_names,
+                'num_experiments': num_experiments,
+                'num_batches': num_batches,                         # number of learning batches per experiment
+                'num_learning_episodes': num_learning_episodes,     # number of episodes per batch
+                'num_testing_episodes': num_testing_episodes,       # number of testing episodes per batch
+                'num_best_test_runs': num_best_test_runs,           # number of episodes to run the best agent
+                'max_steps': max_steps}
+                
     rospy.init_node('experiment_graphing_node', anonymous=True)
     
-    def run_experiment(exp_desc):
-        """
-        run [num_experiments] experiments, each with [num_batches] batches
-        each num_learning_episodes has [num_learning_episodes] episodes with [max_steps] per episode
-        """
-        exp_id = exp_desc[0]
-        agent = exp_desc[1]
-        experiment = exp_desc[2]
-        task = exp_desc[3]
-        
-        print '\n*********** STARTING EXPERIMENT %d ***********' % exp_id
-        
-        exp_best_reward = -1000
-        exp_best_counter = 0
-        exp_agent_rewards = []
-        exp_ep_rewards = []
-        exp_best_params = []
-        
-        # Learn in batches
-        exp_agent_rewards.append(0)
-        
-        for i in range(num_batches):
-            if i % 30 == 0: print '[%d] processing batch %d [best = %f]' % (exp_id, i, exp_best_reward)
-            
-            experiment.doEpisodes(num_learning_episodes)
-            
-            # test learned policy
-            # When a num_learning_episodes is done, evaluate so we can see progress and show learning curves
-            best_network, best_score = agent.learner._bestFound()
-            best_params = best_network.params
-            
-#            print '****SCORES****', i
-#            print best_score_f, best_score
-            
-#            curparams = agent.learner.bestEvaluable
-            
-#            print 'batch', i, best_score
-            #agent.learner._setInitEvaluable(curparams)
-            #curparams = agent.learner.current
-            #agent.learner.wrappingEvaluable._setParameters(curparams);
-            
-            # Evaluate the current learned policy for num_testing_episodes episodes
-            rewards = []
-            
-            for test_ep in range(num_testing_episodes):
-#                    print "\t\tTESTING EP", test_ep
-                agent.newEpisode()
-                # Execute the agent in the environment without learning for one episode.
-                # This uses the current set of parameters
-                #r = agent.learner._BlackBoxOptimizer__evaluator(agent.learner.wrappingEvaluable)
-                r = task(best_network) #agent.learner._bestFound()[0])
-                #print 'bef', test_ep, r
-                #r = agent.learner._oneEvaluation(curparams)
-                #r = agent.learner._bestFound()[1]
-                #print 'aft', test_ep, r
-#                    print "\t\t\treward testing episode", test_ep, r
-                rewards.append(r)
-                #testingJointProbs.append(task.objects[0].jointProb)
-                
-            # average of all rewards earned by the current policy running num_testing_episodes episodes
-            avg_testing_reward = np.mean(rewards)
-            
-            #rospy.loginfo('\t[%d] average testing reward for batch %d is [%.5f]', exp_id, i, avg_testing_reward)
-            
-            # list of average rewards per num_learning_episodes 
-            exp_agent_rewards.append(avg_testing_reward)
-            
-            # list of reward per episode in this num_learning_episodes
-            exp_ep_rewards.append(rewards)
-            
-            # compare the average reward for this evaluation of the learned policy. If it is better on average than
-            # a previous one, then save off the parameters that make up the neural network so we can use it to 
-            # perform a single episode
-            if avg_testing_reward > exp_best_reward:
-                print '[%d] New best reward %f (change from previous is %f)' % (exp_id, avg_testing_reward, avg_testing_reward - exp_best_reward)
-                exp_best_reward = avg_testing_reward
-                exp_best_params = best_network #agent.learner.bestEvaluable
-#                exp_best_params = agent.learner.current.copy()
-                
-        # return parameters of the best policy in this experiment
-        print '[%d] experiment best reward is %f' % (exp_id, exp_best_reward)
-        return exp_agent_rewards, exp_best_reward, exp_best_params
+    def report_batch(exp_id, batch, avg_testing_reward, rewards):
+        rospy.loginfo('[%d] average testing reward for batch %d is %f', exp_id, batch, avg_testing_reward)
         
     # init structures for rewards and network parameters
     lrn_rewards = []
     best_params = []
     best_reward = -1000
     
-    num_cpus = cpu_count()
+    # run [num_experiments] experiments, each with [num_batches] batches of
+    # [num_learning_episodes] episodes with [max_steps] per episode, every
+    # experiment is set up and run in its own worker process
+    specs = [ExperimentSpec(i, algorithm, object_names, action_names, num_objects,
+                            num_batches, num_learning_episodes, num_testing_episodes, max_steps)
+             for i in range(num_experiments)]
+             
+    num_cpus = min(cpu_count(), num_experiments)
     rospy.loginfo('Using %d CPUs for experiments', num_cpus)
     
-    exp_desciptions = []
+    runner = ExperimentRunner(object_names, action_names, processes=num_cpus)
+    res = runner.run(specs, report_batch)
+    runner.close()
     
-    for i in range(num_experiments):
-        # set up environment, task, neural net, agent, and experiment
-        env = InfoMaxEnv(object_names, action_names, num_objects, False)
-        task = InfoMaxTask(env, max_steps=max_steps)
-        net = buildNetwork(task.outdim, task.indim, bias=True, outclass=SoftmaxLayer)
-        
-        if algorithm == 'pgpe':
-            agent = OptimizationAgent(net, PGPE(storeAllEvaluations=True,minimize=False,verbose=False))
-        elif algorithm == 'cmaes':
-            agent = OptimizationAgent(net, CMAES(minimize=False,verbose=False))
-            
-        experiment = EpisodicExperiment(task, agent)
-        
-        exp_desciptions.append([i, agent, experiment, task])
-        
-    pool = Pool(processes=num_cpus)
-    
-    res = []
-    if algorithm == 'pgpe':
-        res = pool.map(run_experiment, exp_desciptions)
-    elif algorithm == 'cmaes':
-        for desc in exp_desciptions:
-            res.append(run_experiment(desc))
-    else:
-        for desc in exp_desciptions:
-            res.append(run_experiment(desc))
-            
     for exp_res in res:
         exp_agent_rewards, exp_best_reward, exp_best_params = exp_res
         lrn_rewards.append(exp_agent_rewards)
@@ -301,15 +193,11 @@ if __name__ == '__main__':
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
     #path = "./" + path + "/" + timestamp + "/"
     #os.mkdir(path)
-    filename = "experiment.desc"
-    # save metadata, including trained policy parameters
-    pickle_metadata(path+filename, timestamp, best_params2)
+    results = ResultWriter(path, experiment_metadata(timestamp))
     
-    ###################### save rewards per num_learning_episodes during learning
-    outfile = path+"RewardsPerEpisode-learning.pkl"
-    f = open(outfile, 'w')
-    pickle.dump(lrn_rewards,f)
-    f.close()
+    # trained policy parameters and rewards per batch during learning
+    results.add('best_params', best_params2.params, dtype=float)
+    results.add('learning_rewards', lrn_rewards, dtype=float)
     
     ###################### now run the best agent
     # need to save action trace, also a good place to insert hand-coded policy for running
@@ -321,13 +209,7 @@ if __name__ == '__main__':
     # set up environment, task, neural net, agent, and experiment
     env = InfoMaxEnv(object_names, action_names, num_objects, False)
     task = InfoMaxTask(env, max_steps=max_steps)
-    net = buildNetwork(task.outdim, task.indim, bias =True, outclass=SoftmaxLayer)
-    
-    if algorithm == 'pgpe':
-        agent = OptimizationAgent(net, PGPE(storeAllEvaluations=True,minimize=False,verbose=False))
-    elif algorithm == 'cmaes':
-        agent = OptimizationAgent(net, CMAES(minimize=False,verbose=False))
-        
+    agent = build_agent(algorithm, task)
     experiment = EpisodicExperiment(task, agent)
     experiment.doEpisodes(1)
     
@@ -369,7 +251,7 @@ if __name__ == '__main__':
                 #print 'l', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], avg_prob_learned[test_run,cur_loc,step_counter], avg_prob_learned[test_run,cur_loc]
                 #print 'l', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], joint_probs_learned[test_run,cur_loc]
                 
-            steps.append(action_names[actionIdx])
+            steps.append(actionIdx)
             step_counter += 1
             
         learned_true.append(task.env.objects)
@@ -401,7 +283,7 @@ if __name__ == '__main__':
                 #print 'h', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], avg_prob_handcoded[test_run,cur_loc,step_counter], avg_prob_handcoded[test_run,cur_loc]
                 #print 'h', test_run, cur_loc, step_counter, action_names[actionIdx], object_names[task.env.objects[cur_loc]], joint_probs_handcoded[test_run,cur_loc]
                 
-            steps.append(action_names[actions[actionIdx]])
+            steps.append(actions[actionIdx])
             actionIdx += 1
             if actionIdx >= len(actions): actionIdx = 0
             
@@ -419,34 +301,22 @@ if __name__ == '__main__':
     #print joint_probs_learned
     #print joint_probs_handcoded
     
-    ###################### save rewards per step with the best agent
-    outfile = path+"RewardsPerStep-trained.pkl"
-    f = open(outfile, 'w')
-    pickle.dump(Ep_rewards,f)
-    pickle.dump(Ep_rewardsHand, f)
-    f.close()
-    
-    ###################### save accuracy per step with the best agent and hand-coded policy
-    outfile = path+"AccuracyPerStep.pkl"
-    f = open(outfile, 'w')
-    pickle.dump(probCorrect,f)
-    pickle.dump(probCorrectHand,f)
-    f.close()
-    
-    ###################### save joint probs per step with the best agent
-    outfile = path+"JointProbsPerStep-learned.pkl"
-    f = open(outfile, 'w')
+    ###################### save rewards, accuracy and joint probs per step with the best agent and hand-coded policy
+    results.add('learned_rewards', Ep_rewards, dtype=float)
+    results.add('handcoded_rewards', Ep_rewardsHand, dtype=float)
     
-    pickle.dump(learned_steps, f)
-    pickle.dump(joint_probs_learned, f)
+    results.add('learned_accuracy', probCorrect)
+    results.add('handcoded_accuracy', probCorrectHand)
     
-    pickle.dump(handcoded_steps, f)
-    pickle.dump(joint_probs_handcoded, f)
+    results.add('learned_actions', learned_steps, dtype=int)
+    results.add('learned_joint_probs', joint_probs_learned)
+    results.add('learned_true', learned_true, dtype=int)
     
-    pickle.dump(learned_true, f)
-    pickle.dump(handcoded_true, f)
+    results.add('handcoded_actions', handcoded_steps, dtype=int)
+    results.add('handcoded_joint_probs', joint_probs_handcoded)
+    results.add('handcoded_true', handcoded_true, dtype=int)
     
-    f.close()
+    results.close()
     
     ###################### print metadata and plot figures
     grapher = graph(path)
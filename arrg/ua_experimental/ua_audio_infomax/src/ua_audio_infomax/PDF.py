@@ -30,8 +30,36 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+"""
+PDFs sensed by the robot for every (action, category) pair, used to
+simulate sensing in InfoMax episodes.
+
+The pickled databases written by the audio experiments (/tmp/obj_pdf.pkl
+and /tmp/proportions.pkl) are converted once into a compact library next to
+them: pdfs.npy holds all PDFs as rows (one column per object, in
+object_names order) with every (action, category) pair stored as one
+contiguous block, index.npz holds the offset and number of PDFs of each
+pair. The library is memory-mapped on load, so sampling never touches
+pickles or dicts.
+
+Every set of action/object names gets its own directory
+(<pickle>-<hash of the names>.pdflib/), so configurations don't replace each
+other's libraries. Inside it every build of the pickle is a version
+directory named after the pickle's modification time and size. Versions are
+renamed into place complete and are never rebuilt in place, a new version
+only appears when the pickle changes, so processes building and loading at
+the same time never see missing or half written files. Older versions are
+removed after a newer one was built, a load that loses its files to that
+tries again with the newest one.
+"""
+
+
+import os
+import shutil
 import pickle
-from numpy.random import randint
+import hashlib
+
+import numpy as np
 
 
 __author__ = 'Daniel Ford, Antons Rebguns'
@@ -43,6 +71,151 @@ __maintainer__ = 'Daniel Ford'
 __email__ = 'dford@email.arizona.edu'
 
 
+OBJ_PDF_DATABASE = '/tmp/obj_pdf.pkl'
+PROPORTIONS_DATABASE = '/tmp/proportions.pkl'
+
+# attempts at loading a library whose version is replaced while it is loaded
+LOAD_ATTEMPTS = 3
+
+
+def library_path(database, action_names, object_names):
+    """Directory of the libraries of database built for these names."""
+    names_hash = hashlib.sha1(repr((list(action_names), list(object_names)))).hexdigest()[:16]
+    return '%s-%s.pdflib' % (os.path.splitext(database)[0], names_hash)
+
+
+def library_version(database):
+    """Version directory name of the current contents of database."""
+    st = os.stat(database)
+    return '%d-%d' % (int(st.st_mtime * 1e6), st.st_size)
+
+
+def library_versions(path):
+    """Complete versions in a library directory, oldest first."""
+    if not os.path.isdir(path): return []
+    
+    versions = [v for v in os.listdir(path) if not v.startswith('.') and os.path.exists(os.path.join(path, v, 'index.npz'))]
+    return sorted(versions, key=lambda v: tuple(int(x) for x in v.split('-')))
+
+
+def read_pickled_pdfs(database, action_names, object_names):
+    """
+    Reads a pickled database into {(action_id, category_id): (n x objects)
+    array}. Handles both the obj_pdf format (lists of {object: prob} dicts)
+    and the proportions format (a list or tuple whose first element maps to
+    arrays, audio_read.py dumps it as [probs_by_action, object_names,
+    action_names]).
+    """
+    pdfs_in = open(database, 'rb')
+    pdf_database = pickle.load(pdfs_in)
+    pdfs_in.close()
+    
+    if isinstance(pdf_database, (list, tuple)): pdf_database = pdf_database[0]
+    
+    blocks = {}
+    
+    for action_id, action_name in enumerate(action_names):
+        if action_name not in pdf_database: continue
+        
+        for category_id, category_name in enumerate(object_names):
+            if category_name not in pdf_database[action_name]: continue
+            
+            pdf_samples = pdf_database[action_name][category_name]
+            
+            if isinstance(pdf_samples, np.ndarray):
+                block = np.asarray(pdf_samples, dtype=np.float64)
+            else:
+                block = np.array([[pdf[obj] for obj in object_names] for pdf in pdf_samples], dtype=np.float64)
+                
+            blocks[(action_id,category_id)] = block.reshape(-1, len(object_names))
+            
+    return blocks
+
+
+def build_pdf_library(database, action_names, object_names):
+    """
+    Converts a pickled database into the compact library format, returns
+    the version directory it is in.
+    """
+    path = library_path(database, action_names, object_names)
+    version = library_version(database)
+    version_path = os.path.join(path, version)
+    
+    blocks = read_pickled_pdfs(database, action_names, object_names)
+    
+    offsets = np.zeros((len(action_names), len(object_names)), dtype=np.int64)
+    counts = np.zeros((len(action_names), len(object_names)), dtype=np.int64)
+    data = []
+    total = 0
+    
+    for action_id in range(len(action_names)):
+        for category_id in range(len(object_names)):
+            block = blocks.get((action_id,category_id))
+            if block is None: continue
+            
+            offsets[action_id,category_id] = total
+            counts[action_id,category_id] = len(block)
+            data.append(block)
+            total += len(block)
+            
+    data = np.vstack(data) if data else np.zeros((0, len(object_names)))
+    
+    # write next to the final location and rename it into place at the end
+    # so readers never see a half written library
+    tmp_path = os.path.join(path, '.tmp%d' % os.getpid())
+    if os.path.exists(tmp_path): shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    
+    np.save(os.path.join(tmp_path, 'pdfs.npy'), data)
+    np.savez(os.path.join(tmp_path, 'index.npz'),
+             offsets=offsets,
+             counts=counts,
+             action_names=np.array(action_names),
+             object_names=np.array(object_names))
+             
+    try:
+        os.rename(tmp_path, version_path)
+    except OSError:
+        # another process built the same version first, it's identical
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        
+    # versions older than this one are no use to anyone loading from now on
+    versions = library_versions(path)
+    for old in versions[:versions.index(version)]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+        
+    return version_path
+
+
+def load_pdf_library(database, action_names, object_names):
+    """
+    Memory-mapped PDFs, offsets and counts of a database, (re)building the
+    compact library first if needed.
+    """
+    path = library_path(database, action_names, object_names)
+    
+    for attempt in range(LOAD_ATTEMPTS):
+        if os.path.exists(database):
+            version_path = os.path.join(path, library_version(database))
+            if not os.path.exists(os.path.join(version_path, 'index.npz')):
+                version_path = build_pdf_library(database, action_names, object_names)
+        else:
+            # the pickle is gone, the newest library built from it still works
+            versions = library_versions(path)
+            if not versions: raise IOError('no PDF database %s and no library built from it' % database)
+            version_path = os.path.join(path, versions[-1])
+            
+        try:
+            index = np.load(os.path.join(version_path, 'index.npz'))
+            offsets, counts = index['offsets'], index['counts']
+            index.close()
+            pdfs = np.load(os.path.join(version_path, 'pdfs.npy'), mmap_mode='r')
+            return pdfs, offsets, counts
+        except (IOError, OSError):
+            # a newer version replaced this one while it was being loaded
+            if attempt == LOAD_ATTEMPTS - 1: raise
+
+
 class PDF_library():
     def __init__(self, action_names, object_names):
         self.action_names = action_names
@@ -53,40 +226,46 @@ class PDF_library():
 
 
     def read_pdf_database(self):
-        pdfs_in = open('/tmp/obj_pdf.pkl', 'rb')
-        self.pdf_database = pickle.load(pdfs_in)
-        pdfs_in.close()
+        self.pdfs, self.offsets, self.counts = load_pdf_library(OBJ_PDF_DATABASE, self.action_names, self.object_names)
 
 
-    def sample(self, action_id, category_id):
+    def read_pdf_database_new(self):
+        self.pdfs, self.offsets, self.counts = load_pdf_library(PROPORTIONS_DATABASE, self.action_names, self.object_names)
+
+
+    def sample_batch(self, action_ids, category_ids, n=None):
         """
-        sample randomly from PDFs for given object and action
+        Random PDFs for many (action, category) pairs at once. Returns an
+        (pairs x objects) array, or (pairs x n x objects) when n is given.
         """
-        # select a PDF at random from the correct category
-        action_name = self.action_names[action_id]
-        category_name = self.object_names[category_id]
+        action_ids = np.asarray(action_ids, dtype=int)
+        category_ids = np.asarray(category_ids, dtype=int)
+        counts = self.counts[action_ids,category_ids]
         
-        pdf_samples = self.pdf_database[action_name][category_name]
-        pdf = pdf_samples[randint(len(pdf_samples))]
+        if (counts == 0).any():
+            missing = np.nonzero(counts == 0)[0][0]
+            raise KeyError('no PDFs for action %s on %s' % (self.action_names[action_ids[missing]], self.object_names[category_ids[missing]]))
+            
+        offsets = self.offsets[action_ids,category_ids]
         
-        # translate from map to list representation
-        return [pdf[obj] for obj in self.object_names]
+        if n is None:
+            picks = (np.random.random(len(action_ids)) * counts).astype(int)
+            return self.pdfs[offsets + picks]
+            
+        picks = (np.random.random((len(action_ids), n)) * counts[:,np.newaxis]).astype(int)
+        return self.pdfs[offsets[:,np.newaxis] + picks]
 
 
-    def read_pdf_database_new(self):
-        pdfs_in = open('/tmp/proportions.pkl', 'rb')
-        self.pdf_database, _, _ = pickle.load(pdfs_in)
-        pdfs_in.close()
+    def sample(self, action_id, category_id):
+        """
+        sample randomly from PDFs for given object and action
+        """
+        return self.sample_batch([action_id], [category_id])[0].tolist()
 
 
     def sample_new(self, action_id, category_id):
         """
-        sample randomly from PDFs for given object and action
+        sample randomly from PDFs for given object and action, call
+        read_pdf_database_new() first
         """
-        # select a PDF at random from the correct category
-        action_name = self.action_names[action_id]
-        category_name = self.object_names[category_id]
-        
-        pdf_samples = self.pdf_database[action_name][category_name]
-        return pdf_samples[randint(pdf_samples.shape[0])].tolist()
-
+        return self.sample(action_id, category_id)
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Vectorized InfoMax task that steps a batch of independent episodes at once.
+
+BatchInfoMaxTask follows InfoMaxTask with the robotTestServer simulation
+built in, but keeps the state of all episodes in arrays (batch x objects x
+...) instead of per-object BeliefObjectDirichlet instances, so one call to
+performActions() advances every episode of the batch. Observations and
+rewards have the same layout and meaning as the ones InfoMaxTask produces.
+
+ParallelEpisodeRunner shards a number of episodes over a process pool, each
+worker running its share through its own BatchInfoMaxTask.
+"""
+
+
+import os
+import time
+
+import numpy as np
+
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+import roslib; roslib.load_manifest('ua_audio_infomax')
+
+from pybrain.structure.modules import BiasUnit
+from pybrain.structure.modules import LinearLayer
+from pybrain.structure.modules import SigmoidLayer
+from pybrain.structure.modules import SoftmaxLayer
+from pybrain.structure.modules import TanhLayer
+from pybrain.structure.connections import FullConnection
+from pybrain.structure.connections import IdentityConnection
+
+from ua_audio_infomax.PDF import PDF_library
+from ua_audio_infomax.robotTestServer import robotTestServer
+from ua_audio_infomax.tasks import load_prior_alphas
+from ua_audio_infomax.tasks import log_beta
+from ua_audio_infomax.msg import Action as InfomaxAction
+
+
+__author__ = 'Daniel Ford, Antons Rebguns'
+__copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
+__credits__ = 'Ian Fasel'
+
+__license__ = 'BSD'
+__maintainer__ = 'Daniel Ford'
+__email__ = 'dford@email.arizona.edu'
+
+
+# same numbering InfoMaxTask uses for state counts
+STATE_IDS = {'init': 0, 'grasped': 1, 'lifted': 2, 'placed': 3}
+
+
+def draw_greedy(values):
+    """
+    Row-wise drawGibbs(values, temperature=0): index of the largest value,
+    ties are broken at random.
+    """
+    values = np.asarray(values)
+    best = values == values.max(axis=1)[:,np.newaxis]
+    return (np.random.random(values.shape) * best).argmax(axis=1)
+
+
+class BatchNetwork():
+    """
+    Activates a PyBrain feed-forward network on a whole batch of inputs (one
+    per row). Networks built from linear, bias, sigmoid, tanh and softmax
+    layers joined by full or identity connections (everything buildNetwork
+    makes) are evaluated as matrix products, anything else falls back to
+    calling activate() row by row.
+    """
+    
+    def __init__(self, network):
+        self.network = network
+        self.vectorized = self._supported()
+
+
+    def _supported(self):
+        layers = (BiasUnit, LinearLayer, SigmoidLayer, SoftmaxLayer, TanhLayer)
+        
+        if not hasattr(self.network, 'modulesSorted'): return False
+        
+        for module in self.network.modulesSorted:
+            if type(module) not in layers: return False
+            
+            for conn in self.network.connections[module]:
+                if type(conn) not in (FullConnection, IdentityConnection): return False
+                
+        return not getattr(self.network, 'recurrentConns', None)
+
+
+    def activate(self, inputs):
+        inputs = np.asarray(inputs, dtype=float)
+        
+        if not self.vectorized:
+            result = []
+            for row in inputs:
+                self.network.reset()
+                result.append(self.network.activate(row))
+            return np.asarray(result)
+            
+        num = inputs.shape[0]
+        net = self.network
+        inbufs = dict((m, np.zeros((num, m.indim))) for m in net.modulesSorted)
+        outbufs = {}
+        
+        # inputs are split over the input modules in order, like Network.activate does
+        offset = 0
+        for module in net.inmodules:
+            inbufs[module] += inputs[:,offset:offset+module.indim]
+            offset += module.indim
+            
+        for module in net.modulesSorted:
+            x = inbufs[module]
+            
+            if isinstance(module, BiasUnit):
+                y = np.ones((num, module.outdim))
+            elif isinstance(module, SoftmaxLayer):
+                # pybrain's safeExp clips at 500
+                y = np.exp(np.clip(x, -500, 500))
+                y /= y.sum(axis=1)[:,np.newaxis]
+            elif isinstance(module, SigmoidLayer):
+                y = 1.0 / (1.0 + np.exp(-x))
+            elif isinstance(module, TanhLayer):
+                y = np.tanh(x)
+            else:
+                y = x
+                
+            outbufs[module] = y
+            
+            for conn in net.connections[module]:
+                src = y[:,conn.inSliceFrom:conn.inSliceTo]
+                dst = inbufs[conn.outmod][:,conn.outSliceFrom:conn.outSliceTo]
+                
+                if isinstance(conn, FullConnection):
+                    dst += np.dot(src, conn.params.reshape(dst.shape[1], src.shape[1]).T)
+                else:
+                    dst += src
+                    
+        return np.hstack([outbufs[m] for m in net.outmodules])
+
+
+class BatchInfoMaxTask():
+    def __init__(self, category_names, action_names, num_objects, batch_size, max_steps=30):
+        self.category_names = category_names
+        self.action_names = action_names
+        self.num_categories = len(category_names)
+        self.num_actions = len(action_names)
+        self.num_objects = num_objects
+        self.batch_size = batch_size
+        self.max_steps = max_steps
+        
+        self.prior_alphas = load_prior_alphas(action_names, category_names)
+        self.prior_log_beta = log_beta(self.prior_alphas)
+        
+        self._load_transitions()
+        self.pdf_library = PDF_library(action_names, category_names)
+        
+        self.initialize_RBFs()
+        self.objects = None
+        self.reset()
+
+
+    def _load_transitions(self):
+        """Action outcomes of robotTestServer as (state x action) tables."""
+        server = robotTestServer(standalone=False)
+        
+        self.allowed = np.zeros((len(STATE_IDS), self.num_actions), dtype=bool)
+        self.next_state = np.zeros((len(STATE_IDS), self.num_actions), dtype=int)
+        
+        for state_name, state_id in STATE_IDS.items():
+            for action in range(self.num_actions):
+                self.allowed[state_id,action] = action in server.allowed_actions[state_name]
+                self.next_state[state_id,action] = STATE_IDS[server.state[action]] if action in server.state else state_id
+
+
+    def initialize_RBFs(self):
+        """
+        create RBFs to encode time to completion
+        """
+        self.numRBFs = 6
+        self.sigma = self.max_steps / self.numRBFs
+        self.RBFcenters = np.linspace(0, self.max_steps, self.numRBFs).astype(int)
+
+
+    def reset(self, randomize=True, batch_size=None):
+        if batch_size is not None and batch_size != self.batch_size:
+            self.batch_size = batch_size
+            self.objects = None
+            
+        B = self.batch_size
+        N = self.num_objects
+        
+        if randomize or self.objects is None:
+            self.objects = np.random.randint(0, self.num_categories, (B, N))
+            
+        self.batch = np.arange(B)
+        self.steps = 0
+        self.samples = 0
+        self.location = np.zeros(B, dtype=int)
+        self.state = np.zeros(B, dtype=int)
+        
+        # BeliefObjectDirichlet state of every object in every episode
+        self.category_alphas = np.ones((B, N, self.num_actions, self.num_categories)) * (1.0/self.num_categories)
+        self.belief_action_count = np.zeros((B, N, self.num_actions))
+        self.update_joint_alphas()
+        
+        self.action_counts = np.zeros((B, N, self.num_actions))
+        self.state_counts = np.zeros((B, N, len(STATE_IDS)))
+        self.RBFs = np.zeros((B, self.numRBFs))
+        
+        self.reward = np.zeros(B)
+        self.cumreward = np.zeros(B)
+        self.percent_correct = np.zeros(B)
+        self.maxentropy = self.calculate_entropy()
+        self.prev_entropy = np.zeros(B)
+
+
+    def update_joint_alphas(self):
+        alphas = self.category_alphas
+        self.joint_alphas = (alphas / alphas.sum(axis=3)[...,np.newaxis]).mean(axis=2)
+        self.joint_prob = self.joint_alphas / self.joint_alphas.sum(axis=2)[...,np.newaxis]
+
+
+    def calculate_entropy(self):
+        p = self.joint_alphas / self.joint_alphas.sum(axis=2)[...,np.newaxis]
+        return -(p * np.log(p)).sum(axis=2).sum(axis=1)
+
+
+    def update_RBFs(self):
+        # integer arithmetic on purpose, same values InfoMaxTask computes
+        self.RBFs[:] = np.exp(-((self.steps - self.RBFcenters)**2) // self.sigma)
+
+
+    def getObservations(self):
+        """
+        (batch x outdim) array of belief vectors, row b is what
+        InfoMaxTask.getObservation returns for episode b
+        """
+        # objects in order starting at the current location
+        order = (self.location[:,np.newaxis] + np.arange(self.num_objects)) % self.num_objects
+        rows = self.batch[:,np.newaxis]
+        
+        curj = self.joint_prob[rows,order].reshape(self.batch_size, -1)
+        act_count = self.belief_action_count[rows,order].reshape(self.batch_size, -1)
+        
+        self.update_RBFs()
+        
+        return np.hstack((curj, act_count, self.RBFs))
+
+
+    def performActions(self, actions):
+        """
+        Performs one action in every episode. Actions are either indices or a
+        (batch x actions) array of network outputs.
+        """
+        actions = np.asarray(actions)
+        if actions.ndim == 2: actions = draw_greedy(actions)
+        
+        self.steps += 1
+        B = self.batch
+        N = self.num_objects
+        
+        allowed = self.allowed[self.state,actions]
+        left = allowed & (actions == InfomaxAction.MOVE_LEFT)
+        right = allowed & (actions == InfomaxAction.MOVE_RIGHT)
+        sensing = allowed & ~left & ~right
+        
+        self.location[left] = (self.location[left] + 1) % N
+        self.location[right] = (self.location[right] - 1) % N
+        self.state[allowed] = self.next_state[self.state[allowed],actions[allowed]]
+        
+        self.action_counts[B,self.location,actions] += 1
+        self.state_counts[B,self.location,self.state] += 1
+        
+        if sensing.any():
+            self.update_beliefs(np.nonzero(sensing)[0], actions[sensing])
+            
+        truth = self.joint_prob[B[:,np.newaxis],np.arange(N),self.objects]
+        self.percent_correct = truth.sum(axis=1) / N
+        
+        self.updateReward()
+        self.cumreward += self.reward
+        self.samples += 1
+
+
+    def update_beliefs(self, episodes, actions):
+        """
+        BeliefObjectDirichlet.update_alphas for the objects at the current
+        location of the given episodes.
+        """
+        locations = self.location[episodes]
+        pdfs = self.pdf_library.sample_batch(actions, self.objects[episodes,locations])
+        
+        with np.errstate(divide='ignore'):
+            log_r = (np.einsum('mij,mj->mi', self.prior_alphas[actions] - 1.0, np.log(pdfs))
+                     - self.prior_log_beta[actions])
+            log_ps = np.log(self.category_alphas[episodes,locations,actions]) + log_r
+            
+        ps = np.exp(log_ps - log_ps.max(axis=1)[:,np.newaxis])
+        
+        self.category_alphas[episodes,locations,actions] = ps / ps.sum(axis=1)[:,np.newaxis]
+        self.belief_action_count[episodes,locations,actions] += 1
+        self.update_joint_alphas()
+
+
+    def isFinished(self):
+        return self.steps >= self.max_steps
+
+
+    def updateReward(self):
+        entropy = self.calculate_entropy()
+        norm_ent = (self.maxentropy - entropy) / self.maxentropy
+        norm_change = norm_ent - self.prev_entropy
+        
+        self.prev_entropy = norm_ent
+        self.reward = norm_ent * 2 + norm_change
+
+
+    def run_episodes(self, policy, num_episodes=None):
+        """
+        Runs a batch of episodes with a policy (PyBrain network or any object
+        with a batch activate()) and returns the total reward of every episode,
+        same as calling InfoMaxTask(network) once per episode.
+        """
+        if not isinstance(policy, BatchNetwork) and hasattr(policy, 'modulesSorted'):
+            policy = BatchNetwork(policy)
+            
+        self.reset(batch_size=num_episodes)
+        
+        while not self.isFinished():
+            self.performActions(policy.activate(self.getObservations()))
+            
+        return self.cumreward.copy()
+
+
+    @property
+    def indim(self):
+        return self.num_actions
+
+
+    @property
+    def outdim(self):
+        return self.num_objects * (self.num_categories + self.num_actions) + self.numRBFs
+
+
+# tasks live in the worker processes, built once per configuration
+_worker_tasks = {}
+
+
+def _init_worker():
+    # forked workers would otherwise all draw the same episodes
+    np.random.seed((os.getpid() * 1000003 + int(time.time() * 1000)) % 4294967296)
+
+
+def _run_shard(args):
+    config, network, num_episodes = args
+    
+    if config not in _worker_tasks:
+        category_names, action_names, num_objects, max_steps = config
+        _worker_tasks[config] = BatchInfoMaxTask(list(category_names), list(action_names), num_objects, num_episodes, max_steps)
+        
+    return _worker_tasks[config].run_episodes(network, num_episodes)
+
+
+class ParallelEpisodeRunner():
+    def __init__(self, category_names, action_names, num_objects, max_steps=30, processes=None):
+        self.config = (tuple(category_names), tuple(action_names), num_objects, max_steps)
+        self.processes = processes or cpu_count()
+        self.pool = Pool(processes=self.processes, initializer=_init_worker)
+
+
+    def run_episodes(self, network, num_episodes):
+        """Total reward of num_episodes episodes, split evenly over the workers."""
+        shards = [n for n in np.diff(np.linspace(0, num_episodes, self.processes+1).astype(int)) if n > 0]
+        results = self.pool.map(_run_shard, [(self.config, network, n) for n in shards])
+        return np.concatenate(results)
+
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -35,15 +35,15 @@ import numpy as np
 import roslib; roslib.load_manifest('ua_audio_infomax')
 import rospy
 
-from std_srvs.srv import Empty
-
 from pybrain.utilities import Named
 from pybrain.rl.environments.environment import Environment
 
 from ua_audio_infomax.robotTestServer import robotTestServer
 from ua_audio_infomax.msg import Action as InfomaxAction
-from ua_audio_infomax.srv import InfoMax
-from ua_audio_infomax.srv import InfoMaxRequest
+from ua_audio_infomax.srv import InfoMaxRegister
+from ua_audio_infomax.srv import InfoMaxStep
+from ua_audio_infomax.srv import InfoMaxBatchStep
+from ua_audio_infomax.srv import InfoMaxReset
 
 
 __author__ = 'Daniel Ford, Antons Rebguns'
@@ -65,17 +65,23 @@ class InfoMaxEnv(Environment, Named):
         
         if standalone_robot_server:
             self.robot_server = None
-            rospy.loginfo('waiting for InfoMax service...')
-            rospy.wait_for_service('InfoMax')
-            rospy.loginfo('connected to InfoMax service')
-            self.get_belief_distribution = rospy.ServiceProxy('InfoMax', InfoMax)
+            rospy.loginfo('waiting for InfoMax services...')
+            rospy.wait_for_service('InfoMaxRegister')
+            rospy.wait_for_service('InfoMaxStep')
+            rospy.wait_for_service('InfoMaxBatchStep')
+            rospy.wait_for_service('InfoMaxReset')
+            rospy.loginfo('connected to InfoMax services')
+            
+            # steps come in fast, keep their connections open
+            register = rospy.ServiceProxy('InfoMaxRegister', InfoMaxRegister)
+            self.step = rospy.ServiceProxy('InfoMaxStep', InfoMaxStep, persistent=True)
+            self.batch_step = rospy.ServiceProxy('InfoMaxBatchStep', InfoMaxBatchStep, persistent=True)
+            self.reset_session = rospy.ServiceProxy('InfoMaxReset', InfoMaxReset, persistent=True)
             
-            rospy.loginfo('waiting for reset_current_location service...')
-            rospy.wait_for_service('reset_current_location')
-            rospy.loginfo('connected to reset_current_location service')
-            self.reset_current_location = rospy.ServiceProxy('reset_current_location', Empty)
+            self.session = register(num_objects, category_names, action_names, self.num_categories).session
         else:
             self.robot_server = robotTestServer(standalone=False)
+            self.session = self.robot_server.register_session(category_names, action_names, num_objects, self.num_categories)
             
         self.objects = None
         self.reset()
@@ -88,8 +94,9 @@ class InfoMaxEnv(Environment, Named):
         if randomize:
             self.objects = np.random.randint(0, self.num_categories, self.num_objects)
             
-        if not self.robot_server: self.reset_current_location(Empty())
-        else: self.robot_server.reset_current_location(Empty())
+        # only this environment's robot goes back, other sessions may be mid-episode
+        if not self.robot_server: self.reset_session(self.session)
+        else: self.robot_server.reset_session(self.session)
         
         self.current_location = 0
         self.current_state = 'init'
@@ -101,19 +108,13 @@ class InfoMaxEnv(Environment, Named):
         over all categories.
         """
         try:
-            req = InfoMaxRequest()
-            req.num_objects = self.num_objects
-            req.objectNames = self.category_names
-            req.actionNames = self.action_names
-            req.numCats = self.num_categories
-            req.catID = self.objects[self.current_location]
-            req.actionID.val = action
+            cat_id = self.objects[self.current_location]
             
             rospy.logdebug('calling sense service with action %d (%s) on object %d(%s)' %
-                           (req.actionID.val, self.action_names[req.actionID.val], req.catID, self.category_names[req.catID]))
+                           (action, self.action_names[action], cat_id, self.category_names[cat_id]))
                            
-            if not self.robot_server: res = self.get_belief_distribution(req)
-            else: res = self.robot_server.handle_infomax_request(req)
+            if not self.robot_server: res = self.step(self.session, cat_id, InfomaxAction(action))
+            else: res = self.robot_server.step(self.session, action, cat_id)
             self.current_location = res.location
             self.current_state = res.state
             
@@ -122,3 +123,27 @@ class InfoMaxEnv(Environment, Named):
             rospy.logerr('Service call failed: %s' % e)
             return None
 
+
+    def sense_batch(self, actions):
+        """
+        Perform a sequence of actions starting at the current location in one
+        call. Returns the InfoMaxBatchStep response with beliefs as a (sensed
+        actions x categories) array.
+        """
+        try:
+            if not self.robot_server:
+                res = self.batch_step(self.session, self.objects, actions)
+                res.sensed = np.asarray(res.sensed, dtype=bool)
+                res.beliefs = np.reshape(res.beliefs, (-1, self.num_categories))
+            else:
+                res = self.robot_server.step_batch(self.session, actions, self.objects)
+                
+            if len(res.locations):
+                self.current_location = res.locations[-1]
+                self.current_state = res.states[-1]
+                
+            return res
+        except rospy.ServiceException as e:
+            rospy.logerr('Service call failed: %s' % e)
+            return None
+
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Runs InfoMax learning experiments in parallel, one experiment per worker
+process.
+
+Experiments are described by small ExperimentSpec objects, every worker
+builds its own environment, task, network and PGPE or CMA-ES agent from the
+spec, so nothing but the spec goes out and nothing but rewards and the best
+network come back. The prior alphas are read once in the parent and handed
+to the workers as a read-only array in shared memory, the PDF library is
+built once before the workers start and then memory-mapped by all of them.
+Average testing rewards of every batch are sent back as soon as the batch
+is done.
+"""
+
+
+import os
+import time
+
+from multiprocessing import Pool
+from multiprocessing import Queue
+from multiprocessing import cpu_count
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+import roslib; roslib.load_manifest('ua_audio_infomax')
+
+from pybrain.optimization import PGPE
+from pybrain.optimization import CMAES
+from pybrain.rl.agents import OptimizationAgent
+from pybrain.rl.experiments import EpisodicExperiment
+from pybrain.tools.shortcuts import buildNetwork
+from pybrain.structure.modules import SoftmaxLayer
+
+from ua_audio_infomax.PDF import OBJ_PDF_DATABASE
+from ua_audio_infomax.PDF import load_pdf_library
+from ua_audio_infomax.tasks import InfoMaxTask
+from ua_audio_infomax.tasks import load_prior_alphas
+from ua_audio_infomax.tasks import set_prior_alphas
+from ua_audio_infomax.batch_tasks import BatchInfoMaxTask
+from ua_audio_infomax.environment import InfoMaxEnv
+
+
+__author__ = 'Daniel Ford, Antons Rebguns'
+__copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
+__credits__ = 'Ian Fasel'
+
+__license__ = 'BSD'
+__maintainer__ = 'Daniel Ford'
+__email__ = 'dford@email.arizona.edu'
+
+
+ALGORITHMS = ('pgpe', 'cmaes')
+
+
+class ExperimentSpec():
+    def __init__(self, exp_id, algorithm, object_names, action_names, num_objects,
+                       num_batches, num_learning_episodes, num_testing_episodes,
+                       max_steps, seed=None):
+        self.exp_id = exp_id
+        self.algorithm = algorithm
+        self.object_names = list(object_names)
+        self.action_names = list(action_names)
+        self.num_objects = num_objects
+        self.num_batches = num_batches
+        self.num_learning_episodes = num_learning_episodes
+        self.num_testing_episodes = num_testing_episodes
+        self.max_steps = max_steps
+        self.seed = seed    # None keeps the random state of the process
+
+
+def build_agent(algorithm, task):
+    """Softmax policy network of a task wrapped in a PGPE or CMA-ES agent."""
+    net = buildNetwork(task.outdim, task.indim, bias=True, outclass=SoftmaxLayer)
+    
+    if algorithm == 'pgpe':
+        return OptimizationAgent(net, PGPE(storeAllEvaluations=True,minimize=False,verbose=False))
+    elif algorithm == 'cmaes':
+        return OptimizationAgent(net, CMAES(minimize=False,verbose=False))
+        
+    raise ValueError('unknown optimization algorithm %s' % algorithm)
+
+
+def run_experiment(spec, report=None):
+    """
+    Learns for spec.num_batches batches of spec.num_learning_episodes episodes,
+    testing the best network found so far after every batch.
+    report(exp_id, batch, avg_testing_reward, rewards) is called after each
+    batch. Returns the average testing reward of every batch (after a leading
+    0), the best of them and the network that earned it.
+    """
+    if spec.seed is not None: np.random.seed(spec.seed)
+    
+    # set up environment, task, neural net, agent, and experiment
+    env = InfoMaxEnv(spec.object_names, spec.action_names, spec.num_objects, False)
+    task = InfoMaxTask(env, max_steps=spec.max_steps)
+    agent = build_agent(spec.algorithm, task)
+    experiment = EpisodicExperiment(task, agent)
+    batch_task = BatchInfoMaxTask(spec.object_names, spec.action_names, spec.num_objects, spec.num_testing_episodes, max_steps=spec.max_steps)
+    
+    exp_id = spec.exp_id
+    exp_best_reward = -1000
+    exp_best_params = []
+    exp_agent_rewards = [0]
+    
+    print '\n*********** STARTING EXPERIMENT %d ***********' % exp_id
+    
+    for i in range(spec.num_batches):
+        if i % 30 == 0: print '[%d] processing batch %d [best = %f]' % (exp_id, i, exp_best_reward)
+        
+        experiment.doEpisodes(spec.num_learning_episodes)
+        
+        # evaluate the best policy found so far, all testing episodes run side
+        # by side without learning
+        best_network, best_score = agent.learner._bestFound()
+        
+        for test_ep in range(spec.num_testing_episodes):
+            agent.newEpisode()
+            
+        rewards = list(batch_task.run_episodes(best_network, spec.num_testing_episodes))
+        avg_testing_reward = np.mean(rewards)
+        exp_agent_rewards.append(avg_testing_reward)
+        
+        if report: report(exp_id, i, avg_testing_reward, rewards)
+        
+        if avg_testing_reward > exp_best_reward:
+            print '[%d] New best reward %f (change from previous is %f)' % (exp_id, avg_testing_reward, avg_testing_reward - exp_best_reward)
+            exp_best_reward = avg_testing_reward
+            exp_best_params = best_network
+            
+    print '[%d] experiment best reward is %f' % (exp_id, exp_best_reward)
+    return exp_agent_rewards, exp_best_reward, exp_best_params
+
+
+# per worker process, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(reports, alphas_buffer, alphas_shape, action_names, object_names):
+    # forked workers would otherwise all run the same episodes
+    np.random.seed((os.getpid() * 1000003 + int(time.time() * 1000)) % 4294967296)
+    
+    prior_alphas = np.frombuffer(alphas_buffer, dtype=float).reshape(alphas_shape)
+    prior_alphas.flags.writeable = False
+    set_prior_alphas(action_names, object_names, prior_alphas)
+    
+    _worker['reports'] = reports
+
+
+def _report(exp_id, batch, avg_testing_reward, rewards):
+    _worker['reports'].put((exp_id, batch, avg_testing_reward, rewards))
+
+
+def _run_experiment(spec):
+    try:
+        return run_experiment(spec, _report)
+    finally:
+        # every report of this experiment is in the queue before this one
+        _worker['reports'].put((spec.exp_id, None, None, None))
+
+
+class ExperimentRunner():
+    def __init__(self, object_names, action_names, processes=None):
+        self.object_names = list(object_names)
+        self.action_names = list(action_names)
+        self.processes = processes or cpu_count()
+        self.reports = Queue()
+        
+        # read everything the workers share once, before they are forked:
+        # the priors go into shared memory, the PDF library gets (re)built
+        # here and is memory-mapped by every worker afterwards
+        prior_alphas = load_prior_alphas(self.action_names, self.object_names)
+        self.alphas_buffer = RawArray('d', prior_alphas.size)
+        np.frombuffer(self.alphas_buffer, dtype=float)[:] = prior_alphas.ravel()
+        
+        load_pdf_library(OBJ_PDF_DATABASE, self.action_names, self.object_names)
+        
+        self.pool = Pool(processes=self.processes,
+                         initializer=_init_worker,
+                         initargs=(self.reports, self.alphas_buffer, prior_alphas.shape, self.action_names, self.object_names))
+
+
+    def run(self, specs, callback=None):
+        """
+        Runs all experiments, at most one per process at a time, and returns
+        their run_experiment results in the order of specs. As batches finish
+        callback(exp_id, batch, avg_testing_reward, rewards) is called here,
+        in the parent process.
+        """
+        results = [self.pool.apply_async(_run_experiment, (spec,)) for spec in specs]
+        running = len(specs)
+        
+        while running:
+            exp_id, batch, avg_testing_reward, rewards = self.reports.get()
+            
+            if batch is None:
+                running -= 1
+            elif callback:
+                callback(exp_id, batch, avg_testing_reward, rewards)
+                
+        # re-raises the exception of a failed experiment
+        return [r.get() for r in results]
+
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -33,7 +33,6 @@
 
 import os
 import sys
-import pickle
 import datetime
 import itertools
 
@@ -46,6 +45,9 @@ import numpy as np
 
 from scipy import stats
 
+from ua_audio_infomax.results import ExperimentResults
+from ua_audio_infomax.results import column_stats
+
 
 __author__ = 'Daniel Ford, Antons Rebguns'
 __copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
@@ -59,22 +61,20 @@ __email__ = 'dford@email.arizona.edu'
 class graph():
     def __init__(self, path):
         self.path = path
-        pkl_path = os.path.join(self.path, 'experiment.desc')
-        
-        pkl = open(pkl_path)
-        
-        self.timestamp = pickle.load(pkl)
-        self.numCategories = pickle.load(pkl)
-        self.object_names = pickle.load(pkl)
-        self.action_names = pickle.load(pkl)
-        self.numbExp = pickle.load(pkl)
-        self.prnts = pickle.load(pkl)
-        self.batch = pickle.load(pkl)
-        self.numTestingEps = pickle.load(pkl)
-        self.numTestRunEps = pickle.load(pkl)
-        self.maxSteps = pickle.load(pkl)
-        
-        #self.params = pickle.load(pkl)
+        self.results = ExperimentResults(self.path)
+        
+        metadata = self.results.metadata
+        
+        self.timestamp = metadata['timestamp']
+        self.numCategories = metadata['num_categories']
+        self.object_names = metadata['object_names']
+        self.action_names = metadata['action_names']
+        self.numbExp = metadata['num_experiments']
+        self.prnts = metadata['num_batches']
+        self.batch = metadata['num_learning_episodes']
+        self.numTestingEps = metadata['num_testing_episodes']
+        self.numTestRunEps = metadata['num_best_test_runs']
+        self.maxSteps = metadata['max_steps']
 
 
     def print_data(self):
@@ -96,18 +96,8 @@ class graph():
 
 
     def plot_rewards_per_learning_episode(self, fig_path):
-        pkl_path = os.path.join(self.path, 'RewardsPerEpisode-learning.pkl')
-        pkl = open(pkl_path)
-        lrn_rewards = pickle.load(pkl)
-        pkl.close()
-        
-        pkl_path = os.path.join(self.path, 'RewardsPerStep-trained.pkl')
-        pkl = open(pkl_path)
-        learned_rewards = np.array(pickle.load(pkl))
-        handcoded_rewards = np.array(pickle.load(pkl))
-        pkl.close()
-        
-        hand_reward = handcoded_rewards.sum(axis=1).mean()
+        lrn_rewards = self.results.column('learning_rewards')
+        hand_reward = self.results.column('handcoded_rewards').sum(axis=1).mean()
         
         x_vals = np.arange(np.size(lrn_rewards, axis=1)) * (self.batch)
         means = np.mean(lrn_rewards, axis=0)
@@ -125,11 +115,8 @@ class graph():
 
 
     def plot_rewards_per_trained_step(self, fig_path):
-        pkl_path = os.path.join(self.path, 'RewardsPerStep-trained.pkl')
-        pkl = open(pkl_path)
-        learned_rewards = np.array(pickle.load(pkl))
-        handcoded_rewards = np.array(pickle.load(pkl))
-        pkl.close()
+        learned_rewards = self.results.column('learned_rewards')
+        handcoded_rewards = self.results.column('handcoded_rewards')
         
         pad = np.zeros((learned_rewards.shape[0],1))
         learned_rewards = np.hstack((pad,learned_rewards))
@@ -191,11 +178,8 @@ class graph():
 
 
     def plot_accuracy_per_step(self, fig_path):
-        pkl_path = os.path.join(self.path, 'AccuracyPerStep.pkl')
-        pkl = open(pkl_path)
-        probCorrect = np.array(pickle.load(pkl), dtype='float64')
-        probCorrectHand = np.array(pickle.load(pkl), dtype='float64')
-        pkl.close()
+        probCorrect = np.asarray(self.results.column('learned_accuracy'), dtype='float64')
+        probCorrectHand = np.asarray(self.results.column('handcoded_accuracy'), dtype='float64')
         
         pad = np.zeros((probCorrect.shape[0],probCorrect.shape[1],1))
         probCorrect = np.dstack((pad,probCorrect))
@@ -273,38 +257,21 @@ Handcoded \%% %(handcoded_row)s\\
         f.close()
 
     def plot_joint_probs_per_step(self, fig_path):
-        pkl_path = os.path.join(self.path, 'JointProbsPerStep-learned.pkl')
-        pkl = open(pkl_path)
-        
-        learned_steps = np.array(pickle.load(pkl))
-        joint_probs_learned = np.array(pickle.load(pkl))
-        
-        handcoded_steps = pickle.load(pkl)
-        joint_probs_handcoded = np.array(pickle.load(pkl))
-        
-        learned_true = np.array(pickle.load(pkl))
-        handcoded_true = np.array(pickle.load(pkl))
-        
-        pkl.close()
-        
-        p = np.array(['']*learned_steps.shape[0])
-        pad = np.reshape(p, (p.shape[0],-1))
-        learned_steps = np.hstack((learned_steps,pad))
-        handcoded_steps = np.hstack((handcoded_steps,pad))
-        
-        pad = np.ones((joint_probs_learned.shape[0],joint_probs_learned.shape[1],1,joint_probs_learned.shape[3])) / joint_probs_learned.shape[3]
-        joint_probs_learned = np.dstack((pad,joint_probs_learned))
-        joint_probs_handcoded = np.dstack((pad,joint_probs_handcoded))
-        
-        pkl_path = os.path.join(self.path, 'RewardsPerStep-trained.pkl')
-        pkl = open(pkl_path)
-        learned_rewards = np.array(pickle.load(pkl))
-        handcoded_rewards = np.array(pickle.load(pkl))
-        pkl.close()
-        
-        pad = np.zeros((learned_rewards.shape[0],1))
-        learned_rewards = np.hstack((pad,learned_rewards))
-        handcoded_rewards = np.hstack((pad,handcoded_rewards))
+        # traces are read one test run at a time, with the joint probabilities
+        # starting from a uniform distribution and rewards from 0
+        def steps(column, run):
+            return [self.action_names[a] for a in self.results.column(column)[run]] + ['']
+            
+        def joint_probs(column, run):
+            probs = self.results.column(column)[run]
+            pad = np.ones((probs.shape[0],1,probs.shape[2])) / probs.shape[2]
+            return np.hstack((pad,probs))
+            
+        def rewards(column, run):
+            return np.hstack(([0.0], self.results.column(column)[run]))
+            
+        learned_true = self.results.column('learned_true')
+        handcoded_true = self.results.column('handcoded_true')
         
         matplotlib.rcParams['legend.fontsize'] = 6
         matplotlib.rcParams['xtick.labelsize'] = 5
@@ -312,7 +279,11 @@ Handcoded \%% %(handcoded_row)s\\
         
         styles = itertools.cycle(['b+', 'gx', 'rd', 'co', 'mv', 'y^', 'k*', 'bx', 'g+', 'r*'])
         
-        for test_run_idx in range(len(learned_steps)-1):
+        for test_run_idx in range(len(learned_true)-1):
+            learned_steps = steps('learned_actions', test_run_idx)
+            joint_probs_learned = joint_probs('learned_joint_probs', test_run_idx)
+            learned_rewards = rewards('learned_rewards', test_run_idx)
+            
             fig1 = plt.figure()
             fig1.suptitle('Category Joint Probabilities (Learned)')
             fig1.set_figwidth(4.50)
@@ -321,16 +292,16 @@ Handcoded \%% %(handcoded_row)s\\
             
             for object_location,object_idx in enumerate(learned_true[test_run_idx]):
                 ax = fig1.add_subplot(len(learned_true[test_run_idx])+1,1,object_location+1)
-                ax.plot(joint_probs_learned[test_run_idx,object_location])
-                ax.set_xticks(np.arange(len(learned_steps[test_run_idx])))
-                max_val = np.round(np.max(joint_probs_learned[test_run_idx,object_location]), 1)
+                ax.plot(joint_probs_learned[object_location])
+                ax.set_xticks(np.arange(len(learned_steps)))
+                max_val = np.round(np.max(joint_probs_learned[object_location]), 1)
                 ax.set_yticks(np.arange(0.0, max_val+0.05, 0.05))
                 l = np.arange(0.05, max_val, 0.1).tolist()
                 l = np.array(zip(['']*len(l), l)).flatten()
                 ax.set_yticklabels(l)
                 ax.set_xticklabels([])
                 ax.get_xaxis().tick_bottom()
-                #plt.xticks(np.arange(len(learned_steps[test_run_idx])), learned_steps[test_run_idx], rotation='vertical')
+                #plt.xticks(np.arange(len(learned_steps)), learned_steps, rotation='vertical')
                 
                 #plt.axis([0, self.maxSteps, 0, 1])
                 
@@ -347,9 +318,9 @@ Handcoded \%% %(handcoded_row)s\\
                     legend_present = True
                     
             ax = fig1.add_subplot(len(learned_true[test_run_idx])+1,1,len(learned_true[test_run_idx])+1)
-            ax.plot(learned_rewards[test_run_idx], 'r+-')
-            plt.xticks(np.arange(len(learned_steps[test_run_idx])), learned_steps[test_run_idx], rotation='vertical')
-            max_val = np.round(np.max(learned_rewards[test_run_idx]), 1)
+            ax.plot(learned_rewards, 'r+-')
+            plt.xticks(np.arange(len(learned_steps)), learned_steps, rotation='vertical')
+            max_val = np.round(np.max(learned_rewards), 1)
             ax.set_yticks(np.arange(0.0, max_val+0.1, 0.05))
             ax.set_yticklabels(np.arange(0.0, max_val+0.05, 0.05))
             ax.yaxis.set_label_position('right')
@@ -360,7 +331,11 @@ Handcoded \%% %(handcoded_row)s\\
             
             plt.savefig(os.path.join(fig_path, 'JointProbsPerStep-%s-learned-%d.pdf' % (str([self.object_names[i] for i in learned_true[test_run_idx]]), test_run_idx)))
             
-        for test_run_idx in range(len(handcoded_steps)-1):
+        for test_run_idx in range(len(handcoded_true)-1):
+            handcoded_steps = steps('handcoded_actions', test_run_idx)
+            joint_probs_handcoded = joint_probs('handcoded_joint_probs', test_run_idx)
+            handcoded_rewards = rewards('handcoded_rewards', test_run_idx)
+            
             fig1 = plt.figure()
             fig1.suptitle('Category Joint Probabilities (Handcoded)', size='small')
             fig1.set_figwidth(4.50)
@@ -369,16 +344,16 @@ Handcoded \%% %(handcoded_row)s\\
             
             for object_location,object_idx in enumerate(handcoded_true[test_run_idx]):
                 ax = fig1.add_subplot(len(handcoded_true[test_run_idx])+1,1,object_location+1)
-                ax.plot(joint_probs_handcoded[test_run_idx,object_location])
-                ax.set_xticks(np.arange(len(handcoded_steps[test_run_idx])))
-                max_val = np.round(np.max(joint_probs_handcoded[test_run_idx,object_location]), 1)
+                ax.plot(joint_probs_handcoded[object_location])
+                ax.set_xticks(np.arange(len(handcoded_steps)))
+                max_val = np.round(np.max(joint_probs_handcoded[object_location]), 1)
                 ax.set_yticks(np.arange(0.0, max_val+0.05, 0.05))
                 l = np.arange(0.05, max_val, 0.1).tolist()
                 l = np.array(zip(['']*len(l), l)).flatten()
                 ax.set_yticklabels(l)
                 ax.set_xticklabels([])
                 ax.get_xaxis().tick_bottom()
-                #plt.xticks(np.arange(len(handcoded_steps[test_run_idx])), handcoded_steps[test_run_idx], rotation='vertical')
+                #plt.xticks(np.arange(len(handcoded_steps)), handcoded_steps, rotation='vertical')
                 
                 #plt.axis([0, self.maxSteps, 0, 1])
                 
@@ -395,9 +370,9 @@ Handcoded \%% %(handcoded_row)s\\
                     legend_present = True
                     
             ax = fig1.add_subplot(len(handcoded_true[test_run_idx])+1,1,len(handcoded_true[test_run_idx])+1)
-            ax.plot(handcoded_rewards[test_run_idx], 'r+-')
-            plt.xticks(np.arange(len(handcoded_steps[test_run_idx])), handcoded_steps[test_run_idx], rotation='vertical')
-            max_val = np.round(np.max(handcoded_rewards[test_run_idx]), 1)
+            ax.plot(handcoded_rewards, 'r+-')
+            plt.xticks(np.arange(len(handcoded_steps)), handcoded_steps, rotation='vertical')
+            max_val = np.round(np.max(handcoded_rewards), 1)
             ax.set_yticks(np.arange(0.0, max_val+0.1, 0.05))
             ax.set_yticklabels(np.arange(0.0, max_val+0.05, 0.05))
             ax.yaxis.set_label_position('right')
@@ -421,13 +396,39 @@ Handcoded \%% %(handcoded_row)s\\
         print 'ALL GRAPHS DONE'
 
 
+def print_summary(paths):
+    """
+    Learning and test results pooled over many experiment directories, only
+    the columns needed are read, a chunk of rows at a time.
+    """
+    print ""
+    print "***** summary of %d experiment directories *****" % len(paths)
+    print ""
+    
+    means, stds, sems, count = column_stats(paths, 'learning_rewards')
+    print "learning runs: %d" % count
+    print "testing reward after last batch: %f +- %f" % (means[-1], sems[-1])
+    print "best average testing reward: %f (batch %d)" % (means.max(), means.argmax())
+    print ""
+    
+    for policy in ('learned', 'handcoded'):
+        means, stds, sems, count = column_stats(paths, policy + '_rewards')
+        print "%s policy, %d runs: total reward %f" % (policy, count, means.sum())
+        
+        means, stds, sems, count = column_stats(paths, policy + '_accuracy')
+        print "%s policy, %d runs: accuracy after last step %2.1f%%" % (policy, count, means[...,-1].mean() * 100)
+        
+    print ""
+
+
 if __name__ == '__main__':
-        if len(sys.argv) < 3:
-            path = ''
+        # one directory gets plotted, several get summarized
+        paths = sys.argv[1:] or ['']
+        
+        if len(paths) > 1:
+            print_summary(paths)
         else:
-            path = sys.argv[1]
-            
-        graph1 = graph(path)
-        graph1.print_data()
-        graph1.plot_all()
+            graph1 = graph(paths[0])
+            graph1.print_data()
+            graph1.plot_all()
 
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Columnar on-disk store for InfoMax experiment results.
+
+An experiment directory holds one .npy file per metric (a column) and a
+results.json header with the experiment parameters and the name, file,
+dtype and shape of every column. Columns are memory-mapped when read, so
+readers only touch the columns, and the rows of them, they actually use. The
+header is written last, a directory without one is incomplete.
+
+Columns written by experimentGraphingWrapper.py (R test runs of the best
+policy, O objects, S steps, C categories):
+
+    learning_rewards        experiments x (batches+1) average testing rewards
+    best_params             parameters of the best policy network
+    learned_rewards         R x S rewards per step of the trained policy
+    learned_accuracy        R x O x S correct (1) or not (0) per object
+    learned_joint_probs     R x O x S x C joint category probabilities
+    learned_actions         R x S action ids
+    learned_true            R x O true categories of the objects
+    handcoded_*             the same for the hand-coded policy
+
+Directories written before this format (experiment.desc and the other
+pickles) are converted on first use by convert_pickles().
+"""
+
+
+import os
+import json
+import pickle
+
+import numpy as np
+
+
+__author__ = 'Daniel Ford, Antons Rebguns'
+__copyright__ = 'Copyright (c) 2011 Daniel Ford, Antons Rebguns'
+__credits__ = 'Ian Fasel'
+
+__license__ = 'BSD'
+__maintainer__ = 'Daniel Ford'
+__email__ = 'dford@email.arizona.edu'
+
+
+RESULTS_HEADER = 'results.json'
+FORMAT_VERSION = 1
+
+# rows per read when reducing a column over many directories
+CHUNK_ROWS = 4096
+
+# experiment.desc entries in the order experimentGraphingWrapper.py pickled them
+LEGACY_METADATA = ('timestamp', 'num_categories', 'object_names', 'action_names',
+                   'num_experiments', 'num_batches', 'num_learning_episodes',
+                   'num_testing_episodes', 'num_best_test_runs', 'max_steps')
+
+# other pickles of the old format and the columns they hold, in order
+LEGACY_PICKLES = (('RewardsPerEpisode-learning.pkl', ('learning_rewards',)),
+                  ('RewardsPerStep-trained.pkl', ('learned_rewards', 'handcoded_rewards')),
+                  ('AccuracyPerStep.pkl', ('learned_accuracy', 'handcoded_accuracy')),
+                  ('JointProbsPerStep-learned.pkl', ('learned_actions', 'learned_joint_probs',
+                                                     'handcoded_actions', 'handcoded_joint_probs',
+                                                     'learned_true', 'handcoded_true')))
+
+
+class ResultWriter():
+    def __init__(self, path, metadata):
+        self.path = path
+        self.metadata = dict(metadata)
+        self.columns = {}
+        
+        if self.path and not os.path.exists(self.path):
+            os.makedirs(self.path)
+            
+        # an existing header describes columns that are about to be replaced
+        header_file = os.path.join(self.path, RESULTS_HEADER)
+        if os.path.exists(header_file): os.remove(header_file)
+
+
+    def add(self, name, values, dtype=None):
+        values = np.ascontiguousarray(values, dtype=dtype)
+        file_name = name + '.npy'
+        
+        np.save(os.path.join(self.path, file_name), values)
+        self.columns[name] = {'file': file_name, 'dtype': values.dtype.str, 'shape': list(values.shape)}
+
+
+    def close(self):
+        header = {'version': FORMAT_VERSION, 'metadata': self.metadata, 'columns': self.columns}
+        header_file = os.path.join(self.path, RESULTS_HEADER)
+        
+        f = open(header_file + '.tmp', 'w')
+        json.dump(header, f, indent=4, sort_keys=True)
+        f.close()
+        os.rename(header_file + '.tmp', header_file)
+
+
+class ExperimentResults():
+    def __init__(self, path):
+        self.path = path
+        
+        header_file = os.path.join(self.path, RESULTS_HEADER)
+        if not os.path.exists(header_file) and os.path.exists(os.path.join(self.path, 'experiment.desc')):
+            convert_pickles(self.path)
+            
+        f = open(header_file)
+        header = json.load(f)
+        f.close()
+        
+        if header['version'] > FORMAT_VERSION:
+            raise ValueError('%s has format version %d, only %d is supported' % (header_file, header['version'], FORMAT_VERSION))
+            
+        self.metadata = header['metadata']
+        self.columns = header['columns']
+        self.maps = {}
+
+
+    def __contains__(self, name):
+        return name in self.columns
+
+
+    def shape(self, name):
+        return tuple(self.columns[name]['shape'])
+
+
+    def column(self, name):
+        """Read-only memory map of a column, opened once."""
+        if name not in self.maps:
+            if name not in self.columns: raise KeyError('%s has no column %s' % (self.path, name))
+            self.maps[name] = np.load(os.path.join(self.path, self.columns[name]['file']), mmap_mode='r')
+            
+        return self.maps[name]
+
+
+    def close(self):
+        self.maps = {}
+
+
+def write_results(path, metadata, columns):
+    """Writes a dict of column name -> array as a complete result directory."""
+    writer = ResultWriter(path, metadata)
+    
+    for name, values in sorted(columns.items()):
+        writer.add(name, values)
+        
+    writer.close()
+
+
+def convert_pickles(path):
+    """
+    Converts a result directory of the old pickle format. Columns the old
+    files don't have (or whose pickles are truncated) are left out.
+    """
+    f = open(os.path.join(path, 'experiment.desc'), 'rb')
+    metadata = dict((key, pickle.load(f)) for key in LEGACY_METADATA)
+    
+    try:
+        network = pickle.load(f)
+    except Exception:
+        network = None
+    
+    f.close()
+    
+    columns = {}
+    if network is not None: columns['best_params'] = np.asarray(getattr(network, 'params', network), dtype=float)
+    
+    for file_name, names in LEGACY_PICKLES:
+        pkl_path = os.path.join(path, file_name)
+        if not os.path.exists(pkl_path): continue
+        
+        f = open(pkl_path, 'rb')
+        
+        for name in names:
+            try:
+                columns[name] = pickle.load(f)
+            except Exception:
+                break
+                
+        f.close()
+        
+    # action names become ids so the traces fit in an integer column, the
+    # oldest files have other things in their place
+    action_ids = dict((action, action_id) for action_id, action in enumerate(metadata['action_names']))
+    
+    for name in ('learned_actions', 'handcoded_actions'):
+        if name not in columns: continue
+        
+        try:
+            columns[name] = [[action_ids[action] for action in trace] for trace in columns[name]]
+        except (KeyError, TypeError):
+            del columns[name]
+            
+    arrays = {}
+    
+    for name, values in columns.items():
+        values = np.asarray(values)
+        
+        # ragged traces can't be stored as a column
+        if values.dtype != object: arrays[name] = values
+        
+    write_results(path, metadata, arrays)
+
+
+def column_stats(paths, name):
+    """
+    Mean, standard deviation and standard error (like scipy.stats.sem) over
+    the first axis of a column, with the rows of all result directories in
+    paths pooled together. Columns are read CHUNK_ROWS rows at a time and the
+    per-chunk statistics merged, so only one chunk is in memory at once.
+    """
+    count = 0
+    mean = None
+    m2 = None
+    
+    for path in paths:
+        column = ExperimentResults(path).column(name)
+        
+        if mean is not None and column.shape[1:] != mean.shape:
+            raise ValueError('column %s of %s has shape %s, expected (n, %s)' % (name, path, column.shape, ', '.join(map(str, mean.shape))))
+            
+        for start in range(0, column.shape[0], CHUNK_ROWS):
+            rows = np.asarray(column[start:start+CHUNK_ROWS], dtype=float)
+            n = rows.shape[0]
+            rows_mean = rows.mean(axis=0)
+            rows_m2 = ((rows - rows_mean) ** 2).sum(axis=0)
+            
+            if mean is None:
+                count, mean, m2 = n, rows_mean, rows_m2
+                continue
+                
+            delta = rows_mean - mean
+            total = count + n
+            mean = mean + delta * n / total
+            m2 = m2 + rows_m2 + delta * delta * count * n / total
+            count = total
+            
+    if not count: raise ValueError('no rows of column %s in %s' % (name, ', '.join(paths)))
+    
+    std = np.sqrt(m2 / count)
+    sem = np.sqrt(m2 / max(count - 1, 1)) / np.sqrt(count)
+    
+    return mean, std, sem, count
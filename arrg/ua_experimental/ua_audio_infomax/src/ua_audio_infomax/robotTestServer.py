@@ -34,6 +34,17 @@
 """
 test node that responds to service requests from the InfoMax agent
 intended to mimic robot controller node
+
+Clients register their configuration (object, action and category counts
+and names) once through InfoMaxRegister and get a session id back. Steps
+then only carry the session id, the action and the category at the current
+location (InfoMaxStep), or a whole sequence of actions (InfoMaxBatchStep).
+InfoMaxReset puts the robot of one session back at its start,
+reset_current_location only resets the sessions of plain InfoMax requests.
+Every session has its own simulated robot, sessions with the same names
+share a PDF library. The original InfoMax request, which carries the whole
+configuration with every step, is still served through an implicit session
+per configuration.
 """
 
 
@@ -47,6 +58,14 @@ import numpy as np
 from ua_audio_infomax.PDF import PDF_library
 from ua_audio_infomax.srv import InfoMax
 from ua_audio_infomax.srv import InfoMaxResponse
+from ua_audio_infomax.srv import InfoMaxRegister
+from ua_audio_infomax.srv import InfoMaxRegisterResponse
+from ua_audio_infomax.srv import InfoMaxStep
+from ua_audio_infomax.srv import InfoMaxStepResponse
+from ua_audio_infomax.srv import InfoMaxBatchStep
+from ua_audio_infomax.srv import InfoMaxBatchStepResponse
+from ua_audio_infomax.srv import InfoMaxReset
+from ua_audio_infomax.srv import InfoMaxResetResponse
 from ua_audio_infomax.msg import Action as InfomaxAction
 
 
@@ -59,6 +78,18 @@ __maintainer__ = 'Daniel Ford'
 __email__ = 'dford@email.arizona.edu'
 
 
+class InfoMaxSession():
+    def __init__(self, object_names, action_names, num_objects, num_categories):
+        self.object_names = list(object_names)
+        self.action_names = list(action_names)
+        self.num_objects = num_objects
+        self.num_categories = num_categories
+        self.num_actions = len(self.action_names)
+        
+        self.current_location = 0
+        self.current_state = 'init'
+
+
 class robotTestServer():
     def __init__(self, standalone=False):
         self.state = {InfomaxAction.GRASP:          'grasped',
@@ -78,84 +109,189 @@ class robotTestServer():
                                 'placed':   [InfomaxAction.GRASP, InfomaxAction.PUSH, InfomaxAction.MOVE_LEFT, InfomaxAction.MOVE_RIGHT],
                                }
                                
-        self.object_names = []
-        self.action_names = []
-        self.num_objects = []
-        self.current_location = 0
-        self.current_state = 'init'
-        self.pdf_database_initialized = False
+        self.sessions = {}          # session id -> InfoMaxSession
+        self.legacy_sessions = {}   # configuration -> session id for plain InfoMax requests
+        self.databases = {}         # (action names, object names) -> PDF_library
+        self.next_session = 1
         
         if standalone:
             rospy.init_node('robotTestServer')
             rospy.Service('InfoMax', InfoMax, self.handle_infomax_request)
+            rospy.Service('InfoMaxRegister', InfoMaxRegister, self.handle_register_request)
+            rospy.Service('InfoMaxStep', InfoMaxStep, self.handle_step_request)
+            rospy.Service('InfoMaxBatchStep', InfoMaxBatchStep, self.handle_batch_step_request)
+            rospy.Service('InfoMaxReset', InfoMaxReset, self.handle_reset_request)
             rospy.Service('reset_current_location', Empty, self.reset_current_location)
             
         rospy.loginfo('Ready to run the robot')
 
 
-    def initialize_pdf_library(self):
-        rospy.loginfo('creating pdf library...')
-        self.database = PDF_library(self.action_names, self.object_names)
-        self.pdf_database_initialized = True
-        rospy.loginfo('done')
+    def pdf_library(self, session):
+        key = (tuple(session.action_names), tuple(session.object_names))
+        
+        if key not in self.databases:
+            rospy.loginfo('creating pdf library...')
+            self.databases[key] = PDF_library(session.action_names, session.object_names)
+            rospy.loginfo('done')
+            
+        return self.databases[key]
+
+
+    def register_session(self, object_names, action_names, num_objects, num_categories):
+        """
+        Sets up a simulated robot for one client configuration, returns the
+        session id to step it with.
+        """
+        session = InfoMaxSession(object_names, action_names, num_objects, num_categories)
+        self.pdf_library(session)
+        
+        session_id = self.next_session
+        self.next_session += 1
+        self.sessions[session_id] = session
+        
+        return session_id
+
+
+    def get_session(self, session_id):
+        if session_id not in self.sessions:
+            raise rospy.ServiceException('unknown InfoMax session %d' % session_id)
+            
+        return self.sessions[session_id]
+
+
+    def reset_session(self, session_id):
+        """Puts the simulated robot of a session back at location 0."""
+        session = self.get_session(session_id)
+        session.current_location = 0
+        session.current_state = 'init'
 
 
     def reset_current_location(self, req):
-        self.current_location = 0
-        self.current_state = 'init'
+        # plain InfoMax clients don't know their session, reset all of theirs
+        for session_id in self.legacy_sessions.values():
+            self.reset_session(session_id)
+            
         #rospy.loginfo('Reset requested, at location %d' % self.current_location)
         return []
 
 
     def _reset(self):
-        self.reset_current_location(None)
-        self.pdf_database_initialized = False
+        for session_id in self.sessions:
+            self.reset_session(session_id)
+            
+        self.databases = {}
 
 
-    def handle_infomax_request(self, req):
+    def perform_action(self, session, action):
         """
-        instruct the robot to move to or sense the selected object
+        Moves the simulated robot of a session. Returns True if the action
+        senses the object at the current location (the location before the
+        action is performed).
         """
-        self.num_categories = req.numCats
-        self.object_names = req.objectNames
-        self.num_objects = req.num_objects
-        self.action_names = req.actionNames
-        self.num_actions = len(self.action_names)
+        sensed = False
         
-        if not self.pdf_database_initialized: self.initialize_pdf_library()
+        #rospy.loginfo('Performing %s at location %d (state %s)', session.action_names[action], session.current_location, session.current_state)
         
-        # uniform
-        beliefs = None
-        success = False
-        
-        #rospy.loginfo('Performing %s at location %d (state %s)', self.action_names[req.actionID.val], self.current_location, self.current_state)
-        
-        # perform action and get PDF (or None if we moved or reset the robot)
-        if req.actionID.val in self.allowed_actions[self.current_state]:
-            if req.actionID.val == InfomaxAction.MOVE_LEFT:
-                self.current_location = (self.current_location + 1) % self.num_objects
-                self.current_state = self.state[req.actionID.val]
-                success = True
-            elif req.actionID.val == InfomaxAction.MOVE_RIGHT:
-                self.current_location = (self.current_location - 1) % self.num_objects
-                self.current_state = self.state[req.actionID.val]
-                success = True
+        if action in self.allowed_actions[session.current_state]:
+            if action == InfomaxAction.MOVE_LEFT:
+                session.current_location = (session.current_location + 1) % session.num_objects
+            elif action == InfomaxAction.MOVE_RIGHT:
+                session.current_location = (session.current_location - 1) % session.num_objects
             else:
-                #rospy.loginfo('\tallowed: %s', str(self.allowed_actions[self.current_state]))
-                beliefs = self.database.sample(req.actionID.val, req.catID)
-                self.current_state = self.state[req.actionID.val]
-                success = True
-        else:
-            #beliefs = [1.0/self.num_categories]*self.num_categories
-            success = True
+                #rospy.loginfo('\tallowed: %s', str(self.allowed_actions[session.current_state]))
+                sensed = True
+                
+            session.current_state = self.state[action]
+            
+        #rospy.loginfo('\tAt location %d in state %s', session.current_location, session.current_state)
+        return sensed
+
+
+    def step(self, session_id, action, cat_id):
+        """
+        instruct the robot to move to or sense the selected object
+        """
+        session = self.get_session(session_id)
+        
+        # perform action and get PDF (or None if we moved or the action is not
+        # allowed in the current state, the step counts as successful anyway)
+        beliefs = None
+        
+        if self.perform_action(session, action):
+            beliefs = self.pdf_library(session).sample(action, cat_id)
             
-        #rospy.loginfo('\tAt location %d in state %s', self.current_location, self.current_state)
         #rospy.loginfo('\tSensed %s\n', str(beliefs))
         
-        return InfoMaxResponse(success, beliefs, self.current_location, self.current_state)
+        return InfoMaxStepResponse(True, beliefs, session.current_location, session.current_state)
+
+
+    def step_batch(self, session_id, actions, objects):
+        """
+        Performs a sequence of actions, objects holds the category of the
+        object at every location. All sensed PDFs are sampled in one go and
+        returned as a (sensed actions x categories) array, the other fields
+        are arrays with one entry per action.
+        """
+        session = self.get_session(session_id)
+        actions = np.asarray(actions, dtype=int)
+        
+        num = len(actions)
+        sensed = np.zeros(num, dtype=bool)
+        cat_ids = np.zeros(num, dtype=int)
+        locations = np.zeros(num, dtype=int)
+        states = [None] * num
+        
+        for idx, action in enumerate(actions.tolist()):
+            cat_ids[idx] = objects[session.current_location]
+            sensed[idx] = self.perform_action(session, action)
+            locations[idx] = session.current_location
+            states[idx] = session.current_state
+            
+        beliefs = self.pdf_library(session).sample_batch(actions[sensed], cat_ids[sensed])
+        
+        return InfoMaxBatchStepResponse(np.ones(num, dtype=bool), sensed, beliefs, locations, states)
+
+
+    def handle_register_request(self, req):
+        session_id = self.register_session(req.objectNames, req.actionNames, req.num_objects, req.numCats)
+        return InfoMaxRegisterResponse(session_id)
+
+
+    def handle_reset_request(self, req):
+        self.reset_session(req.session)
+        return InfoMaxResetResponse()
+
+
+    def handle_step_request(self, req):
+        return self.step(req.session, req.actionID.val, req.catID)
+
+
+    def handle_batch_step_request(self, req):
+        res = self.step_batch(req.session, req.actionIDs, req.objects)
+        
+        # flat lists for the wire
+        res.success = res.success.tolist()
+        res.sensed = res.sensed.tolist()
+        res.beliefs = res.beliefs.ravel().tolist()
+        res.locations = res.locations.tolist()
+        
+        return res
+
+
+    def handle_infomax_request(self, req):
+        """
+        instruct the robot to move to or sense the selected object, the
+        configuration in the request selects the session
+        """
+        key = (tuple(req.objectNames), tuple(req.actionNames), req.num_objects, req.numCats)
+        
+        if key not in self.legacy_sessions:
+            self.legacy_sessions[key] = self.register_session(req.objectNames, req.actionNames, req.num_objects, req.numCats)
+            
+        res = self.step(self.legacy_sessions[key], req.actionID.val, req.catID)
+        return InfoMaxResponse(res.success, res.beliefs, res.location, res.state)
 
 
 if __name__ == "__main__":
     server = robotTestServer(standalone=True)
     rospy.spin()
-
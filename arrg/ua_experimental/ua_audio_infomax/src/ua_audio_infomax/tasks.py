@@ -29,6 +29,7 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import pickle
 
 import numpy as np
@@ -54,6 +55,66 @@ __maintainer__ = 'Daniel Ford'
 __email__ = 'dford@email.arizona.edu'
 
 
+def log_beta(alphas):
+    """
+    Log of the multivariate Beta function (the Dirichlet normalizer) over the
+    last axis of alphas.
+    """
+    return gammaln(alphas).sum(axis=-1) - gammaln(alphas.sum(axis=-1))
+
+
+ALPHAS_DATABASE = '/tmp/alphas.pkl'
+
+# prior tables by (action names, category names), each with the modification
+# time of the pickle it was read from (None for tables set with
+# set_prior_alphas, those are never reloaded)
+_prior_alphas = {}
+
+
+def set_prior_alphas(action_names, category_names, prior_alphas):
+    """
+    Makes load_prior_alphas return prior_alphas for these names instead of
+    reading the pickle, e.g. a read-only view of a table in shared memory.
+    """
+    _prior_alphas[(tuple(action_names), tuple(category_names))] = (None, prior_alphas)
+
+
+def load_prior_alphas(action_names, category_names):
+    """
+    Dirichlet priors estimated by dir_est.py as a (actions x categories x
+    categories) array, actions without estimates get flat priors. The pickle
+    is only read again after it changes, callers must not modify the array.
+    """
+    key = (tuple(action_names), tuple(category_names))
+    mtime = os.path.getmtime(ALPHAS_DATABASE) if os.path.exists(ALPHAS_DATABASE) else None
+    
+    if key in _prior_alphas:
+        cached_mtime, prior_alphas = _prior_alphas[key]
+        if cached_mtime is None or cached_mtime == mtime: return prior_alphas
+        
+    prior_alphas = read_prior_alphas(action_names, category_names)
+    _prior_alphas[key] = (mtime, prior_alphas)
+    
+    return prior_alphas
+
+
+def read_prior_alphas(action_names, category_names):
+    """Reads the priors from the pickle written by dir_est.py."""
+    alphas_pkl = open(ALPHAS_DATABASE, 'rb')
+    alphas_map = pickle.load(alphas_pkl)
+    alphas_pkl.close()
+    
+    prior_alphas = np.ones((len(alphas_map),len(category_names),len(category_names)), dtype=float)
+    
+    for action_id, action_name in enumerate(action_names):
+        if action_name not in alphas_map: continue
+        
+        for category_id, category_name in enumerate(category_names):
+            prior_alphas[action_id,category_id] = alphas_map[action_name][category_name]
+            
+    return prior_alphas
+
+
 class InfoMaxTask(EpisodicTask, Named):
     def __init__(self, environment,
                        sort_beliefs=True,
@@ -79,24 +140,14 @@ class InfoMaxTask(EpisodicTask, Named):
         self.steps = 0
         self.current_location = 0
         
-        alphas_pkl = open('/tmp/alphas.pkl', 'rb')
-        alphas_map = pickle.load(alphas_pkl)
-        alphas_pkl.close()
+        self.prior_alphas = load_prior_alphas(self.env.action_names, self.env.category_names)
         
-        self.prior_alphas = np.ones((len(alphas_map),self.env.num_categories,self.env.num_categories), dtype=float)
+        # Dirichlet normalizers of the priors never change, all objects share them
+        self.prior_log_beta = log_beta(self.prior_alphas)
         
-        for action_name in self.env.action_names:
-            action_id = self.env.action_names.index(action_name)
-            
-            if action_name not in alphas_map: continue
-            
-            for category_name in self.env.category_names:
-                category_id = self.env.category_names.index(category_name)
-                self.prior_alphas[action_id,category_id] = alphas_map[action_name][category_name]
-                
         self.env.reset(randomize)
         #print 'true objects', self.env.objects
-        self.objects = [BeliefObjectDirichlet(self.env.num_categories, len(self.env.action_names), self.prior_alphas) for _ in self.env.objects]
+        self.objects = [BeliefObjectDirichlet(self.env.num_categories, len(self.env.action_names), self.prior_alphas, self.prior_log_beta) for _ in self.env.objects]
         self.action_counts = np.zeros((len(self.objects),len(self.env.action_names)))
         self.state_counts = np.zeros((len(self.objects),len(self.state_ids.keys())))
         
@@ -275,10 +326,15 @@ class InfoMaxTask(EpisodicTask, Named):
 
 
 class BeliefObjectDirichlet(Named):
-    def __init__(self, num_categories, num_actions, prior_alphas):
+    def __init__(self, num_categories, num_actions, prior_alphas, prior_log_beta=None):
         self.num_categories = num_categories    # number of object categories
         self.num_actions = num_actions          # number of possible actions
         self.prior_alphas = prior_alphas
+        
+        # log Dirichlet normalizer of every (action, category) prior
+        if prior_log_beta is None: prior_log_beta = log_beta(prior_alphas)
+        self.prior_log_beta = prior_log_beta
+        
         self.reset()
 
 
@@ -299,14 +355,9 @@ class BeliefObjectDirichlet(Named):
 
 
     def computeJointAlpha(self, alphas):
-        joint = []
-        if True:
-            for alpha in alphas:
-                joint.append(alpha * (1.0/alpha.sum()) )
-            joint = np.mean(np.array(joint),axis=0)
-        else:
-            joint = np.array(alphas).sum(axis=0)
-        return joint
+        # mean over actions of every action's normalized alphas
+        alphas = np.asarray(alphas)
+        return (alphas / alphas.sum(axis=1)[:,np.newaxis]).mean(axis=0)
 
 
     def update_joint_alphas(self):
@@ -323,18 +374,14 @@ class BeliefObjectDirichlet(Named):
         # get alphas over all objects for a given action (num_cat X num_cat matrix) and renormalize
         action_alphas = self.prior_alphas[action_id]
         
-        def compute_prob(pdf, alphas):
-            top = gammaln(alphas).sum()
-            bottom = gammaln(alphas.sum())
-            B = top - bottom
-            mult = ((alphas-1.0) * np.log(current_pdf)).sum()
-            return np.exp(mult - B)
-            
-        r = np.zeros(self.num_categories)
-        for category in range(self.num_categories):
-            r[category] = compute_prob(current_pdf, action_alphas[category])
+        # Dirichlet log likelihood of the pdf under every category's prior at
+        # once, the posterior is normalized in log space so peaked pdfs don't
+        # underflow to 0
+        with np.errstate(divide='ignore'):
+            log_r = np.dot(action_alphas - 1.0, np.log(current_pdf)) - self.prior_log_beta[action_id]
+            log_ps = np.log(self.category_alphas[action_id]) + log_r
             
-        ps = self.category_alphas[action_id] * r
+        ps = np.exp(log_ps - log_ps.max())
         posterior = ps / ps.sum()
         
         self.category_alphas[action_id] = posterior
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011, Daniel Ford, Antons Rebguns
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# Neither the name of the <ORGANIZATION> nor the names of its contributors may
+# be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+PKG = 'ua_audio_infomax'
+
+import roslib; roslib.load_manifest(PKG)
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ua_audio_infomax import PDF
+
+
+ACTION_NAMES = ['grasp', 'lift']
+OBJECT_NAMES = ['a', 'b', 'c']
+
+
+class TestPDFLibrary(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.databases = (PDF.OBJ_PDF_DATABASE, PDF.PROPORTIONS_DATABASE)
+        PDF.OBJ_PDF_DATABASE = os.path.join(self.tmp_dir, 'obj_pdf.pkl')
+        PDF.PROPORTIONS_DATABASE = os.path.join(self.tmp_dir, 'proportions.pkl')
+
+        # obj_pdf format: lists of {object: prob} dicts
+        obj_pdfs = {}
+        for action_name in ACTION_NAMES:
+            obj_pdfs[action_name] = {}
+            for object_name in OBJECT_NAMES:
+                obj_pdfs[action_name][object_name] = [dict((o, 1.0 if o == object_name else 0.0) for o in OBJECT_NAMES)]
+        self.dump(PDF.OBJ_PDF_DATABASE, obj_pdfs)
+
+        # proportions format, one row per sampled PDF, the row sums tell
+        # which (action, category) block a sample came from
+        self.probs_by_action = {}
+        for action_id, action_name in enumerate(ACTION_NAMES):
+            self.probs_by_action[action_name] = {}
+            for category_id, object_name in enumerate(OBJECT_NAMES):
+                rows = np.zeros((4, len(OBJECT_NAMES)))
+                rows[:,category_id] = 10 * action_id + category_id + 1
+                self.probs_by_action[action_name][object_name] = rows
+
+    def tearDown(self):
+        PDF.OBJ_PDF_DATABASE, PDF.PROPORTIONS_DATABASE = self.databases
+        shutil.rmtree(self.tmp_dir)
+
+    def dump(self, database, contents):
+        output = open(database, 'wb')
+        pickle.dump(contents, output)
+        output.close()
+
+    def check_proportions(self, contents):
+        self.dump(PDF.PROPORTIONS_DATABASE, contents)
+
+        library = PDF.PDF_library(ACTION_NAMES, OBJECT_NAMES)
+        library.read_pdf_database_new()
+
+        for action_id in range(len(ACTION_NAMES)):
+            for category_id in range(len(OBJECT_NAMES)):
+                pdf = library.sample_new(action_id, category_id)
+                self.assertEqual(len(pdf), len(OBJECT_NAMES))
+                self.assertEqual(sum(pdf), 10 * action_id + category_id + 1)
+
+    def test_proportions_list(self):
+        # what audio_read.py dumps
+        self.check_proportions([self.probs_by_action, OBJECT_NAMES, ACTION_NAMES])
+
+    def test_proportions_tuple(self):
+        self.check_proportions((self.probs_by_action, OBJECT_NAMES, ACTION_NAMES))
+
+    def test_obj_pdf(self):
+        library = PDF.PDF_library(ACTION_NAMES, OBJECT_NAMES)
+
+        for category_id, object_name in enumerate(OBJECT_NAMES):
+            pdf = library.sample(0, category_id)
+            self.assertEqual(pdf, [1.0 if o == object_name else 0.0 for o in OBJECT_NAMES])
+
+
+if __name__ == '__main__':
+    import rostest
+    rostest.unitrun(PKG, 'test_pdf_library', TestPDFLibrary)
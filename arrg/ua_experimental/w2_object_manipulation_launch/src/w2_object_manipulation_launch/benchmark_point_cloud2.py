@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Author: Antons Rebguns
+
+"""
+Compares the generator based read_points/create_cloud against the NumPy
+record array functions in point_cloud2 on a synthetic Kinect-sized cloud,
+checks that both return the same points and reports the time each takes.
+
+usage: benchmark_point_cloud2.py [width] [height] [nan_fraction]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import roslib; roslib.load_manifest('w2_object_manipulation_launch')
+
+from sensor_msgs.msg import PointField
+
+from w2_object_manipulation_launch.point_cloud2 import read_points
+from w2_object_manipulation_launch.point_cloud2 import read_points_array
+from w2_object_manipulation_launch.point_cloud2 import create_cloud
+from w2_object_manipulation_launch.point_cloud2 import array_to_cloud
+from w2_object_manipulation_launch.point_cloud2 import fields_to_dtype
+
+
+# layout of the openni driver's XYZRGB clouds: x, y, z, 4 bytes of padding
+# and rgb packed into a float, 32 bytes per point
+KINECT_FIELDS = [PointField('x', 0, PointField.FLOAT32, 1),
+                 PointField('y', 4, PointField.FLOAT32, 1),
+                 PointField('z', 8, PointField.FLOAT32, 1),
+                 PointField('rgb', 16, PointField.FLOAT32, 1)]
+KINECT_POINT_STEP = 32
+
+
+def synthesize(width, height, nan_fraction):
+    """Organized cloud of a slanted plane with nan_fraction points missing."""
+    points = np.zeros((height, width), dtype=fields_to_dtype(KINECT_FIELDS, KINECT_POINT_STEP))
+    v, u = np.mgrid[0:height, 0:width]
+
+    points['z'] = 1.0 + 0.001 * v
+    points['x'] = (u - width / 2.0) * points['z'] / 525.0
+    points['y'] = (v - height / 2.0) * points['z'] / 525.0
+    points['rgb'] = np.random.random((height, width))
+
+    missing = np.random.random((height, width)) < nan_fraction
+    for name in ('x', 'y', 'z'):
+        points[name][missing] = np.nan
+
+    return array_to_cloud(None, points)
+
+
+def timed(name, func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    elapsed = time.time() - start
+    print '%-40s %8.3f sec' % (name, elapsed)
+    return result, elapsed
+
+
+def same(generated, array, names):
+    expected = np.array(generated, dtype=float).reshape(-1, len(names))
+    got = np.column_stack([array[name] for name in names]).astype(float).reshape(-1, len(names))
+    return expected.shape == got.shape and ((expected == got) | (np.isnan(expected) & np.isnan(got))).all()
+
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 640
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 480
+    nan_fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    np.random.seed(0)
+    cloud = synthesize(width, height, nan_fraction)
+    xyz = ['x', 'y', 'z']
+    uvs = np.column_stack((np.random.randint(0, width, 1000), np.random.randint(0, height, 1000)))
+
+    print 'Cloud of %d x %d points, %.0f%% NaN' % (width, height, nan_fraction * 100)
+    print
+
+    cases = [('all points', {}),
+             ('x, y, z without NaNs', {'field_names': xyz, 'skip_nans': True}),
+             ('x, y, z at 1000 uvs', {'field_names': xyz, 'uvs': uvs.tolist()})]
+
+    for name, kwargs in cases:
+        generated, gen_time = timed('read_points (%s)' % name, lambda: list(read_points(cloud, **kwargs)))
+        array, np_time = timed('read_points_array (%s)' % name, read_points_array, cloud, **kwargs)
+        names = kwargs.get('field_names', [f.name for f in cloud.fields])
+        print '%-40s %8.1fx, identical: %s' % ('speedup', gen_time / np_time, same(generated, array, names))
+        print
+
+    points = read_points_array(cloud, field_names=xyz, skip_nans=True)
+    point_list = np.column_stack([points[name] for name in xyz]).tolist()
+    fields = KINECT_FIELDS[:3]
+
+    generated, gen_time = timed('create_cloud (points as lists)', create_cloud, None, fields, point_list)
+    array, np_time = timed('create_cloud (points as array)', create_cloud, None, fields, np.array(point_list, dtype=np.float32))
+    print '%-40s %8.1fx, identical: %s' % ('speedup', gen_time / np_time, generated.data == array.data)
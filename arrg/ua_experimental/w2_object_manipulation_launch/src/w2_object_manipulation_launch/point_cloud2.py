@@ -3,15 +3,23 @@
 """
 Serialization of sensor_msgs.PointCloud2 messages.
 
+read_points and create_cloud work point by point. The *_array functions
+view cloud.data as a NumPy record array (one record per point, one named
+field per PointField) without copying it, and filter, gather and pack whole
+clouds at once.
+
 Author: Tim Field
 """
 
 import roslib; roslib.load_manifest('sensor_msgs')
 
+import sys
 import ctypes
 import math
 import struct
 
+import numpy as np
+
 from sensor_msgs.msg import PointCloud2, PointField
 
 _DATATYPES = {}
@@ -24,6 +32,16 @@ _DATATYPES[PointField.UINT32]  = ('I', 4)
 _DATATYPES[PointField.FLOAT32] = ('f', 4)
 _DATATYPES[PointField.FLOAT64] = ('d', 8)
 
+_NUMPY_DATATYPES = {}
+_NUMPY_DATATYPES[PointField.INT8]    = np.dtype('i1')
+_NUMPY_DATATYPES[PointField.UINT8]   = np.dtype('u1')
+_NUMPY_DATATYPES[PointField.INT16]   = np.dtype('i2')
+_NUMPY_DATATYPES[PointField.UINT16]  = np.dtype('u2')
+_NUMPY_DATATYPES[PointField.INT32]   = np.dtype('i4')
+_NUMPY_DATATYPES[PointField.UINT32]  = np.dtype('u4')
+_NUMPY_DATATYPES[PointField.FLOAT32] = np.dtype('f4')
+_NUMPY_DATATYPES[PointField.FLOAT64] = np.dtype('f8')
+
 def read_points(cloud, field_names=None, skip_nans=False, uvs=[]):
     """
     Read points from a L{sensor_msgs.PointCloud2} message.
@@ -90,10 +108,13 @@ def create_cloud(header, fields, points):
     @param points: The point cloud points.
     @type  points: list of iterables, i.e. one iterable for each point, with the
                    elements of each iterable being the values of the fields for 
-                   that point (in the same order as the fields parameter)
+                   that point (in the same order as the fields parameter), or a
+                   numpy array (see L{create_cloud_array})
     @return: The point cloud.
     @rtype:  L{sensor_msgs.msg.PointCloud2}
     """
+    if isinstance(points, np.ndarray):
+        return create_cloud_array(header, fields, points)
 
     cloud_struct = struct.Struct(_get_struct_fmt(False, fields))
 
@@ -147,3 +168,193 @@ def _get_struct_fmt(is_bigendian, fields, field_names=None):
             offset += field.count * datatype_length
 
     return fmt
+
+def fields_to_dtype(fields, point_step, is_bigendian=False, field_names=None):
+    """
+    NumPy record dtype of a point with the given fields, with field offsets
+    and itemsize taken from the cloud so it can view cloud data directly.
+
+    @param fields: The point cloud fields.
+    @type  fields: iterable of L{sensor_msgs.msg.PointField}
+    @param point_step: Size of one point in bytes.
+    @type  point_step: int
+    @param is_bigendian: Byte order of the data.
+    @type  is_bigendian: bool
+    @param field_names: The names of fields to include. If None, include all fields. [default: None]
+    @type  field_names: iterable
+    @return: Record dtype, fields with count > 1 are subarrays.
+    @rtype:  numpy.dtype
+    """
+    byte_order = '>' if is_bigendian else '<'
+    names, formats, offsets = [], [], []
+
+    for field in sorted(fields, key=lambda f: f.offset):
+        if field_names is not None and field.name not in field_names:
+            continue
+        if field.datatype not in _NUMPY_DATATYPES:
+            print >> sys.stderr, 'Skipping unknown PointField datatype [%d]' % field.datatype
+            continue
+
+        dtype = _NUMPY_DATATYPES[field.datatype].newbyteorder(byte_order)
+        names.append(field.name)
+        formats.append(dtype if field.count == 1 else (dtype, (field.count,)))
+        offsets.append(field.offset)
+
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': point_step})
+
+def dtype_to_fields(dtype):
+    """
+    PointFields of a record dtype, the inverse of L{fields_to_dtype}.
+
+    @param dtype: Record dtype with one field per PointField.
+    @type  dtype: numpy.dtype
+    @return: The point cloud fields.
+    @rtype:  list of L{sensor_msgs.msg.PointField}
+    """
+    datatypes = dict((t.str[1:], d) for d, t in _NUMPY_DATATYPES.items())
+    fields = []
+
+    for name in dtype.names:
+        field_dtype, offset = dtype.fields[name][:2]
+        base, shape = field_dtype.base, field_dtype.shape
+        if base.str[1:] not in datatypes:
+            raise ValueError('field %s has type %s, which PointField does not support' % (name, base))
+        fields.append(PointField(name, offset, datatypes[base.str[1:]], int(np.prod(shape)) if shape else 1))
+
+    return fields
+
+def cloud_to_array(cloud, field_names=None):
+    """
+    View the data of a L{sensor_msgs.PointCloud2} message as a record array.
+    Nothing is copied, the array is read-only when cloud.data is a string.
+
+    @param cloud: The point cloud to read from.
+    @type  cloud: L{sensor_msgs.PointCloud2}
+    @param field_names: The names of fields to read. If None, read all fields. [default: None]
+    @type  field_names: iterable
+    @return: height x width record array, element [v,u] is the point at u, v.
+    @rtype:  numpy.ndarray
+    """
+    dtype = fields_to_dtype(cloud.fields, cloud.point_step, cloud.is_bigendian, field_names)
+    return np.ndarray(shape=(cloud.height, cloud.width), dtype=dtype, buffer=cloud.data, strides=(cloud.row_step, cloud.point_step))
+
+def nan_mask(points):
+    """
+    Which points of a record array have no NaN in any of their floating point fields.
+
+    @param points: Record array of points.
+    @type  points: numpy.ndarray
+    @return: Boolean array with the shape of points.
+    @rtype:  numpy.ndarray
+    """
+    valid = np.ones(points.shape, dtype=bool)
+
+    for name in points.dtype.names:
+        values = points[name]
+        if values.dtype.kind != 'f':
+            continue
+        if values.ndim > points.ndim:
+            values = values.reshape(points.shape + (-1,)).max(axis=-1)
+        valid &= ~np.isnan(values)
+
+    return valid
+
+def read_points_array(cloud, field_names=None, skip_nans=False, uvs=None):
+    """
+    Read points from a L{sensor_msgs.PointCloud2} message into a record array,
+    the same points L{read_points} yields, in the same order.
+
+    @param cloud: The point cloud to read from.
+    @type  cloud: L{sensor_msgs.PointCloud2}
+    @param field_names: The names of fields to read. If None, read all fields. [default: None]
+    @type  field_names: iterable
+    @param skip_nans: If True, then don't return any point with a NaN value.
+    @type  skip_nans: bool [default: False]
+    @param uvs: If specified, then only return the points at the given coordinates. [default: None]
+    @type  uvs: iterable of (u, v) pairs or N x 2 array
+    @return: One dimensional record array of points, a view of cloud.data when
+             neither skip_nans nor uvs are given and the rows are not padded.
+    @rtype:  numpy.ndarray
+    """
+    points = cloud_to_array(cloud, field_names)
+
+    if uvs is not None and len(uvs):
+        uvs = np.asarray(uvs, dtype=np.intp).reshape(-1, 2)
+        points = points[uvs[:,1], uvs[:,0]]
+    else:
+        points = points.reshape(-1)
+
+    if skip_nans:
+        points = points[nan_mask(points)]
+
+    return points
+
+def create_cloud_array(header, fields, points):
+    """
+    Create an unorganized L{sensor_msgs.msg.PointCloud2} message from a numpy array.
+
+    @param header: The point cloud header.
+    @type  header: L{std_msgs.msg.Header}
+    @param fields: The point cloud fields.
+    @type  fields: iterable of L{sensor_msgs.msg.PointField}
+    @param points: Record array with (at least) the fields named in fields, or a
+                   N x M array with the values of each point in a row (in the
+                   same order as the fields parameter).
+    @type  points: numpy.ndarray
+    @return: The point cloud.
+    @rtype:  L{sensor_msgs.msg.PointCloud2}
+    """
+    point_step = struct.calcsize(_get_struct_fmt(False, fields))
+    dtype = fields_to_dtype(fields, point_step)
+
+    if points.dtype.names:
+        points = points.reshape(-1)
+        data = np.zeros(len(points), dtype=dtype)
+        for name in dtype.names:
+            data[name] = points[name]
+    else:
+        # the fields decide the number of columns, so an empty array works too
+        counts = [int(np.prod(dtype.fields[name][0].shape)) for name in dtype.names]
+        points = points.reshape(-1, sum(counts))
+        data = np.zeros(len(points), dtype=dtype)
+        column = 0
+        for name, count in zip(dtype.names, counts):
+            values = points[:,column:column+count]
+            data[name] = values.reshape(data[name].shape)
+            column += count
+
+    return PointCloud2(header=header,
+                       height=1,
+                       width=len(data),
+                       is_dense=False,
+                       is_bigendian=False,
+                       fields=fields,
+                       point_step=point_step,
+                       row_step=point_step * len(data),
+                       data=data.tostring())
+
+def array_to_cloud(header, points):
+    """
+    Create a L{sensor_msgs.msg.PointCloud2} message from a record array, fields
+    come from its dtype. A height x width array gives an organized cloud.
+
+    @param header: The point cloud header.
+    @type  header: L{std_msgs.msg.Header}
+    @param points: Record array of points.
+    @type  points: numpy.ndarray
+    @return: The point cloud.
+    @rtype:  L{sensor_msgs.msg.PointCloud2}
+    """
+    points = np.ascontiguousarray(points)
+    height, width = points.shape if points.ndim == 2 else (1, points.size)
+    is_bigendian = any(points.dtype.fields[name][0].base.byteorder == '>' for name in points.dtype.names)
+
+    return PointCloud2(header=header,
+                       height=height,
+                       width=width,
+                       is_dense=bool(nan_mask(points).all()),
+                       is_bigendian=is_bigendian,
+                       fields=dtype_to_fields(points.dtype),
+                       point_step=points.dtype.itemsize,
+                       row_step=points.dtype.itemsize * width,
+                       data=points.tostring())
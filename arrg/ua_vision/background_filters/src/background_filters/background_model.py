@@ -0,0 +1,192 @@
+"""
+Per-pixel Gaussian color model of a static background.
+
+Every pixel is described by the mean and the 3x3 covariance of its color over
+the background samples. All pixels are handled at once as (H x W x 3) and
+(H x W x 3 x 3) arrays. The statistics follow the C++ background_averager
+node: covariances are scaled by the number of samples and have their
+diagonal padded so they can always be inverted, standard deviations come
+from the padded diagonal.
+
+Statistics can be exported to a directory (ideally on a tmpfs such as
+/dev/shm) as one .npy file per array and a JSON header naming them, readers
+memory map the arrays instead of receiving them in a message.
+"""
+
+import os
+import json
+
+import numpy
+
+
+EXPORT_HEADER = 'background_stats.json'
+
+# arrays of BackgroundModel.statistics() in order
+STATISTICS = ('average_background', 'covariance_matrix', 'covariance_matrix_inv',
+              'covariance_matrix_dets', 'standard_deviations')
+
+
+def batch_moments(samples):
+    """Mean (H x W x C) and scaled covariance (H x W x C x C) of N x H x W x C samples."""
+    samples = numpy.asarray(samples, dtype=numpy.float64)
+    mean = samples.mean(axis=0)
+    centered = samples - mean
+    cov = numpy.einsum('nhwi,nhwj->hwij', centered, centered) / samples.shape[0]
+    return mean, cov
+
+
+def padded_stats(cov, padding):
+    """
+    Covariances with padding added to the diagonal, their inverses,
+    determinants and the standard deviations of every channel.
+    """
+    channels = cov.shape[-1]
+    cov = cov + padding * numpy.eye(channels)
+
+    cov_inv = numpy.linalg.inv(cov)
+    dets = numpy.linalg.det(cov)
+    std_devs = numpy.sqrt(numpy.diagonal(cov, axis1=-2, axis2=-1))
+
+    return cov, cov_inv, dets, std_devs
+
+
+def tile(stats, step=1, x=0, y=0, width=0, height=0):
+    """
+    Views of the per-pixel arrays in stats restricted to a width x height
+    tile at (x, y), every step-th pixel in both directions. A width or
+    height of 0 extends the tile to the image border.
+    """
+    step = max(step, 1)
+    rows = slice(y, y + height if height else None, step)
+    cols = slice(x, x + width if width else None, step)
+    return tuple(a[rows, cols] for a in stats)
+
+
+def export_statistics(path, version, colorspace, stats):
+    """
+    Writes stats to path as <name>-<version>.npy files, then replaces the
+    header, then removes the files of older versions. A reader that opened
+    the previous header can still map its arrays on Linux, they go away
+    when the last map is closed.
+    """
+    if not os.path.exists(path): os.makedirs(path)
+
+    arrays = {}
+
+    for name, values in zip(STATISTICS, stats):
+        file_name = '%s-%d.npy' % (name, version)
+        numpy.save(os.path.join(path, file_name), numpy.ascontiguousarray(values))
+        arrays[name] = {'file': file_name, 'dtype': values.dtype.str, 'shape': list(values.shape)}
+
+    header = {'version': version, 'colorspace': colorspace, 'arrays': arrays}
+    header_file = os.path.join(path, EXPORT_HEADER)
+
+    f = open(header_file + '.tmp', 'w')
+    json.dump(header, f, indent=4, sort_keys=True)
+    f.close()
+    os.rename(header_file + '.tmp', header_file)
+
+    current = set(a['file'] for a in arrays.values())
+
+    for file_name in os.listdir(path):
+        if file_name.endswith('.npy') and file_name not in current:
+            os.remove(os.path.join(path, file_name))
+
+    return header_file
+
+
+def load_exported(header_file):
+    """Version, colorspace and read-only memory maps of exported statistics."""
+    f = open(header_file)
+    header = json.load(f)
+    f.close()
+
+    path = os.path.dirname(header_file)
+    stats = tuple(numpy.load(os.path.join(path, header['arrays'][name]['file']), mmap_mode='r') for name in STATISTICS)
+
+    return header['version'], header['colorspace'], stats
+
+
+class BackgroundModel:
+    """
+    Background statistics collected either from a fixed set of frames
+    (fit) or frame by frame with Welford's update (update). With a window,
+    the running model weighs the newest frame by 1/window once it has seen
+    that many frames, so it keeps following slow changes in the scene.
+    version goes up every time the statistics change, it is never 0.
+    """
+
+    def __init__(self, padding=1.0, window=0):
+        self.padding = padding
+        self.window = window
+        self.version = 0
+        self.reset()
+
+    def reset(self):
+        self.version += 1
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.stats = None
+
+    def fit(self, samples):
+        """Replaces the model with the statistics of N x H x W x C samples."""
+        samples = numpy.asarray(samples)
+        self.mean, cov = batch_moments(samples)
+        self.count = samples.shape[0]
+        self.m2 = cov * self.count
+        self.stats = None
+        self.version += 1
+
+    def update(self, frame):
+        """Adds one H x W x C frame to the running statistics."""
+        frame = numpy.asarray(frame, dtype=numpy.float64)
+
+        if self.mean is None or self.mean.shape != frame.shape:
+            self.reset()
+            self.mean = numpy.zeros(frame.shape)
+            self.m2 = numpy.zeros(frame.shape + frame.shape[-1:])
+
+        self.count += 1
+
+        if self.window and self.count > self.window:
+            # exponentially weighted from here on, m2 stays scaled to window
+            weight = 1.0 / self.window
+            delta = frame - self.mean
+            self.mean += weight * delta
+            self.m2 *= (1.0 - weight)
+            self.m2 += (1.0 - weight) * delta[..., :, numpy.newaxis] * delta[..., numpy.newaxis, :]
+        else:
+            delta = frame - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta[..., :, numpy.newaxis] * (frame - self.mean)[..., numpy.newaxis, :]
+
+        self.stats = None
+        self.version += 1
+
+    @property
+    def samples(self):
+        """Number of frames the statistics are scaled to."""
+        return min(self.count, self.window) if self.window else self.count
+
+    def covariance(self):
+        return self.m2 / max(self.samples, 1)
+
+    def statistics(self):
+        """
+        Mean as an 8-bit image, padded covariances, their inverses,
+        determinants and standard deviations as float32 arrays. Computed once
+        per model state.
+        """
+        if self.mean is None: raise ValueError('background model has no samples')
+
+        if self.stats is None:
+            cov, cov_inv, dets, std_devs = padded_stats(self.covariance(), self.padding)
+            avg_img = numpy.clip(numpy.round(self.mean), 0, 255).astype(numpy.uint8)
+            self.stats = (avg_img,
+                          cov.astype(numpy.float32),
+                          cov_inv.astype(numpy.float32),
+                          dets.astype(numpy.float32),
+                          std_devs.astype(numpy.float32))
+
+        return self.stats
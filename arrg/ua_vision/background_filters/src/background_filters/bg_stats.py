@@ -8,92 +8,137 @@ import cv_bridge
 
 from sensor_msgs.msg import Image
 from background_filters.srv import GetBgStats
+from background_filters.srv import GetBgStatsResponse
+from background_filters.srv import GetBgStatsCompact
+from background_filters.srv import GetBgStatsCompactResponse
+from background_filters.background_model import BackgroundModel
+from background_filters.background_model import tile
+from background_filters.background_model import export_statistics
 
 import numpy
-import math
+import threading
 
 class BackgroundAverager:
     def __init__(self):
         rospy.init_node('background_averager', anonymous=True)
-        rospy.Subscriber('image', Image, self.handle_image)
-        rospy.Service('get_background_stats', GetBgStats, self.get_bg_stats)
         self.bg_num = rospy.get_param('~bg_num', 10)
 
+        # 'batch' computes the model once from the first bg_num frames,
+        # 'running' keeps updating it with every frame
+        self.mode = rospy.get_param('~mode', 'batch')
+
+        # running mode follows the last window frames, 0 averages all of them
+        window = rospy.get_param('~window', 0)
+        padding = rospy.get_param('~diagonal_padding', 1.0)
+
+        # where get_background_stats_compact exports the statistics for
+        # clients that memory map them
+        self.export_path = rospy.get_param('~export_path', '/dev/shm/background_stats')
+
+        if self.mode not in ('batch', 'running'):
+            rospy.logwarn('Unknown mode %s, using batch' % self.mode)
+            self.mode = 'batch'
+
         self.bridge = cv_bridge.CvBridge()
-        #self.win1 = cv.NamedWindow('win1')
-        #self.win2 = cv.NamedWindow('win2')
-        self.counter = 0
-        self.have_ave_bg = False
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()
+        self.model = BackgroundModel(padding, window)
         self.numpy_bgs = []
-        self.covariances = []
-        self.averages = []
-        self.determinants = []
-        self.std_devs = []
+        self.have_ave_bg = False
+        self.exported = (None, None)    # version and header file of the last export
+
+        rospy.Subscriber('image', Image, self.handle_image)
+        rospy.Service('get_background_stats', GetBgStats, self.get_bg_stats)
+        rospy.Service('get_background_stats_compact', GetBgStatsCompact, self.get_bg_stats_compact)
 
     def handle_image(self, msg):
-        if self.counter < self.bg_num:
-            cv_image = self.bridge.imgmsg_to_cv(msg, "bgr8")
-            self.numpy_bgs.append(numpy.asarray(cv_image))
-            self.counter += 1
+        if self.mode == 'batch' and self.have_ave_bg:
             return
 
-        if not self.have_ave_bg:
+        cv_image = self.bridge.imgmsg_to_cv(msg, "bgr8")
+        frame = numpy.asarray(cv_image)
+
+        if self.mode == 'running':
+            with self.lock:
+                self.model.update(frame)
+
+            if not self.have_ave_bg and self.model.count >= self.bg_num:
+                self.have_ave_bg = True
+                rospy.loginfo('Running background model has %d samples' % self.model.count)
+
+            return
+
+        self.numpy_bgs.append(frame)
+        if len(self.numpy_bgs) < self.bg_num:
+            return
+
+        rospy.loginfo('Collected samples for background image averaging')
+        height, width, n_channels = frame.shape
+        rospy.loginfo('height = %d, width = %d, n_channels = %d' % (height, width, n_channels))
+
+        with self.lock:
+            self.model.fit(self.numpy_bgs)
+            self.numpy_bgs = []
             self.have_ave_bg = True
-            rospy.loginfo('Collected samples for background image averaging')
-
-            height = self.numpy_bgs[0].shape[0]
-            width = self.numpy_bgs[0].shape[1]
-            n_channels = self.numpy_bgs[0].shape[2]
-            depth = cv.IPL_DEPTH_8U
-            size = self.numpy_bgs[0].size
-            rospy.loginfo('height = %d, width = %d, n_channels = %d, depth = %d, size = %d' % (height, width, n_channels, depth, size))
-
-            cov_mat = cv.CreateMat(3, 3, cv.CV_32FC1)
-            ave_arr = cv.CreateMat(1, 3, cv.CV_32FC1)
-
-            # for each pixel in the image
-            for i in xrange(0, size, 3):
-                vects = []
-                # for each image that we sampled
-                for img in self.numpy_bgs:
-                    mat = cv.CreateMatHeader(1, 3, cv.CV_8UC1)
-                    cv.SetData(mat, img.take([i, i+1, i+2]), 3)
-                    vects.append(mat)
-                cv.CalcCovarMatrix(vects, cov_mat, ave_arr, cv.CV_COVAR_NORMAL)
-                self.determinants.append(cv.Det(cov_mat))
-                self.covariances.extend(numpy.asarray(cov_mat, dtype=numpy.uint8).ravel())
-                ave_np = numpy.asarray(ave_arr, dtype=numpy.uint8).ravel()
-                self.averages.extend(ave_np)
-                sdb = sdg = sdr = 0.0
-                for img in self.numpy_bgs:
-                    (b, g, r) = img.take([i, i+1, i+2])
-                    sdb += pow(b - ave_np[0], 2.0)
-                    sdg += pow(g - ave_np[1], 2.0)
-                    sdr += pow(r - ave_np[2], 2.0)
-                self.std_devs.append(math.sqrt(sdb / (self.bg_num - 1.0)))
-                self.std_devs.append(math.sqrt(sdg / (self.bg_num - 1.0)))
-                self.std_devs.append(math.sqrt(sdr / (self.bg_num - 1.0)))
-
-            ave_numpy = numpy.array(self.averages, dtype=numpy.uint8)
-            self.ave_img = cv.CreateImageHeader((width, height), cv.IPL_DEPTH_8U, 3)
-            cv.SetData(self.ave_img, ave_numpy, width * 3)
-
-            #cv.ShowImage('win1', self.ave_img)
-            #cv.ShowImage('win1', self.numpy_bgs[0])
-            #cv.ShowImage('win2', cv.fromarray(self.numpy_bgs[0]))
-            #cv.WaitKey(1000)
-
-            rospy.loginfo('Computed average background image from samples')
+
+        rospy.loginfo('Computed average background image from samples')
 
     def get_bg_stats(self, req):
-        res = GetBgStats()
-        res.average_background = self.bridge.cv_toimgmsg(self.ave_img)
-        res.covariance_matrix = self.covariances
-        res.covariance_matrix_dets = self.determinants
-        res.standard_deviations = self.std_devs
+        if not self.have_ave_bg:
+            raise rospy.ServiceException('background model has %d of %d samples' % (self.model.count or len(self.numpy_bgs), self.bg_num))
+
+        with self.lock:
+            ave_img, cov, cov_inv, dets, std_devs = self.model.statistics()
+
+        res = GetBgStatsResponse()
+        res.colorspace = 'rgb'
+        res.average_background = self.bridge.cv_to_imgmsg(cv.fromarray(ave_img), 'bgr8')
+        res.covariance_matrix = cov.ravel().tolist()
+        res.covariance_matrix_inv = cov_inv.ravel().tolist()
+        res.covariance_matrix_dets = dets.ravel().tolist()
+        res.standard_deviations = std_devs.ravel().tolist()
+        return res
+
+    def get_bg_stats_compact(self, req):
+        """
+        Statistics as raw little endian float32 buffers, optionally only a
+        downsampled tile of them, or exported to shared memory. Nothing is
+        sent if the client already has the current version.
+        """
+        if not self.have_ave_bg:
+            raise rospy.ServiceException('background model has %d of %d samples' % (self.model.count or len(self.numpy_bgs), self.bg_num))
+
+        with self.lock:
+            version = self.model.version
+            stats = self.model.statistics()
+
+        res = GetBgStatsCompactResponse()
+        res.version = version
+        res.changed = version != req.known_version
+        if not res.changed: return res
+
+        res.colorspace = 'rgb'
+
+        if req.shared_memory:
+            # the whole image is exported, clients slice the maps themselves
+            with self.export_lock:
+                if self.exported[0] != version:
+                    self.exported = (version, export_statistics(self.export_path, version, res.colorspace, stats))
+                res.shared_file = self.exported[1]
+            res.height, res.width, res.channels = stats[0].shape
+            return res
+
+        roi = req.roi
+        ave_img, cov, cov_inv, dets, std_devs = tile(stats, req.step, roi.x_offset, roi.y_offset, roi.width, roi.height)
+        res.height, res.width, res.channels = ave_img.shape
+
+        res.average_background = self.bridge.cv_to_imgmsg(cv.fromarray(numpy.ascontiguousarray(ave_img)), 'bgr8')
+        res.covariance_matrix = numpy.ascontiguousarray(cov, dtype='<f4').tostring()
+        res.covariance_matrix_inv = numpy.ascontiguousarray(cov_inv, dtype='<f4').tostring()
+        res.covariance_matrix_dets = numpy.ascontiguousarray(dets, dtype='<f4').tostring()
+        res.standard_deviations = numpy.ascontiguousarray(std_devs, dtype='<f4').tostring()
         return res
 
 if __name__ == '__main__':
     b = BackgroundAverager()
     rospy.spin()
-
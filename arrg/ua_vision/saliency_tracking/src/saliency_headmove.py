@@ -39,48 +39,111 @@ roslib.load_manifest('saliency_tracking')
 
 import rospy
 import math
+from threading import Lock
+from threading import Thread
 from geometry_msgs.msg import Point
+from geometry_msgs.msg import PointStamped
 from pr2_controllers_msgs.msg import JointControllerState
 from std_msgs.msg import Float64
 
+from saliency_tracking.head_tracking import CameraModel
+from saliency_tracking.head_tracking import HeadTracker
+
 class TrackSaliencyPOI():
     def __init__(self):
-        self.hfov = 49.2
-        self.vfov = 36.0
-        self.center = Point(320, 240, 0)
-        self.deg_pan_ratio = self.hfov / 640.0       # how many degrees in a pixel in x plane
-        self.deg_tilt_ratio = self.vfov / 480.0      # how many degrees in a pixel in y plane
-        self.pan_deg_ratio = 640.0 / self.hfov       # how many pixels in a degree in x plane
-        self.tilt_deg_ratio = 480.0 / self.vfov      # how many pixels in a degree in y plane
-        
         rospy.init_node('saliency_track_poi', anonymous=False)
-        self.saliency_poi_sub = rospy.Subscriber('saliency_poi', Point, self.do_track_poi)
-        self.move_head_pan_pub = rospy.Publisher('head_pan_controller/command', Float64)
-        self.move_head_tilt_pub = rospy.Publisher('head_tilt_controller/command', Float64)
-        self.joint_state_sub = rospy.Subscriber('head_pan_controller/state', JointControllerState, self.process_current_pan_state)
-        self.joint_state_sub = rospy.Subscriber('head_tilt_controller/state', JointControllerState, self.process_current_tilt_state)
         
+        self.camera = CameraModel(rospy.get_param('~hfov', 49.2),
+                                  rospy.get_param('~vfov', 36.0),
+                                  rospy.get_param('~image_width', 640),
+                                  rospy.get_param('~image_height', 480))
+                                  
+        # 'direct' commands the head on every point of interest,
+        # 'predictive' filters the points and commands at control_rate
+        self.mode = rospy.get_param('~tracking_mode', 'predictive')
+        self.control_rate = rospy.get_param('~control_rate', 10.0)
+        
+        # predictive mode uses saliency_poi_stamped, stamped with the capture
+        # time of the image, unless told otherwise. The image of a point on
+        # saliency_poi is assumed to have been captured poi_latency seconds
+        # before the point arrived
+        self.use_stamped_poi = rospy.get_param('~use_stamped_poi', True)
+        self.poi_latency = rospy.get_param('~poi_latency', 0.1)
+        
+        self.tracker = HeadTracker(self.camera,
+                                   deadband=rospy.get_param('~deadband', 1.0),
+                                   lookahead=rospy.get_param('~lookahead', 0.05),
+                                   max_prediction=rospy.get_param('~max_prediction', 0.5),
+                                   process_noise=rospy.get_param('~process_noise', 400.0),
+                                   measurement_noise=rospy.get_param('~measurement_noise', 1.0))
+        self.tracker_lock = Lock()
+        
+        if self.mode not in ('direct', 'predictive'):
+            rospy.logwarn('Unknown tracking mode %s, using predictive' % self.mode)
+            self.mode = 'predictive'
+            
         self.current_pan_angle = 0
         self.current_tilt_angle = 0
         self.current_pan_moving = False
         self.current_tilt_moving = False
+        
+        self.move_head_pan_pub = rospy.Publisher('head_pan_controller/command', Float64)
+        self.move_head_tilt_pub = rospy.Publisher('head_tilt_controller/command', Float64)
+        self.joint_state_sub = rospy.Subscriber('head_pan_controller/state', JointControllerState, self.process_current_pan_state)
+        self.joint_state_sub = rospy.Subscriber('head_tilt_controller/state', JointControllerState, self.process_current_tilt_state)
+        
+        if self.mode == 'direct':
+            self.saliency_poi_sub = rospy.Subscriber('saliency_poi', Point, self.do_track_poi)
+        elif self.use_stamped_poi:
+            self.saliency_poi_sub = rospy.Subscriber('saliency_poi_stamped', PointStamped, self.add_stamped_poi)
+            Thread(target=self.control_loop).start()
+        else:
+            self.saliency_poi_sub = rospy.Subscriber('saliency_poi', Point, self.add_poi)
+            Thread(target=self.control_loop).start()
+
+    def state_stamp(self, state):
+        # controllers that don't stamp their state get the arrival time
+        stamp = state.header.stamp.to_sec()
+        return stamp if stamp > 0 else rospy.get_time()
 
     def process_current_pan_state(self, new_state):
         self.current_pan_angle = math.degrees(new_state.process_value)
+        
+        with self.tracker_lock:
+            self.tracker.pan.add(self.state_stamp(new_state), self.current_pan_angle)
 
     def process_current_tilt_state(self, new_state):
         self.current_tilt_angle = math.degrees(new_state.process_value)
+        
+        with self.tracker_lock:
+            self.tracker.tilt.add(self.state_stamp(new_state), self.current_tilt_angle)
 
     def do_track_poi(self, point):
-        x = point.x
-        y = point.y
-        x_dist = -x + self.center.x
-        y_dist = -y + self.center.y
-        x_dist_ang = x_dist * self.deg_pan_ratio
-        y_dist_ang = y_dist * self.deg_tilt_ratio
+        x_dist_ang, y_dist_ang = self.camera.offset(point.x, point.y)
 
         self.move_head_pan_pub.publish(math.radians(self.current_pan_angle + x_dist_ang))
         self.move_head_tilt_pub.publish(math.radians(self.current_tilt_angle + y_dist_ang))
+
+    def add_poi(self, point):
+        with self.tracker_lock:
+            self.tracker.add_point(point.x, point.y, rospy.get_time() - self.poi_latency)
+
+    def add_stamped_poi(self, poi):
+        with self.tracker_lock:
+            self.tracker.add_point(poi.point.x, poi.point.y, poi.header.stamp.to_sec())
+
+    def control_loop(self):
+        r = rospy.Rate(self.control_rate)
+        
+        while not rospy.is_shutdown():
+            with self.tracker_lock:
+                command = self.tracker.command(rospy.get_time())
+                
+            if command is not None:
+                self.move_head_pan_pub.publish(math.radians(command[0]))
+                self.move_head_tilt_pub.publish(math.radians(command[1]))
+                
+            r.sleep()
         
 if __name__ == '__main__':
     try:
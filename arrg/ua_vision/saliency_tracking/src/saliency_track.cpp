@@ -48,6 +48,7 @@
 
 #include <sensor_msgs/Image.h>
 #include <geometry_msgs/Point.h>
+#include <geometry_msgs/PointStamped.h>
 
 #include <driver_base/SensorLevels.h>
 #include <dynamic_reconfigure/server.h>
@@ -65,6 +66,7 @@ class SaliencyTracker
 private:
     image_transport::Subscriber sub;
     ros::Publisher saliency_poi_pub;
+    ros::Publisher saliency_poi_stamped_pub;
     ros::Publisher saliency_img_pub;
 
     /** dynamic parameter configuration */
@@ -106,6 +108,7 @@ public:
         sub = it.subscribe(topic, 1, &SaliencyTracker::image_cb, this, transport);
 
         saliency_poi_pub = nh.advertise<geometry_msgs::Point>("saliency_poi", 1);
+        saliency_poi_stamped_pub = nh.advertise<geometry_msgs::PointStamped>("saliency_poi_stamped", 1);
         saliency_img_pub = nh.advertise<sensor_msgs::Image>("saliency_img", 1);
     }
 
@@ -233,7 +236,14 @@ public:
 	    sensor_msgs::Image::Ptr saliency_msg = bridge_.cvToImgMsg(&out_msg, "passthrough");
             saliency_msg->header.stamp = msg->header.stamp;
 
+            // same point stamped with the capture time of the image, lets
+            // head trackers compensate for the processing delay
+            geometry_msgs::PointStamped poi_stamped;
+            poi_stamped.header = msg->header;
+            poi_stamped.point = poi;
+
             saliency_poi_pub.publish(poi);
+            saliency_poi_stamped_pub.publish(poi_stamped);
             saliency_img_pub.publish(saliency_msg);
 
             if (current_config.display_img)
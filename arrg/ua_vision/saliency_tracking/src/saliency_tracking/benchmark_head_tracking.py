@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Arizona Robotics Research Group,
+# University of Arizona. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+
+
+"""
+Replays the same saliency point stream through the direct controller (a
+command for every point, relative to the last joint state) and through
+HeadTracker, with a simulated pan/tilt head closing the loop, and reports
+the command rate, the settling time after every jump of the target and the
+tracking error while the target moves smoothly. HeadTracker is run twice,
+with points from saliency_poi (capture time guessed from a fixed latency)
+and from saliency_poi_stamped (capture time known).
+
+usage: benchmark_head_tracking.py [-s seed] [-r control_rate] [-d deadband]
+
+The stream mimics saliency_track: 30 frames/sec, points delivered 80-120 ms
+after the frame was captured, often several at once, with a few pixels of
+noise. The head moves at most 90 deg/sec toward its last command and
+reports its state at 20 Hz.
+"""
+
+import sys
+import getopt
+import random
+from math import sin, pi
+
+import numpy as np
+
+from head_tracking import CameraModel
+from head_tracking import HeadTracker
+
+
+TICK = 0.001
+DURATION = 12.0
+FRAME_PERIOD = 1.0 / 30
+STATE_PERIOD = 1.0 / 20
+HEAD_SPEED = 90.0
+SETTLED = 2.0       # degrees from the target that count as on target
+
+# the target jumps at these times and moves smoothly after the last one
+JUMPS = [(1.0, (15.0, -8.0)), (4.0, (-10.0, 5.0)), (7.0, (0.0, 0.0))]
+SMOOTH_START = 9.0
+
+
+def target_at(t):
+    if t >= SMOOTH_START:
+        s = t - SMOOTH_START
+        return (10.0 * sin(2 * pi * 0.25 * s), 5.0 * sin(2 * pi * 0.25 * s))
+
+    position = (0.0, 0.0)
+    for start, jump_position in JUMPS:
+        if t >= start: position = jump_position
+    return position
+
+
+def saliency_stream(seed):
+    """Arrival and capture time of every point, in the order they arrive."""
+    rng = random.Random(seed)
+    capture = 0.0
+    pending = []
+
+    while capture < DURATION:
+        pending.append(capture)
+        capture += FRAME_PERIOD
+
+        # the saliency node hands over its results in bursts
+        if rng.random() < 0.5 and capture < DURATION: continue
+
+        arrival = capture + rng.uniform(0.08, 0.12)
+
+        for stamp in pending:
+            yield arrival, stamp
+        pending = []
+
+
+class SimulatedHead():
+    def __init__(self):
+        self.position = np.zeros(2)
+        self.goal = np.zeros(2)
+
+    def step(self, dt):
+        move = np.clip(self.goal - self.position, -HEAD_SPEED * dt, HEAD_SPEED * dt)
+        self.position += move
+
+
+def run(controller, camera, seed, control_rate, deadband):
+    rng = random.Random(seed + 1)
+    head = SimulatedHead()
+    history = []        # (t, head position) every tick
+    commands = 0
+    tracker = HeadTracker(camera, deadband=deadband)
+    last_state = np.zeros(2)
+    next_state = 0.0
+    next_control = 0.0
+
+    def head_at(t):
+        i = min(max(int(round(t / TICK)), 0), len(history) - 1)
+        return history[i][1]
+
+    points = list(saliency_stream(seed))
+    points.reverse()
+
+    t = 0.0
+    while t < DURATION:
+        head.step(TICK)
+        history.append((t, head.position.copy()))
+
+        if t >= next_state:
+            last_state = head.position.copy()
+            tracker.pan.add(t, last_state[0])
+            tracker.tilt.add(t, last_state[1])
+            next_state += STATE_PERIOD
+
+        while points and points[-1][0] <= t:
+            arrival, capture = points.pop()
+            target = np.array(target_at(capture))
+            pixel = np.array([camera.center_x, camera.center_y]) - \
+                    (target - head_at(capture)) / [camera.deg_pan_ratio, camera.deg_tilt_ratio]
+            x = min(max(pixel[0] + rng.gauss(0, 3), 0), 2 * camera.center_x)
+            y = min(max(pixel[1] + rng.gauss(0, 3), 0), 2 * camera.center_y)
+
+            if controller == 'direct':
+                head.goal = last_state + camera.offset(x, y)
+                commands += 1
+            elif controller == 'unstamped':
+                # the node only knows the arrival time, it assumes a fixed latency
+                tracker.add_point(x, y, arrival - 0.1)
+            else:
+                tracker.add_point(x, y, capture)
+
+        if controller != 'direct' and t >= next_control:
+            command = tracker.command(t)
+            if command is not None:
+                head.goal = np.array(command)
+                commands += 1
+            next_control += 1.0 / control_rate
+
+        t += TICK
+
+    return history, commands
+
+
+def settling_times(history):
+    """Time after every jump until the head stays within SETTLED of the target."""
+    ends = [start for start, _ in JUMPS[1:]] + [SMOOTH_START]
+    result = []
+
+    for (start, target), end in zip(JUMPS, ends):
+        settled = None
+
+        for t, position in history:
+            if t < start or t >= end: continue
+            on_target = np.abs(position - target).max() <= SETTLED
+            if on_target and settled is None: settled = t
+            if not on_target: settled = None
+
+        result.append(settled - start if settled is not None else float('inf'))
+
+    return result
+
+
+def tracking_error(history):
+    errors = [np.abs(position - target_at(t)).max() for t, position in history if t >= SMOOTH_START + 1.0]
+    return np.sqrt(np.mean(np.square(errors)))
+
+
+if __name__ == '__main__':
+    seed = 0
+    control_rate = 10.0
+    deadband = 1.0
+
+    opts, args = getopt.getopt(sys.argv[1:], 's:r:d:')
+    for opt, value in opts:
+        if opt == '-s': seed = int(value)
+        elif opt == '-r': control_rate = float(value)
+        elif opt == '-d': deadband = float(value)
+
+    camera = CameraModel()
+
+    print '%-12s %12s %28s %16s' % ('controller', 'commands/s', 'settling time per jump (s)', 'rms error (deg)')
+
+    for controller in ('direct', 'unstamped', 'stamped'):
+        history, commands = run(controller, camera, seed, control_rate, deadband)
+        settling = ' '.join(['%6.2f' % s for s in settling_times(history)])
+        print '%-12s %12.1f %28s %16.2f' % (controller, commands / DURATION, settling, tracking_error(history))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Arizona Robotics Research Group,
+# University of Arizona. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of University of Arizona nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Antons Rebguns
+
+"""
+Predictive head tracking of a point of interest in the camera image.
+
+The point is turned into an absolute pan/tilt target using the head angles at
+the time the image was captured (interpolated from the joint state history),
+so a head that has moved since then doesn't make the target jump. A constant
+velocity Kalman filter smooths the targets and predicts where the point will
+be when the next command takes effect. Commands go out at a fixed rate and
+only when the prediction moved out of a deadband around the last command.
+
+All angles are in degrees, times in seconds.
+"""
+
+import bisect
+
+import numpy as np
+
+
+class CameraModel():
+    """ Degrees of pan and tilt per pixel of a width x height image. """
+
+    def __init__(self, hfov=49.2, vfov=36.0, width=640, height=480):
+        self.center_x = width / 2.0
+        self.center_y = height / 2.0
+        self.deg_pan_ratio = hfov / float(width)      # how many degrees in a pixel in x plane
+        self.deg_tilt_ratio = vfov / float(height)    # how many degrees in a pixel in y plane
+
+    def offset(self, x, y):
+        """Pan and tilt from the image center to pixel (x, y)."""
+        return ((self.center_x - x) * self.deg_pan_ratio,
+                (self.center_y - y) * self.deg_tilt_ratio)
+
+
+class JointHistory():
+    """ Recent (stamp, angle) samples of one joint, interpolated by time. """
+
+    def __init__(self, max_age=2.0):
+        self.max_age = max_age
+        self.stamps = []
+        self.angles = []
+
+    def add(self, stamp, angle):
+        if self.stamps and stamp < self.stamps[-1]: return
+
+        self.stamps.append(stamp)
+        self.angles.append(angle)
+
+        # drop old samples in bulk rather than one at a time
+        if stamp - self.stamps[0] > 2 * self.max_age:
+            start = bisect.bisect_left(self.stamps, stamp - self.max_age)
+            del self.stamps[:start]
+            del self.angles[:start]
+
+    def latest(self):
+        return self.angles[-1] if self.angles else 0.0
+
+    def at(self, stamp):
+        """Angle at stamp, clamped to the oldest and newest samples."""
+        if not self.stamps: return 0.0
+
+        i = bisect.bisect_left(self.stamps, stamp)
+        if i == 0: return self.angles[0]
+        if i == len(self.stamps): return self.angles[-1]
+
+        t0, t1 = self.stamps[i-1], self.stamps[i]
+        a0, a1 = self.angles[i-1], self.angles[i]
+        return a0 + (a1 - a0) * (stamp - t0) / (t1 - t0)
+
+
+class ConstantVelocityFilter():
+    """
+    Kalman filter of a 2D position (pan, tilt) moving at constant velocity,
+    state is [pan, tilt, pan velocity, tilt velocity]. process_noise is the
+    spectral density of the (white) acceleration, measurement_noise the
+    standard deviation of a measured position.
+    """
+
+    def __init__(self, process_noise=400.0, measurement_noise=1.0, initial_velocity_std=30.0):
+        self.q = process_noise
+        self.r = measurement_noise ** 2
+        self.initial_velocity_var = initial_velocity_std ** 2
+        self.x = None
+        self.P = None
+        self.stamp = None
+
+    def transition(self, dt):
+        F = np.eye(4)
+        F[0,2] = F[1,3] = dt
+
+        # white noise acceleration integrated over dt
+        Q = np.zeros((4, 4))
+        Q[0,0] = Q[1,1] = self.q * dt**3 / 3.0
+        Q[0,2] = Q[2,0] = Q[1,3] = Q[3,1] = self.q * dt**2 / 2.0
+        Q[2,2] = Q[3,3] = self.q * dt
+
+        return F, Q
+
+    def update(self, z, stamp):
+        z = np.asarray(z, dtype=float)
+
+        if self.x is None:
+            self.x = np.array([z[0], z[1], 0.0, 0.0])
+            self.P = np.diag([self.r, self.r, self.initial_velocity_var, self.initial_velocity_var])
+            self.stamp = stamp
+            return
+
+        # measurements that arrive out of order are fused at the current time
+        dt = max(stamp - self.stamp, 0.0)
+        F, Q = self.transition(dt)
+        x = np.dot(F, self.x)
+        P = np.dot(np.dot(F, self.P), F.T) + Q
+
+        # H = [I 0], so the innovation covariance is the position block of P
+        S = P[:2,:2] + self.r * np.eye(2)
+        K = np.dot(P[:,:2], np.linalg.inv(S))
+        self.x = x + np.dot(K, z - x[:2])
+        self.P = P - np.dot(K, P[:2,:])
+        self.stamp = max(stamp, self.stamp)
+
+    def predict(self, stamp):
+        """Predicted position at stamp, the filter itself is not changed."""
+        dt = max(stamp - self.stamp, 0.0)
+        return self.x[:2] + dt * self.x[2:]
+
+
+class HeadTracker():
+    """
+    Turns points of interest into rate limited pan/tilt commands.
+
+    lookahead is how far past the command time the target is predicted (the
+    time the head needs to start moving), targets are only extrapolated for
+    max_prediction seconds after the last point, then commands stop.
+    """
+
+    def __init__(self, camera, deadband=1.0, lookahead=0.05, max_prediction=0.5,
+                 process_noise=400.0, measurement_noise=1.0):
+        self.camera = camera
+        self.deadband = deadband
+        self.lookahead = lookahead
+        self.max_prediction = max_prediction
+        self.pan = JointHistory()
+        self.tilt = JointHistory()
+        self.filter = ConstantVelocityFilter(process_noise, measurement_noise)
+        self.last_point = None
+        self.last_command = None
+
+    def add_point(self, x, y, capture_stamp):
+        """A point of interest in the image captured at capture_stamp."""
+        pan_offset, tilt_offset = self.camera.offset(x, y)
+        target = (self.pan.at(capture_stamp) + pan_offset, self.tilt.at(capture_stamp) + tilt_offset)
+
+        self.filter.update(target, capture_stamp)
+        self.last_point = capture_stamp if self.last_point is None else max(self.last_point, capture_stamp)
+
+    def command(self, stamp):
+        """
+        Pan and tilt to command at stamp, or None if the head should stay
+        where the last command sent it.
+        """
+        if self.last_point is None or stamp - self.last_point > self.max_prediction:
+            return None
+
+        target = self.filter.predict(stamp + self.lookahead)
+
+        if self.last_command is not None and np.abs(target - self.last_command).max() <= self.deadband:
+            return None
+
+        self.last_command = target
+        return target[0], target[1]
@@ -94,24 +94,155 @@ class GazeboDescriptionParser():
     def get_object(self, name):
         return self.gazebo_world.get(name, None)
 
+# Gazebo body names of environment pieces and objects, e.g. obj_box_1_red_body
+BODY_REGEX = re.compile('(env|obj)_(.*?)_(.*?)_(.*?)_body')
+
+# everything about a body that changes from message to message
+DYNAMIC_TEMPLATE = ' xpos %s ypos %s zpos %s' \
+                   ' xori %s yori %s zori %s wori %s' \
+                   ' xlin %s ylin %s zlin %s' \
+                   ' xang %s yang %s zang %s' \
+                   ' xtrq %s ytrq %s ztrq %s'
+
+class IcarusStateSerializer():
+    """
+    Formats Gazebo world states as Icarus states. The parts of a body's entry
+    that don't change (kind, type, color, role, size) are worked out once per
+    body name and kept, only the pose, twist and torque are formatted for
+    every message.
+    """
+    def __init__(self, gazebo_world):
+        self.gazebo_world = gazebo_world
+        self.static_parts = {}
+        
+    def body_parts(self, name):
+        """Text before and after the dynamic fields of name's entry, None if it isn't published."""
+        if name in self.static_parts:
+            return self.static_parts[name]
+            
+        obj = self.gazebo_world.get_object(name.strip())
+        
+        # Only publish recognizable objects from the world & robot desscriptions
+        if obj is None:
+            self.static_parts[name] = None
+            return None
+            
+        match = re.search(BODY_REGEX, name)
+        
+        if match:
+            if match.group(1) == 'env':
+                prefix = ' \'(environment %s' % (name)
+            else:
+                prefix = ' \'(object %s' % (name)
+            prefix += ' type %s color %s' % (match.group(2), match.group(4))
+        else:
+            prefix = ' \'(object %s' % (name)
+            if name.strip() == 'base_link':
+                prefix += ' type self'
+            else:
+                prefix += ' type empty'
+            prefix += ' color empty'
+            
+        prefix += ' role empty status empty'
+        suffix = ' xsiz %s ysiz %s zsiz %s srad %s)' % (obj.size.x, obj.size.y, obj.size.z, obj.s_radius)
+        
+        self.static_parts[name] = (prefix, suffix)
+        return self.static_parts[name]
+        
+    def poses(self, data):
+        """Position and orientation of every published body, by name."""
+        poses = {}
+        
+        for i, name in enumerate(data.name):
+            if self.body_parts(name) is None: continue
+            pos = data.pose[i].position
+            ori = data.pose[i].orientation
+            poses[name] = (pos.x, pos.y, pos.z, ori.x, ori.y, ori.z, ori.w)
+            
+        return poses
+        
+    def entries(self, data, names=None):
+        """Entries of the published bodies (only those in names if given), in message order."""
+        entries = []
+        
+        for i, name in enumerate(data.name):
+            parts = self.body_parts(name)
+            if parts is None or (names is not None and name not in names): continue
+            
+            pos = data.pose[i].position
+            ori = data.pose[i].orientation
+            lin = data.twist[i].linear
+            ang = data.twist[i].angular
+            trq = data.wrench[i].torque
+            
+            entries.append(parts[0])
+            entries.append(DYNAMIC_TEMPLATE % (pos.x, pos.y, pos.z,
+                                               ori.x, ori.y, ori.z, ori.w,
+                                               lin.x, lin.y, lin.z,
+                                               ang.x, ang.y, ang.z,
+                                               trq.x, trq.y, trq.z))
+            entries.append(parts[1])
+            
+        return entries
+        
+    def serialize(self, data, names=None):
+        return '(list' + ''.join(self.entries(data, names)) + ')'
+
+def moved_bodies(poses, last_poses, tolerance):
+    """Names of bodies that are new or moved more than tolerance since last_poses."""
+    moved = []
+    
+    for name, pose in poses.iteritems():
+        last = last_poses.get(name)
+        
+        # most bodies don't move at all, comparing the tuples is cheap
+        if pose == last: continue
+        
+        if last is None or tolerance <= 0 or max([abs(a - b) for a, b in zip(pose, last)]) > tolerance:
+            moved.append(name)
+            
+    return moved
+
 class IcarusWorldStateServer():
     def __init__(self):
         rospy.init_node(NAME, anonymous=True)
         # Set gazebo_world as None to be retrieved in handler
         self.gazebo_world = None
+        self.serializer = None
+        
+        # icarus_world_state is published at most publish_rate times per second
+        # (0 for every world state), only when some body moved more than
+        # change_tolerance (in position or orientation quaternion) and at least
+        # every keepalive seconds. With publish_delta the moved bodies alone
+        # go to icarus_world_state_delta as well
+        self.publish_rate = rospy.get_param('~publish_rate', 0.0)
+        self.change_tolerance = rospy.get_param('~change_tolerance', 0.0)
+        self.keepalive = rospy.get_param('~keepalive', 1.0)
+        self.publish_delta = rospy.get_param('~publish_delta', False)
+        
+        self.last_data = None
+        self.last_publish = 0.0
+        self.published_poses = {}
         
         # Start get_icarus_world_state service
         rospy.Service('get_icarus_world_state', IcarusWorldState, self.get_icarus_world_state_handler)
         
-        # Start gazebo_world_state subscriber
-        rospy.Subscriber('gazebo_world_state', WorldState, self.gazebo_world_state_handler)
-        
         # Start icarus_world_state publisher
         self.icarus_world_state_pub = rospy.Publisher('icarus_world_state', String)
-        self.icarus_world_state = '\'()'
+        if self.publish_delta: self.icarus_world_state_delta_pub = rospy.Publisher('icarus_world_state_delta', String)
+        # latest formatted state and the world state it came from
+        self.icarus_world_state = (None, '\'()')
+        
+        # Start gazebo_world_state subscriber
+        rospy.Subscriber('gazebo_world_state', WorldState, self.gazebo_world_state_handler)
         
     def get_icarus_world_state_handler(self, req):
-        return IcarusWorldStateResponse(self.icarus_world_state)
+        # the state is only formatted when it's published, the latest one may not have been
+        data = self.last_data
+        if data is not None and data is not self.icarus_world_state[0]:
+            self.icarus_world_state = (data, self.serializer.serialize(data))
+            
+        return IcarusWorldStateResponse(self.icarus_world_state[1])
         
     def gazebo_world_state_handler(self, data):
         # Retrieve the static world & robot descriptions once on first run
@@ -121,53 +252,36 @@ class IcarusWorldStateServer():
             robot_param = rospy.search_param('robot_description')
             robot_description = str(rospy.get_param(robot_param, ''))
             self.gazebo_world = GazeboDescriptionParser(world_description, robot_description)
+            self.serializer = IcarusStateSerializer(self.gazebo_world)
             
-        # Begin parsing icarus world state
-        icarus_state = '(list'
-        regex = re.compile('(env|obj)_(.*?)_(.*?)_(.*?)_body')
+        self.last_data = data
+        now = rospy.get_time()
+        since_publish = now - self.last_publish
         
-        for i in range(len(data.name)):
-            pos = data.pose[i].position
-            ori = data.pose[i].orientation
-            lin = data.twist[i].linear
-            ang = data.twist[i].angular
-            frc = data.wrench[i].force
-            trq = data.wrench[i].torque
+        # sim time jumped back (gazebo reset /clock), the world most likely
+        # changed with it, so publish right away and start timing from here
+        if since_publish < 0: since_publish = float('inf')
             
-            # Only publish recognizable objects from the world & robot desscriptions
-            if self.gazebo_world != None and self.gazebo_world.has_object(data.name[i].strip()):
-                match = re.search(regex, data.name[i])
-                
-                if match:
-                    if match.group(1) == 'env':
-                        icarus_state += ' \'(environment %s' % (data.name[i])
-                    else:
-                        icarus_state += ' \'(object %s' % (data.name[i])
-                    icarus_state += ' type %s' % (match.group(2))
-                    icarus_state += ' color %s' % (match.group(4))
-                else:
-                    icarus_state += ' \'(object %s' % (data.name[i])
-                    if data.name[i].strip() == 'base_link':
-                        icarus_state += ' type self'
-                    else:
-                        icarus_state += ' type empty'
-                    icarus_state += ' color empty'
-                    
-                icarus_state += ' role empty'
-                icarus_state += ' status empty'
-                icarus_state += ' xpos %s ypos %s zpos %s' % (pos.x, pos.y, pos.z)
-                icarus_state += ' xori %s yori %s zori %s wori %s' % (ori.x, ori.y, ori.z, ori.w)
-                icarus_state += ' xlin %s ylin %s zlin %s' % (lin.x, lin.y, lin.z)
-                icarus_state += ' xang %s yang %s zang %s' % (ang.x, ang.y, ang.z)
-                icarus_state += ' xtrq %s ytrq %s ztrq %s' % (trq.x, trq.y, trq.z)
-                
-                obj = self.gazebo_world.get_object(data.name[i].strip())
-                icarus_state += ' xsiz %s ysiz %s zsiz %s srad %s)' % (obj.size.x, obj.size.y, obj.size.z, obj.s_radius)
-                
-        icarus_state += ')'
-        
-        self.icarus_world_state = icarus_state
+        if self.publish_rate > 0 and since_publish < 1.0 / self.publish_rate:
+            return
+            
+        poses = self.serializer.poses(data)
+        moved = moved_bodies(poses, self.published_poses, self.change_tolerance)
+        removed = [name for name in self.published_poses if name not in poses]
+        
+        if not moved and not removed and since_publish < self.keepalive:
+            return
+            
+        icarus_state = self.serializer.serialize(data)
+        
+        self.icarus_world_state = (data, icarus_state)
         self.icarus_world_state_pub.publish(icarus_state)
+        
+        if self.publish_delta and moved:
+            self.icarus_world_state_delta_pub.publish(self.serializer.serialize(data, set(moved)))
+            
+        self.published_poses = poses
+        self.last_publish = now
 
 
 if __name__ == '__main__':